@@ -0,0 +1,56 @@
+"""Speed of the hexagon polygons of the GeoJSONHex* binds.
+
+Times the row and column implementations of GeoJSONHexFromCombinedLonLat on points that repeat on a grid, against uncached
+Geodesic.Direct solves. Their accuracy is checked by tests/test_bind.py.
+
+    python benchmarks/hexagons.py --rows 20000 --grid 500
+"""
+import time
+import random
+import argparse
+
+from geographiclib.geodesic import Geodesic
+
+from schema_grapher.util.bind import PolygonVertices, GeoJSONHexFromCombinedLonLat, GeoJSONHexFromCombinedLonLatColumn
+
+def DirectPolygon(lat, lon, numvertex, distance):
+    """Function that solves the vertices of a polygon as PolygonLonLat did before it was cached"""
+    geod = Geodesic.WGS84
+    angle = 360 / numvertex
+    coords = []
+    for i in range(numvertex-1,-1,-1):
+        vertex = geod.Direct(lat, lon, float(angle*i), distance)
+        coords += [[vertex['lon2'], vertex['lat2']]]
+    coords += [coords[0]]
+    return coords
+
+def Speed(rows, grid, seed):
+    """Function that times the hexagon bind on points that repeat on a grid of grid distinct points"""
+    r = random.Random(seed)
+    # the binds hand the first coordinate to PolygonLonLat as the latitude, so both are kept in its range
+    cells = ['{:.5f},{:.5f}'.format(r.uniform(2, 15), r.uniform(44, 55)) for _ in range(grid)]
+    batch = [[r.choice(cells)] for _ in range(rows)]
+    header = {'lonlat' : 0}
+    for name, function, data in [
+        ('row, uncached', lambda d: [DirectPolygon(float(v[0].split(',')[0]), float(v[0].split(',')[1]), 6, 500) for v in batch], {}),
+        ('row, geodesic', lambda d: [GeoJSONHexFromCombinedLonLat(d, v, header) for v in batch], {'Method' : 'geodesic'}),
+        ('column, geodesic', lambda d: GeoJSONHexFromCombinedLonLatColumn(d, batch, header), {'Method' : 'geodesic'}),
+        ('column, local', lambda d: GeoJSONHexFromCombinedLonLatColumn(d, batch, header), {'Method' : 'local'}),
+    ]:
+        PolygonVertices.cache_clear()
+        data = dict(data, LonLat = 'lonlat', Radius = 500)
+        start = time.perf_counter()
+        function(data)
+        elapsed = time.perf_counter() - start
+        print("{:18s} {:8.3f}s  {:.0f} rows/s".format(name, elapsed, rows / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Speed of the hexagon binds')
+    parser.add_argument('--rows', type = int, default = 20000)
+    parser.add_argument('--grid', type = int, default = 500, help = 'number of distinct points the rows are drawn from')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    Speed(args.rows, args.grid, args.seed)
+
+if __name__ == '__main__':
+    main()
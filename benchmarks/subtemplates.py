@@ -0,0 +1,59 @@
+"""Benchmark of subtemplate expansion on rows with wide list columns.
+
+Each row holds a list column of --width items that is split by a SplitColumn bind and expanded by a subtemplate, each item of which
+is split again and expanded by a nested subtemplate.
+
+    python benchmarks/subtemplates.py --rows 200 --width 500
+"""
+import argparse
+import time
+
+from schema_grapher.util.misc import MapHeader
+from schema_grapher.util.rdf import CompileSpec, PlanTriples, RenderTriples
+
+SPEC = {
+    "TEMPLATE": [["Event", {"GENSYM": "e", "name": ["name"], "SUBTEMPLATE_t.GENSYM_g": ["hasTag"]}]],
+    "BIND": {"BIND_tags": {"FUNCTION": "SplitColumn", "DATA": {"Column": "tags", "Delimiter": "|"}}},
+    "OPTIONS": {"HASHED_IDS": True},
+    "SUBTEMPLATES": {
+        "t": {
+            "ITERABLE": [["BIND_tags", "tag"]],
+            "TEMPLATE": [["Tag", {"GENSYM": "g", "tag": ["name"], "GENSYM_e": ["about"], "SUBTEMPLATE_p.GENSYM_h": ["hasPart"]}]],
+            "BIND": {"BIND_parts": {"FUNCTION": "SplitColumn", "DATA": {"Column": "tag", "Delimiter": "-"}}},
+            "OPTIONS": {"HASHED_IDS": True},
+            "SUBTEMPLATES": {
+                "p": {
+                    "ITERABLE": [["BIND_parts", "part"]],
+                    "TEMPLATE": [["Part", {"GENSYM": "h", "part": ["name"], "GENSYM_g": ["isPartOf"]}]],
+                    "BIND": {},
+                    "OPTIONS": {"HASHED_IDS": True}
+                }
+            }
+        }
+    }
+}
+
+def Rows(rows, width):
+    """Function that generates rows whose tags column lists width items of two parts each"""
+    for i in range(rows):
+        yield ['event ' + str(i), '|'.join('tag{}-{}'.format(i, j) for j in range(width))]
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark subtemplate expansion on wide list columns')
+    parser.add_argument('--rows', type = int, default = 200)
+    parser.add_argument('--width', type = int, default = 500)
+    args = parser.parse_args()
+
+    plan = CompileSpec(SPEC, MapHeader(['name', 'tags']))
+    triplecount = 0
+    size = 0
+    start = time.perf_counter()
+    for cnt, row in enumerate(Rows(args.rows, args.width)):
+        triples = PlanTriples(plan, row, 'bench_0.nt', cnt, {})
+        triplecount += len(triples)
+        size += len(RenderTriples(triples))
+    elapsed = time.perf_counter() - start
+    print("rows {} width {}: {:.2f}s, {:.0f} rows/s, {:.0f} triples/s, {} triples, {} bytes".format(args.rows, args.width, elapsed, args.rows / elapsed, triplecount / elapsed, triplecount, size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""Benchmark suite of the parsers and the hot functions of the conversion on synthetic data.
+
+Times ParseConfigSingle and ParseConfigMulti on a CSV written by synthetic.py and micro-benchmarks of RowTriples, ParseDatum, WrapDQ
+and DeterministicGensym, and writes rows/s, triples/s and peak RSS of every case to a JSON file. Every parser case runs in its own
+process so its peak RSS is its own. Pass the file of an earlier run with --compare to print the speedup of every case.
+
+The import cases time importing each parser in a fresh interpreter with -X importtime. The suite exits with an error when a parser
+imports one of the HEAVY modules, whose subsystems are only loaded once a run needs them, or takes longer than --import-budget.
+
+    python benchmarks/suite.py --rows 20000 --output results.json
+    python benchmarks/suite.py --rows 20000 --output new.json --compare results.json
+    python benchmarks/suite.py --cases import --import-budget 150
+"""
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import Synthetic, StartStubGeocoder, Rows, Header, Spec, ParseList, COLUMNS, BINDS, IDS
+import schema_grapher
+from schema_grapher.util.misc import MapHeader
+from schema_grapher.util.memory import PeakRSS
+from schema_grapher.util.rdf import RowTriples, ParseDatum, WrapDQ, DeterministicGensym, CompileGensymOrder, PropertyType
+
+# third party and slow standard library modules that importing a parser must not load
+HEAVY = ('dateutil', 'geographiclib', 'rdflib', 'boto3', 'botocore', 'sqlite3', 'http.client', 'urllib.request', 'concurrent.futures')
+
+def ParserCase(mode, configfile, results):
+    """Function that runs a parser on a config in a child process and sends back its time and peak memory"""
+    from schema_grapher.parser.single import ParseConfigSingle
+    from schema_grapher.parser.multiprocess import ParseConfigMulti
+    start = time.perf_counter()
+    if mode == 'single':
+        ParseConfigSingle(configfile)
+    else:
+        ParseConfigMulti(configfile)
+    results.put((time.perf_counter() - start, PeakRSS(), PeakRSS(children = True)))
+
+def RunParser(mode, configfile, rows):
+    """Function that times a parser on a config and returns its result"""
+    config = json.load(open(configfile))
+    shutil.rmtree(config['OUTPUTDIR'], ignore_errors = True)
+    os.makedirs(config['OUTPUTDIR'])
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target = ParserCase, args = (mode, configfile, results))
+    p.start()
+    p.join()
+    if p.exitcode != 0:
+        raise Exception("The {} parser failed on {}".format(mode, configfile))
+    seconds, peak, workers = results.get()
+    triples = 0
+    for path in glob.glob(os.path.join(config['OUTPUTDIR'], '*.nt')):
+        with open(path) as f:
+            triples += sum(1 for line in f if line.strip() != '')
+    return {'name' : 'Parse' + ('ConfigSingle' if mode == 'single' else 'ConfigMulti'), 'seconds' : seconds, 'rows' : rows, 'triples' : triples,
+            'rows_per_second' : rows / seconds, 'triples_per_second' : triples / seconds, 'peak_rss_mb' : peak, 'peak_worker_rss_mb' : workers if mode == 'multi' else None}
+
+def ImportTimes(module):
+    """Function that imports a module in a fresh interpreter with -X importtime and returns the cumulative microseconds of every module it imported"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(schema_grapher.__file__)))
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([root] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p != '']))
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], env = env, capture_output = True, text = True, check = True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(cumulative)
+    return times
+
+def ImportCase(module, repeat = 5):
+    """Function that times importing a module, keeping the best of repeat fresh interpreters, and returns its result with the HEAVY modules it loaded"""
+    runs = [ImportTimes(module) for _ in range(repeat)]
+    seconds = min(t[module] for t in runs) / 1e6
+    return {'name' : 'Import.' + module, 'seconds' : seconds, 'heavy_modules' : [m for m in HEAVY if m in runs[0]]}
+
+def Micro(name, function, items, repeat = 5):
+    """Function that times function on every item, keeping the best of repeat runs, and returns its result"""
+    best = min(timeit.repeat(lambda: [function(i) for i in items], number = 1, repeat = repeat))
+    return {'name' : name, 'seconds' : best, 'calls' : len(items), 'calls_per_second' : len(items) / best, 'peak_rss_mb' : PeakRSS()}
+
+def MicroBenchmarks(args, configfile):
+    """Function that runs the micro-benchmarks on rows of the synthetic data"""
+    config = json.load(open(configfile))
+    pt = PropertyType(config['SCHEMA'])
+    header = Header(args.columns, args.binds, False)
+    rows = list(Rows(header, min(args.rows, 2000), args.seed, args.width))
+    headermap = MapHeader(header)
+    spec = Spec(args.columns, args.binds, args.ids)
+    results = []
+    deterministic = args.ids if args.ids in ('GLOBAL', 'FILE') else None
+    results += [Micro('RowTriples', lambda r: RowTriples(spec, headermap, r[1], 'bench_0.nt', r[0], pt, deterministic = deterministic), list(enumerate(rows)))]
+    results[-1]['rows_per_second'] = results[-1].pop('calls_per_second')
+    for column in args.columns:
+        name, prop, ptype = COLUMNS[column]
+        if 'ParseDatum.' + ptype not in [r['name'] for r in results]:
+            results += [Micro('ParseDatum.' + ptype, lambda d: ParseDatum(prop, d, pt), [r[headermap[name]] for r in rows])]
+    results += [Micro('WrapDQ', WrapDQ, [v for r in rows for v in r])]
+    template = [['Event', {'GENSYM' : 'e', 'name' : ['name'], 'GENSYM_o' : ['organizer']}], ['Org', {'GENSYM' : 'o', 'code' : ['code']}]]
+    order = CompileGensymOrder(template)
+    ids = MapHeader(['name', 'code'])
+    results += [Micro('DeterministicGensym', lambda r: DeterministicGensym('GLOBAL', r, ids, order, 'bench_0.nt'), [['event ' + str(i), 'C' + str(i)] for i in range(len(rows))])]
+    return results
+
+def Compare(results, parameters, previous):
+    """Function that prints the speedup of every case over the same case of an earlier run"""
+    earlier = {r['name'] : r for r in previous['results']}
+    if previous.get('parameters') != parameters:
+        print("The runs were made with different parameters, their times are not comparable")
+    for r in results:
+        if r['name'] in earlier:
+            print("{:32s} {:8.3f}s -> {:8.3f}s  {:.2f}x".format(r['name'], earlier[r['name']]['seconds'], r['seconds'], earlier[r['name']]['seconds'] / r['seconds']))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the parsers and hot functions of Schema Grapher on synthetic data')
+    parser.add_argument('--rows', type = int, default = 20000)
+    parser.add_argument('--columns', type = lambda v: ParseList(v, COLUMNS), default = tuple(COLUMNS.keys()))
+    parser.add_argument('--binds', type = lambda v: ParseList(v, BINDS), default = tuple(BINDS.keys()))
+    parser.add_argument('--ids', choices = IDS, default = 'NONE')
+    parser.add_argument('--geolookup', action = 'store_true', help = 'geolocate addresses against a local stub geocoder')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--width', type = int, default = 3)
+    parser.add_argument('--chunksize', type = int, default = 5000)
+    parser.add_argument('--threads', type = int, default = 4)
+    parser.add_argument('--cases', type = lambda v: ParseList(v, ('single', 'multi', 'micro', 'import')), default = ('single', 'multi', 'micro', 'import'))
+    parser.add_argument('--import-budget', type = float, default = None, help = 'milliseconds importing a parser may take')
+    parser.add_argument('--directory', default = None, help = 'where the synthetic data is written (default a temporary directory)')
+    parser.add_argument('--output', default = 'benchmark.json')
+    parser.add_argument('--compare', default = None, help = 'results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    directory = args.directory if args.directory is not None else tempfile.mkdtemp(prefix = 'schema_grapher_bench_')
+    geocoder = StartStubGeocoder() if args.geolookup else None
+    configfile = Synthetic(directory, args.rows, args.columns, args.binds, args.ids, args.geolookup, args.seed, args.width, args.chunksize, args.threads, geocoder)
+
+    results = []
+    for mode in ('single', 'multi'):
+        if mode in args.cases:
+            results += [RunParser(mode, configfile, args.rows)]
+    if 'micro' in args.cases:
+        results += MicroBenchmarks(args, configfile)
+    if 'import' in args.cases:
+        results += [ImportCase('schema_grapher.parser.' + mode) for mode in ('single', 'multiprocess')]
+    for r in results:
+        print("{:32s} {:8.3f}s".format(r['name'], r['seconds']) + "".join("  {:.0f} {}".format(r[k], k.replace('_', ' ')) for k in ('rows_per_second', 'triples_per_second', 'calls_per_second') if k in r))
+
+    parameters = {k : list(v) if type(v) is tuple else v for k, v in vars(args).items() if k not in ('output', 'compare', 'directory', 'import_budget')}
+    report = {
+        'created' : time.time(),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'parameters' : parameters,
+        'results' : results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 2)
+    if args.compare is not None:
+        Compare(results, parameters, json.load(open(args.compare)))
+    if args.directory is None:
+        shutil.rmtree(directory, ignore_errors = True)
+    regressions = ["{} loads {}".format(r['name'], ', '.join(r['heavy_modules'])) for r in results if r['name'].startswith('Import.') and len(r['heavy_modules']) > 0]
+    if args.import_budget is not None:
+        regressions += ["{} takes {:.1f}ms".format(r['name'], r['seconds'] * 1000) for r in results if r['name'].startswith('Import.') and r['seconds'] * 1000 > args.import_budget]
+    if len(regressions) > 0:
+        sys.exit("Import time regressions: " + "; ".join(regressions))
+
+if __name__ == '__main__':
+    main()
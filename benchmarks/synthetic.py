@@ -0,0 +1,200 @@
+"""Deterministic generator of synthetic CSVs with a matching annotation spec, schema and config.
+
+The same arguments always produce the same files, so runs of the benchmark suite on different versions parse identical data.
+
+    python benchmarks/synthetic.py /tmp/synthetic --rows 100000 --binds hex,split,offset --ids GLOBAL
+"""
+import os
+import json
+import random
+import argparse
+import datetime
+import threading
+import http.server
+import urllib.parse
+
+RDFNS = 'http://schema.localhost/'
+
+# column name, property and schema datatype of every column type
+COLUMNS = {
+    'string' : ('name', 'name', 'String'),
+    'text' : ('code', 'code', 'Text'),
+    'decimal' : ('score', 'score', 'Decimal'),
+    'integer' : ('count', 'count', 'Integer'),
+    'boolean' : ('flag', 'active', 'Boolean'),
+    'date' : ('date', 'startDate', 'DateTime'),
+    'lonlat' : ('lonlat', 'point', 'Text'),
+}
+
+# bind name, bind, the columns it needs and the property and schema datatype of its value
+BINDS = {
+    'hex' : ('BIND_hex', {'FUNCTION' : 'GeoJSONHexFromCombinedLonLat', 'DATA' : {'LonLat' : 'lonlat', 'Radius' : 500}}, ['lonlat'], 'area', 'GeoJSON'),
+    'offset' : ('BIND_end', {'FUNCTION' : 'OffsetDate', 'DATA' : {'DateCol' : 'date', 'Offset' : 3600}}, ['date'], 'endDate', 'DateTime'),
+    'split' : ('BIND_tags', {'FUNCTION' : 'SplitColumn', 'DATA' : {'Column' : 'tags', 'Delimiter' : '|'}}, ['tags'], None, None),
+}
+
+IDS = ('NONE', 'HASHED', 'GLOBAL', 'FILE')
+
+CITIES = [('Richland', 'WA'), ('Kennewick', 'WA'), ('Pasco', 'WA'), ('Portland', 'OR'), ('Boise', 'ID'), ('Spokane', 'WA'), ('Seattle', 'WA'), ('Eugene', 'OR')]
+STREETS = ['Main St', 'George Washington Way', 'Stevens Dr', 'Jadwin Ave', 'Columbia Point Dr', 'Lee Blvd']
+
+def Header(columns, binds, geolookup):
+    """Function that returns the header of a synthetic CSV"""
+    header = ['id'] + [COLUMNS[c][0] for c in columns]
+    for b in binds:
+        header += [k for k in BINDS[b][2] if k not in header]
+    if geolookup:
+        header += ['street', 'city', 'state']
+    return header
+
+def Rows(header, rows, seed = 0, width = 3):
+    """Function that yields the rows of a synthetic CSV, the values are drawn from a generator seeded with seed and list columns hold up to width items"""
+    r = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    for i in range(rows):
+        city, state = r.choice(CITIES)
+        values = {
+            'id' : str(i),
+            'name' : 'event {} "{}"'.format(i, r.choice(STREETS)) if r.random() < 0.1 else 'event ' + str(i),
+            'code' : ''.join(r.choice('ABCDEFGHJKLMNPQRSTUVWXYZ') for _ in range(6)),
+            'score' : '{:.3f}'.format(r.uniform(0, 100)) if r.random() < 0.95 else 'n/a',
+            'count' : str(r.randint(0, 10000)),
+            'flag' : r.choice(['true', 'false']),
+            'date' : (start + datetime.timedelta(seconds = r.randint(0, 3 * 365 * 86400))).strftime('%Y-%m-%d %H:%M:%S'),
+            'lonlat' : '{:.5f},{:.5f}'.format(r.uniform(-124, -117), r.uniform(42, 49)),
+            'tags' : '|'.join('tag{}'.format(r.randint(0, 99)) for _ in range(r.randint(1, width))),
+            'street' : '{} {}'.format(r.randint(1, 9999), r.choice(STREETS)),
+            'city' : city,
+            'state' : state,
+        }
+        yield [values[k] for k in header]
+
+def Spec(columns, binds, ids = 'NONE', geolookup = False):
+    """Function that returns the annotation spec of a synthetic CSV"""
+    event = {'GENSYM' : 'e'}
+    spec = {'TEMPLATE' : [['Event', event]], 'BIND' : {}, 'OPTIONS' : {}}
+    for c in columns:
+        event[COLUMNS[c][0]] = [COLUMNS[c][1]]
+    for b in binds:
+        name, bind, needs, prop, ptype = BINDS[b]
+        spec['BIND'][name] = bind
+        if prop is not None:
+            event[name] = [prop]
+    if 'split' in binds and ids in ('GLOBAL', 'FILE'):
+        # deterministic IDs are derived within a template and cannot follow a subtemplate, so the items become values of the row instead
+        event['BIND_tags'] = ['tag']
+    elif 'split' in binds:
+        event['SUBTEMPLATE_t.GENSYM_g'] = ['hasTag']
+        spec['SUBTEMPLATES'] = {'t' : {
+            'ITERABLE' : [['BIND_tags', 'tag']],
+            'TEMPLATE' : [['Tag', {'GENSYM' : 'g', 'tag' : ['name'], 'GENSYM_e' : ['about']}]],
+            'BIND' : {},
+            'OPTIONS' : {},
+        }}
+    if geolookup:
+        event['GENSYM_l'] = ['location']
+        spec['TEMPLATE'] += [['AddressLocation', {'GENSYM' : 'l', 'street' : ['locationStreet'], 'city' : ['locationCity'], 'state' : ['locationState']}]]
+        spec['OPTIONS']['GEOLOOKUP'] = True
+    if ids == 'HASHED':
+        spec['OPTIONS']['HASHED_IDS'] = True
+        for s in spec.get('SUBTEMPLATES', {}).values():
+            s['OPTIONS']['HASHED_IDS'] = True
+    return spec
+
+def Schema(columns, binds):
+    """Function that returns the schema JSON-LD typing the properties of a synthetic spec"""
+    types = {'name' : 'String', 'tag' : 'String', 'location' : 'Text', 'hasTag' : 'Text', 'about' : 'Text'}
+    for c in columns:
+        types[COLUMNS[c][1]] = COLUMNS[c][2]
+    for b in binds:
+        if BINDS[b][3] is not None:
+            types[BINDS[b][3]] = BINDS[b][4]
+    return {'@graph' : [{'@id' : RDFNS + p, '@type' : 'rdf:Property', RDFNS + 'rangeIncludes' : {'@id' : RDFNS + t}} for p, t in sorted(types.items())]}
+
+def Synthetic(directory, rows = 10000, columns = tuple(COLUMNS.keys()), binds = tuple(BINDS.keys()), ids = 'NONE', geolookup = False, seed = 0, width = 3, chunksize = 10000, threads = 4, geocoder = None):
+    """Function that writes a synthetic CSV, its spec and schema and a config parsing it to directory, and returns the path of the config. The outputs of a run go to the out folder of directory and are not uploaded."""
+    if ids not in IDS:
+        raise Exception("Unknown ID mode: " + str(ids))
+    os.makedirs(os.path.join(directory, 'out'), exist_ok = True)
+    header = Header(columns, binds, geolookup)
+    with open(os.path.join(directory, 'data.csv'), 'w', newline = '') as f:
+        f.write(','.join(header) + '\n')
+        for row in Rows(header, rows, seed, width):
+            f.write(','.join('"' + v.replace('"', '""') + '"' if ',' in v or '"' in v else v for v in row) + '\n')
+    with open(os.path.join(directory, 'spec.json'), 'w') as f:
+        json.dump(Spec(columns, binds, ids, geolookup), f, indent = 2)
+    with open(os.path.join(directory, 'schema.jsonld'), 'w') as f:
+        json.dump(Schema(columns, binds), f, indent = 2)
+    config = {
+        'FILES' : [{'FILE' : os.path.join(directory, 'data.csv'), 'SPEC' : os.path.join(directory, 'spec.json')}],
+        'SCHEMA' : os.path.join(directory, 'schema.jsonld'),
+        'OUTPUTDIR' : os.path.join(directory, 'out'),
+        'S3_FOLDER' : '',
+        'UPLOAD_BACKEND' : 'none',
+        'UPLOAD_MANIFEST' : None,
+        'CHUNKSIZE' : chunksize,
+        'THREADS' : threads,
+        'DETERMINISTIC_IDS' : ids if ids in ('GLOBAL', 'FILE') else 'NONE',
+    }
+    if geocoder is not None:
+        config['GEOCODER'] = geocoder
+        config['GEOCODER_RATE'] = 0
+    with open(os.path.join(directory, 'config.json'), 'w') as f:
+        json.dump(config, f, indent = 2)
+    return os.path.join(directory, 'config.json')
+
+class StubGeocoder(http.server.BaseHTTPRequestHandler):
+    """Local nominatim stub answering every search with a point in the queried city"""
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately, so small responses would otherwise wait on delayed acknowledgements
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        city = query.get('city', [''])[0]
+        feature = {
+            'type' : 'Feature',
+            'properties' : {'place_rank' : 30, 'display_name' : city, 'address' : {'road' : query.get('street', [''])[0], 'city' : city, 'state' : query.get('state', [''])[0], 'country' : 'US'}},
+            'geometry' : {'type' : 'Point', 'coordinates' : [-119.3, 46.2]},
+        }
+        body = json.dumps({'type' : 'FeatureCollection', 'features' : [feature]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def StartStubGeocoder():
+    """Function that serves the stub geocoder on a local port in the background and returns its URL"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubGeocoder)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+def ParseList(value, choices):
+    """Function that parses a comma separated list of choices from the command line"""
+    items = [v for v in value.split(',') if v != '']
+    for v in items:
+        if v not in choices:
+            raise argparse.ArgumentTypeError("{} is not one of {}".format(v, ', '.join(choices)))
+    return tuple(items)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Write a synthetic CSV with a matching spec, schema and config')
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type = int, default = 10000)
+    parser.add_argument('--columns', type = lambda v: ParseList(v, COLUMNS), default = tuple(COLUMNS.keys()), help = 'comma separated column types: ' + ', '.join(COLUMNS))
+    parser.add_argument('--binds', type = lambda v: ParseList(v, BINDS), default = tuple(BINDS.keys()), help = 'comma separated bind functions: ' + ', '.join(BINDS))
+    parser.add_argument('--ids', choices = IDS, default = 'NONE')
+    parser.add_argument('--geolookup', action = 'store_true', help = 'add an AddressLocation template, the GEOCODER of the config is left to be set')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--width', type = int, default = 3, help = 'maximum number of items of the split list column')
+    parser.add_argument('--chunksize', type = int, default = 10000)
+    parser.add_argument('--threads', type = int, default = 4)
+    args = parser.parse_args()
+    print(Synthetic(args.directory, args.rows, args.columns, args.binds, args.ids, args.geolookup, args.seed, args.width, args.chunksize, args.threads))
+
+if __name__ == '__main__':
+    main()
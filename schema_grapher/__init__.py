@@ -1,5 +1,32 @@
 import logging
-import schema_grapher.parser
-import schema_grapher.util
+import importlib
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s', level=logging.INFO)
 
+def LazyExports(package, modules):
+    """Function that returns the module __getattr__ of a package that exports the names of its modules, importing a module only when one of its names is first used. The modules are listed in order of precedence, as the last of a series of star imports. Its __all__ is built from the modules when first asked for, so a star import of the package imports all of them."""
+    exports = []
+
+    def __getattr__(name):
+        if name == '__all__':
+            if len(exports) == 0:
+                for m in modules:
+                    module = importlib.import_module(package + '.' + m)
+                    names = getattr(module, '__all__', [n for n in vars(module) if not n.startswith('_')])
+                    exports.extend(n for n in names if n not in exports)
+                exports.extend(m for m in modules if m not in exports)
+            return exports
+        if name in modules:
+            return importlib.import_module(package + '.' + name)
+        if not name.startswith('_'):
+            for m in modules:
+                module = importlib.import_module(package + '.' + m)
+                if hasattr(module, name):
+                    return getattr(module, name)
+        raise AttributeError("module {!r} has no attribute {!r}".format(package, name))
+    return __getattr__
+
+def __getattr__(name):
+    # the parsers and their subsystems are imported when a run first uses them, not with the package
+    if name in ('parser', 'util'):
+        return importlib.import_module('schema_grapher.' + name)
+    raise AttributeError("module 'schema_grapher' has no attribute {!r}".format(name))
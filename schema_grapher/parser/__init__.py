@@ -1,2 +1,3 @@
-from schema_grapher.parser.single import *
-from schema_grapher.parser.multiprocess import *
+from schema_grapher import LazyExports
+
+__getattr__ = LazyExports('schema_grapher.parser', ('stream', 'multiprocess', 'single'))
@@ -1,90 +1,253 @@
-import time
 import os
+import queue
+import functools
 import multiprocessing
 import json
-from socket import error as SocketError
 import csv
 import logging
 
-from schema_grapher.util import ReadCSV, MapHeader
-from schema_grapher.util import ProcessParser
-from schema_grapher.util.rdf import PropertyType
-from schema_grapher.util.s3 import S3
+from schema_grapher.util.geocache import GeoCacheFromConfig, GetGeoCache, SetGeoCache
+from schema_grapher.util.geobatch import GeocoderFromConfig, GetGeocoder, SetGeocoder
+from schema_grapher.util.misc import ReadCSV, ReadCSVHeader, ReadCSVRange, CSVRecordStarts, MapHeader
+from schema_grapher.util.rdf import PropertyType, CompileSpec, ProcessPlan
+from schema_grapher.util.schema import PropertyTypes
+from schema_grapher.util.output import OutputName, UploaderFromConfig, ObjectName, PartitionCountsName, SubmitPartitions
+from schema_grapher.util.sparql import GraphStoreFromConfig
+from schema_grapher.util.dedup import DedupIndexFromConfig
+from schema_grapher.util.checkpoint import CheckpointFromConfig
+from schema_grapher.util.memory import MemoryBudget, RowsSize
+from schema_grapher.util.metrics import MetricsFromConfig, GetMetrics, SetMetrics, StartProfile, StopProfile
 
 logger = logging.getLogger(__name__)
 
-def ParseConfigMulti(configfile):
-    """Reads in a config file and processes the specification in multiple threads"""
-    processes = []
+def ChunkWorker(config, files, pt, jobs, results, geocache = None, geocoder = None, index = None, store = None):
+    """Long lived worker that parses chunks of any entry of FILES from the job queue until it receives None, the spec of an entry is compiled the first time the worker receives one of its chunks. With METRICS set the metrics of every chunk are sent back with its result."""
+    SetMetrics(MetricsFromConfig(config))
+    profile = StartProfile(config)
+    if geocache is not None:
+        SetGeoCache(geocache)
+    if geocoder is not None:
+        SetGeocoder(geocoder)
+    plans = {}
+    job = jobs.get()
+    while job is not None:
+        n, fname, source, offset, chunknames = job
+        try:
+            if n not in plans:
+                spec, header = files[n]
+                plans[n] = CompileSpec(spec, header, deterministic = config['DETERMINISTIC_IDS'], idhash = config.get('DETERMINISTIC_HASH'))
+            # a source is either a list of rows or a (path, start, end) byte range to parse locally
+            rows = ReadCSVRange(*source) if type(source) is tuple else source
+            if type(source) is tuple and GetMetrics() is not None:
+                rows = GetMetrics().iterate('read', rows)
+            rowcount, triplecount, dropped = ProcessPlan(fname, plans[n], rows, offset, pt, config['DETERMINISTIC_IDS'], chunknames, config.get('OUTPUT_COMPRESSION'), config.get('OUTPUT_BUFFER', 1 << 20), config.get('DEDUP'), index, partitions = config.get('PARTITIONS'), store = store)
+            results.put((n, fname, OutputName(fname, config.get('OUTPUT_COMPRESSION')), offset, rowcount, triplecount, dropped, None, GetMetrics().take() if GetMetrics() is not None else None))
+        except Exception as e:
+            logger.error("Failed to parse chunk " + fname, exc_info=e)
+            if GetMetrics() is not None:
+                GetMetrics().count('chunk_failures')
+            results.put((n, fname, None, offset, 0, 0, 0, repr(e), GetMetrics().take() if GetMetrics() is not None else None))
+        job = jobs.get()
+    if store is not None:
+        store.close()
+    StopProfile(config, profile, 'worker_' + str(os.getpid()))
+
+def ChunkFinished(config, run, result):
+    """Handles the completion report of a chunk by logging it and the progress of its file, adding it to the totals of the run and queueing the output file for upload, after which the chunk is checkpointed"""
+    n, fname, output, offset, rowcount, triplecount, dropped, error, metrics = result
+    if metrics is not None:
+        GetMetrics().merge(metrics)
+    inputfile = config['FILES'][n]['FILE']
+    progress = run['files'][n]
+    if error is not None:
+        logger.error("Chunk {} failed: {}".format(fname, error))
+        progress['failed'] += 1
+    else:
+        logger.info("Finished {}: {} rows, {} triples".format(output, rowcount, triplecount))
+        progress['done'] += 1
+        progress['rows'] += rowcount
+        progress['triples'] += triplecount
+        run['rows'] += rowcount
+        run['triples'] += triplecount
+        run['dropped'] += dropped
+
+        if run['store'] is not None:
+            # the triples of the chunk are already loaded, there is no file to upload
+            run['checkpoint'].done(inputfile, fname, run['store'].endpoint, offset, rowcount, triplecount)
+            FileProgress(inputfile, progress)
+            return
+        if config.get('PARTITIONS') is not None:
+            # the pieces of a chunk stay local until the partitions are merged at the end of the run
+            run['checkpoint'].done(inputfile, fname, PartitionCountsName(fname), offset, rowcount, triplecount)
+            FileProgress(inputfile, progress)
+            return
+        # uploads run in the background so they overlap the parsing of later chunks
+        run['uploader'].submit(output, ObjectName(config, output), functools.partial(run['checkpoint'].done, inputfile, fname, output, offset, rowcount, triplecount))
+    FileProgress(inputfile, progress)
+
+def FileProgress(inputfile, progress):
+    """Logs how many of the chunks queued for a file are finished, and the totals of the file once all of them are"""
+    finished = progress['done'] + progress['failed']
+    if progress['total'] is None:
+        logger.info("{}: {} of {}+ chunks finished".format(inputfile, finished, progress['queued']))
+    elif finished < progress['total']:
+        logger.info("{}: {} of {} chunks finished".format(inputfile, finished, progress['total']))
+    elif progress['failed'] > 0:
+        logger.error("Finished {} with {} failed chunks: {} rows, {} triples".format(inputfile, progress['failed'], progress['rows'], progress['triples']))
+    else:
+        logger.info("Finished {}: {} rows, {} triples".format(inputfile, progress['rows'], progress['triples']))
+
+def CollectResults(config, run, results, workers, pending, block = False, until = 0):
+    """Collects chunk completion reports from the workers, waiting until no more than until chunks are pending when block is set, and returns the number still pending"""
+    while pending > until:
+        try:
+            result = results.get(block, 5)
+        except queue.Empty:
+            if block and not any(w.is_alive() for w in workers):
+                logger.error("All workers exited with {} chunks outstanding".format(pending))
+                return 0
+            if block:
+                continue
+            return pending
+        ChunkFinished(config, run, result)
+        pending -= 1
+    return pending
+
+def Backpressure(config, run, results, workers, pending):
+    """Waits for chunks in flight to finish while another one would not fit in the MAX_MEMORY_MB budget, and returns the number still pending"""
+    while run['budget'].wait(pending, [w.pid for w in workers]):
+        pending = CollectResults(config, run, results, workers, pending, block = True, until = pending - 1)
+    return pending
+
+def ParseConfigMulti(configfile, metrics = None, profile = None, shard = None):
+    """Reads in a config file and processes the specification in multiple threads. The chunks of every file are parsed by one pool of THREADS workers, the files are read largest first. The metrics directory, profile flag and K/N shard override METRICS, METRICS_PROFILE and SHARD."""
     config = json.load(open(configfile))
     for k,v in dict(os.environ).items():
         try:
             config[k] = json.loads(v)
         except:
             config[k] = v
+    if metrics is not None:
+        config['METRICS'] = metrics
+    if profile is not None:
+        config['METRICS_PROFILE'] = profile
+    if shard is not None:
+        config['SHARD'] = shard
+    SetMetrics(MetricsFromConfig(config))
+    parentprofile = StartProfile(config)
+    SetGeoCache(GeoCacheFromConfig(config))
+    SetGeocoder(GeocoderFromConfig(config))
+    GetGeocoder().limiter.share()
+    run = {'uploader' : UploaderFromConfig(config), 'index' : DedupIndexFromConfig(config), 'checkpoint' : CheckpointFromConfig(config), 'store' : GraphStoreFromConfig(config), 'files' : {}, 'chunks' : {}, 'rows' : 0, 'triples' : 0, 'dropped' : 0, 'budget' : MemoryBudget(config.get('MAX_MEMORY_MB'))}
     if 'SCHEMA' in list(config.keys()):
-        pt = PropertyType(config['SCHEMA'])
+        pt = PropertyType(config['SCHEMA'], config.get('SCHEMA_CACHE'), config.get('SCHEMA_REFRESH', 3600), config.get('SCHEMA_TIMEOUT', 30))
     else:
-        pt = {}
-    for i in config['FILES']:
+        pt = PropertyTypes()
+
+    # the spec and header of every file are read once up front and handed to all workers
+    files = {}
+    starts = {}
+    for n, i in enumerate(config['FILES']):
         if os.path.exists(i['FILE']) and os.path.exists(i['SPEC']):
-            logger.info("Parsing " + i['FILE'])
             spec = json.load(open(i['SPEC']))
-            t = ReadCSV(i['FILE'])
-            fileprefix = i['FILE'].split(os.sep)[-1].split('.')[0]
-            th = MapHeader(next(t))
+            run['checkpoint'].begin(config, i, spec, pt)
+            if run['checkpoint'].complete(i['FILE']):
+                run['chunks'][n] = run['checkpoint'].chunks(i['FILE'])
+                continue
+            if config.get('BYTE_RANGES') == True:
+                starts[n] = CSVRecordStarts(i['FILE'], config['CHUNKSIZE'])
+            # only the header is read, from a file that is closed again at once
+            th = MapHeader(ReadCSVHeader(i['FILE']))
+            # compiled here only to reject a spec the workers could not compile before any of them start
+            CompileSpec(spec, th, deterministic = config['DETERMINISTIC_IDS'], idhash = config.get('DETERMINISTIC_HASH'))
+            files[n] = (spec, th)
+        else:
+            if not os.path.exists(i['FILE']):
+                logger.error("File not found: " + i['FILE'])
+            if not os.path.exists(i['SPEC']):
+                logger.error("File not found: " + i['SPEC'])
+    if len(files) == 0:
+        if config.get('PARTITIONS') is not None:
+            SubmitPartitions(config, run['uploader'], [c for n in sorted(run['chunks'].keys()) for c in run['chunks'][n]])
+        run['uploader'].close()
+        StopProfile(config, parentprofile, 'parent')
+        return
 
-            row = next(t, None)
-            rowcount = 0
-            rows = []
-            trows = []
+    # the bounded job queue blocks the reader when the workers fall behind
+    jobs = multiprocessing.Queue(2 * config['THREADS'])
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=ChunkWorker, args=(config, files, pt, jobs, results, GetGeoCache(), GetGeocoder(), run['index'], run['store'])) for _ in range(config['THREADS'])]
+    for w in workers:
+        w.start()
+
+    pending = 0
+    # the largest files are queued first so they do not hold up the end of the run
+    for n in sorted(files.keys(), key = lambda n: os.path.getsize(config['FILES'][n]['FILE']), reverse = True):
+        i = config['FILES'][n]
+        logger.info("Parsing " + i['FILE'])
+        progress = run['files'][n] = {'queued' : 0, 'total' : None, 'done' : 0, 'failed' : 0, 'rows' : 0, 'triples' : 0}
+        chunks = run['chunks'][n] = []
+        fileprefix = i['FILE'].split(os.sep)[-1].split('.')[0]
+        if config.get('BYTE_RANGES') == True:
+            # the rows of every slice were counted when the file was split, so each worker is handed its global row offset
+            ranges = list(zip(starts[n][0][:-1], starts[n][0][1:]))
+            offset = 0
+            for fcount, (s, e) in enumerate(ranges):
+                fname = os.path.join(config['OUTPUTDIR'], fileprefix + '_' + str(fcount) + '.nt')
+                chunks += [fname]
+                if run['checkpoint'].owns(i['FILE'], fcount) and not run['checkpoint'].finished(i['FILE'], fname, offset):
+                    # a worker holds the rows of its slice, which take about four times the bytes they were read from
+                    run['budget'].observe(4 * (e - s) / 1024.0 / 1024.0)
+                    pending = Backpressure(config, run, results, workers, pending)
+                    jobs.put((n, fname, (i['FILE'], s, e), offset, (fileprefix, config['CHUNKSIZE'])))
+                    progress['queued'] += 1
+                    pending += 1
+                offset += starts[n][1][fcount]
+                pending = CollectResults(config, run, results, workers, pending)
+            fcount = len(ranges)
+        else:
+            t = ReadCSV(i['FILE'])
+            if GetMetrics() is not None:
+                t = GetMetrics().iterate('read', t)
+            next(t)
             fcount = 0
+            rows = []
+            row = next(t, None)
             while row != None:
                 rows += [row]
-                if rowcount >= config['CHUNKSIZE']:
-                    trows += [rows]
-                    rows = []
-                    rowcount = -1
-                rowcount += 1
-
                 row = next(t, None)
-                if row == None:
-                    trows += [rows]
-
-                while len(trows) > 0:
-                    job = trows.pop(0)
+                if len(rows) > config['CHUNKSIZE'] or row == None:
                     fname = os.path.join(config['OUTPUTDIR'], fileprefix + '_' + str(fcount) + '.nt')
+                    offset = fcount * (config['CHUNKSIZE'] + 1)
+                    chunks += [fname]
+                    if run['checkpoint'].owns(i['FILE'], fcount) and not run['checkpoint'].finished(i['FILE'], fname, offset):
+                        # the rows are held by the parent, pickled through the job queue and unpickled by a worker
+                        run['budget'].observe(3 * RowsSize(rows))
+                        pending = Backpressure(config, run, results, workers, pending)
+                        jobs.put((n, fname, rows, offset, None))
+                        progress['queued'] += 1
+                        pending += 1
                     fcount += 1
-                    offset = (fcount-1) * config['CHUNKSIZE'] + (fcount-1)
-                    process = multiprocessing.Process(target=ProcessParser, args = (fname, spec.copy(), th.copy(), job.copy(), offset, pt, config['DETERMINISTIC_IDS']))
-                    processes.append(process)
-                    process.start()
-                    waiting = True
-                    while waiting:
-                        time.sleep(1)
-                        alivecount = 0
-                        for i in range(len(processes)):
-                            process = processes.pop(0)
-                            if process.is_alive() == False:
-                                process.join(5)
-                            else:
-                                alivecount += 1
-                                processes.append(process)
-
-                        if alivecount < config['THREADS']:
-                            waiting = False
-
-                    # prepend S3 folder structure to filename with path removed
-                    s3_obj_name = config['S3_FOLDER'] + os.path.split(fname)[1]
-
-                    # Connect to AWS S3 and Upload
-                    logger.info("Connecting to AWS S3.")
-                    sss = S3()
-                    logger.info("Uploading {} to S3".format(s3_obj_name))
-                    sss.upload_file(fname, s3_obj_name, zip=True)
-        else:
-            if not os.path.exists(i['FILE']):
-                logger.error("File not found: " + i['FILE'])
-            if not os.path.exists(i['SPEC']):
-                logger.error("File not found: " + i['SPEC'])
+                    rows = []
+                    pending = CollectResults(config, run, results, workers, pending)
+        run['checkpoint'].total(i['FILE'], fcount)
+        progress['total'] = progress['queued']
+        if progress['done'] + progress['failed'] == progress['total']:
+            FileProgress(i['FILE'], progress)
 
+    for w in workers:
+        jobs.put(None)
+    CollectResults(config, run, results, workers, pending, block = True)
+    for w in workers:
+        w.join()
+    if config.get('PARTITIONS') is not None:
+        # the chunks of the files are merged in the order of FILES, not the order they were parsed in
+        SubmitPartitions(config, run['uploader'], [c for n in sorted(run['chunks'].keys()) for c in run['chunks'][n]])
+    run['uploader'].close()
+    logger.info("Parsed {} rows to {} triples".format(run['rows'], run['triples']))
+    run['budget'].report()
+    StopProfile(config, parentprofile, 'parent')
+    if GetMetrics() is not None:
+        GetMetrics().write(config['METRICS'])
+    if config.get('DEDUP') is not None:
+        logger.info("Dropped {} duplicate triples".format(run['dropped']))
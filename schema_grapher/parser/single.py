@@ -1,63 +1,111 @@
 import os
 import json
-from socket import error as SocketError
+import functools
+import itertools
+import collections
 import csv
 import logging
-from schema_grapher.util.s3 import S3
 
-from schema_grapher.util import ReadCSV, MapHeader
-from schema_grapher.util.rdf import RenderTriples, RowTriples, PropertyType
+from schema_grapher.util.geocache import GeoCacheFromConfig, SetGeoCache
+from schema_grapher.util.misc import ReadCSV, MapHeader
+from schema_grapher.util.geobatch import GeocoderFromConfig, SetGeocoder
+from schema_grapher.util.output import OutputName, UploaderFromConfig, ObjectName, PartitionCountsName, SubmitPartitions
+from schema_grapher.util.sparql import GraphStoreFromConfig
+from schema_grapher.util.dedup import DedupIndexFromConfig
+from schema_grapher.util.checkpoint import CheckpointFromConfig
+from schema_grapher.util.memory import MemoryBudget
+from schema_grapher.util.metrics import MetricsFromConfig, GetMetrics, SetMetrics, StartProfile, StopProfile
+from schema_grapher.util.rdf import CompileSpec, ProcessPlan, PropertyType
+from schema_grapher.util.schema import PropertyTypes
 
 logger = logging.getLogger(__name__)
 
-def ParseConfigSingle(configfile):
-    """Reads in a config file and processes the specification in a single thread"""
+def ParseConfigSingle(configfile, metrics = None, profile = None, shard = None):
+    """Reads in a config file and processes the specification in a single thread, the metrics directory, profile flag and K/N shard override METRICS, METRICS_PROFILE and SHARD"""
     config = json.load(open(configfile))
     for k,v in dict(os.environ).items():
         try:
             config[k] = json.loads(v)
         except:
             config[k] = v
+    if metrics is not None:
+        config['METRICS'] = metrics
+    if profile is not None:
+        config['METRICS_PROFILE'] = profile
+    if shard is not None:
+        config['SHARD'] = shard
+    SetMetrics(MetricsFromConfig(config))
+    profile = StartProfile(config)
+    SetGeoCache(GeoCacheFromConfig(config))
+    SetGeocoder(GeocoderFromConfig(config))
+    uploader = UploaderFromConfig(config)
+    index = DedupIndexFromConfig(config)
+    checkpoint = CheckpointFromConfig(config)
+    dropped = 0
+    compression = config.get('OUTPUT_COMPRESSION')
+    buffering = config.get('OUTPUT_BUFFER', 1 << 20)
+    partitions = config.get('PARTITIONS')
+    store = GraphStoreFromConfig(config)
+    chunks = []
     if 'SCHEMA' in list(config.keys()):
-        pt = PropertyType(config['SCHEMA'])
+        pt = PropertyType(config['SCHEMA'], config.get('SCHEMA_CACHE'), config.get('SCHEMA_REFRESH', 3600), config.get('SCHEMA_TIMEOUT', 30))
     else:
-        pt = {}
+        pt = PropertyTypes()
     for i in config['FILES']:
         if os.path.exists(i['FILE']) and os.path.exists(i['SPEC']):
             logger.info("Parsing {} and generating triples".format(i['FILE']))
             spec = json.load(open(i['SPEC']))
+            checkpoint.begin(config, i, spec, pt)
+            if checkpoint.complete(i['FILE']):
+                chunks += checkpoint.chunks(i['FILE'])
+                continue
             t = ReadCSV(i['FILE'])
+            if GetMetrics() is not None:
+                t = GetMetrics().iterate('read', t)
             fileprefix = i['FILE'].split(os.sep)[-1].split('.')[0]
             th = MapHeader(next(t))
+            plan = CompileSpec(spec, th, deterministic = config['DETERMINISTIC_IDS'], idhash = config.get('DETERMINISTIC_HASH'))
 
-            rowcount = 0
+            # the rows are streamed chunk by chunk, a chunk finished by an earlier run is read past without parsing it
             fcount = 0
-            fname = os.path.join(config['OUTPUTDIR'], fileprefix + '_' + str(fcount) + '.nt')
-            f = open(fname, 'w')
-            for cnt, j in enumerate(t):
-                if rowcount > config['CHUNKSIZE']:
-                    f.close()
-                    rowcount = 0
-                    fcount += 1
-                    fname = os.path.join(config['OUTPUTDIR'], fileprefix + '_' + str(fcount) + '.nt')
-                    f = open(fname, 'w')
-                if j != "":
-                    f.write(RenderTriples(RowTriples(spec, th, j, os.path.split(fname)[1], cnt, pt, deterministic = config['DETERMINISTIC_IDS'])))
-                rowcount += 1
-            f.close()
-
-
-            # prepend S3 folder structure to filename with path removed
-            s3_obj_name = config['S3_FOLDER'] + os.path.split(fname)[1]
-
-            # Connect to AWS S3 and Upload
-            logger.info("Connecting to AWS S3.")
-            sss = S3()
-            logger.info("Uploading {} to S3".format(s3_obj_name))
-            sss.upload_file(fname, s3_obj_name, zip=True)
+            row = next(t, None)
+            while row is not None or fcount == 0:
+                rows = itertools.chain([row] if row is not None else [], itertools.islice(t, config['CHUNKSIZE']))
+                fname = os.path.join(config['OUTPUTDIR'], fileprefix + '_' + str(fcount) + '.nt')
+                offset = fcount * (config['CHUNKSIZE'] + 1)
+                chunks += [fname]
+                if checkpoint.finished(i['FILE'], fname, offset) or not checkpoint.owns(i['FILE'], fcount):
+                    collections.deque(rows, maxlen = 0)
+                else:
+                    rowcount, triplecount, chunkdropped = ProcessPlan(fname, plan, rows, offset, pt, config['DETERMINISTIC_IDS'], None, compression, buffering, config.get('DEDUP'), index, partitions = partitions, store = store)
+                    dropped += chunkdropped
+                    if store is not None:
+                        # the triples of the chunk are already loaded, there is no file to upload
+                        checkpoint.done(i['FILE'], fname, store.endpoint, offset, rowcount, triplecount)
+                    elif partitions is not None:
+                        # the pieces of a chunk stay local until the partitions are merged at the end of the run
+                        checkpoint.done(i['FILE'], fname, PartitionCountsName(fname), offset, rowcount, triplecount)
+                    else:
+                        output = OutputName(fname, compression)
+                        # every finished chunk is uploaded in the background while the next one is parsed
+                        uploader.submit(output, ObjectName(config, output), functools.partial(checkpoint.done, i['FILE'], fname, output, offset, rowcount, triplecount))
+                fcount += 1
+                row = next(t, None)
+            checkpoint.total(i['FILE'], fcount)
 
         else:
             if not os.path.exists(i['FILE']):
                 logger.error("File not found: " + i['FILE'])
             if not os.path.exists(i['SPEC']):
                 logger.error("File not found: " + i['SPEC'])
+    if partitions is not None:
+        SubmitPartitions(config, uploader, chunks)
+    if store is not None:
+        store.close()
+    uploader.close()
+    if config.get('DEDUP') is not None:
+        logger.info("Dropped {} duplicate triples".format(dropped))
+    MemoryBudget().report(workers = False)
+    StopProfile(config, profile, 'single')
+    if GetMetrics() is not None:
+        GetMetrics().write(config['METRICS'])
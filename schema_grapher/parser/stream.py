@@ -0,0 +1,175 @@
+import io
+import os
+import sys
+import json
+import queue
+import itertools
+import multiprocessing
+import logging
+
+from schema_grapher.util.geocache import GeoCacheFromConfig, GetGeoCache, SetGeoCache
+from schema_grapher.util.geobatch import GeocoderFromConfig, GetGeocoder, SetGeocoder
+from schema_grapher.util.misc import ReadCSVStream, MapHeader
+from schema_grapher.util.rdf import PropertyType, CompileSpec, WritePlan
+from schema_grapher.util.schema import PropertyTypes
+from schema_grapher.util.dedup import DedupIndexFromConfig
+from schema_grapher.util.metrics import MetricsFromConfig, GetMetrics, SetMetrics, StartProfile, StopProfile
+
+logger = logging.getLogger(__name__)
+
+def StreamBatches(rows, size):
+    """Function that groups the rows of a stream into lists of size rows"""
+    rows = iter(rows)
+    batch = list(itertools.islice(rows, size))
+    while len(batch) > 0:
+        yield batch
+        batch = list(itertools.islice(rows, size))
+
+def StreamWorker(config, plan, pt, name, jobs, results, geocache = None, geocoder = None, index = None):
+    """Long lived worker of an ordered stream that renders batches of rows from the job queue to N-Triples text until it receives None, every batch is sent back with its sequence number"""
+    SetMetrics(MetricsFromConfig(config))
+    profile = StartProfile(config)
+    if geocache is not None:
+        SetGeoCache(geocache)
+    if geocoder is not None:
+        SetGeocoder(geocoder)
+    chunksize = config.get('CHUNKSIZE', 10000)
+    job = jobs.get()
+    while job is not None:
+        seq, rows = job
+        try:
+            out = io.StringIO()
+            counts = WritePlan(out, name + '_' + str(seq) + '.nt', plan, rows, seq * (chunksize + 1), pt, config.get('DETERMINISTIC_IDS'), (name, chunksize), config.get('DEDUP'), index)
+            results.put((seq, out.getvalue(), counts, None, GetMetrics().take() if GetMetrics() is not None else None))
+        except Exception as e:
+            logger.error("Failed to parse rows {} to {} of {}".format(seq * (chunksize + 1), (seq + 1) * (chunksize + 1) - 1, name), exc_info=e)
+            results.put((seq, None, (0, 0, 0), repr(e), GetMetrics().take() if GetMetrics() is not None else None))
+        job = jobs.get()
+    StopProfile(config, profile, 'worker_' + str(os.getpid()))
+
+def StreamWrite(out, results, workers, ready, written, totals):
+    """Waits for the next result of the workers of an ordered stream and writes every batch that is due, in order. ready holds the batches that finished before an earlier one, and the sequence number of the next batch to write is returned."""
+    while True:
+        try:
+            seq, text, counts, error, metrics = results.get(True, 5)
+            break
+        except queue.Empty:
+            if not all(w.is_alive() for w in workers):
+                raise Exception("A stream worker exited with batches outstanding")
+    if metrics is not None:
+        GetMetrics().merge(metrics)
+    if error is not None:
+        raise Exception("Stream batch {} failed: {}".format(seq, error))
+    ready[seq] = (text, counts)
+    while written in ready:
+        text, counts = ready.pop(written)
+        out.write(text)
+        totals[:] = [a + b for a, b in zip(totals, counts)]
+        written += 1
+    out.flush()
+    return written
+
+def StreamOrdered(config, plan, pt, name, rows, out, index = None):
+    """Fans the rows of a stream out to THREADS workers in batches of CHUNKSIZE + 1 rows and writes their triples in input order. At most twice as many batches as there are workers are read ahead of the output, so the memory used is bounded however long the stream is."""
+    threads = config.get('THREADS', multiprocessing.cpu_count())
+    jobs = multiprocessing.Queue(threads)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=StreamWorker, args=(config, plan, pt, name, jobs, results, GetGeoCache(), GetGeocoder(), index)) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    ready = {}
+    written = 0
+    sent = 0
+    totals = [0, 0, 0]
+    try:
+        for batch in StreamBatches(rows, config.get('CHUNKSIZE', 10000) + 1):
+            while sent - written >= 2 * threads:
+                written = StreamWrite(out, results, workers, ready, written, totals)
+            jobs.put((sent, batch))
+            sent += 1
+        while written < sent:
+            written = StreamWrite(out, results, workers, ready, written, totals)
+    except BaseException:
+        for w in workers:
+            w.terminate()
+        # the batches still queued for the terminated workers are dropped instead of blocking the exit
+        jobs.cancel_join_thread()
+        raise
+    for w in workers:
+        jobs.put(None)
+    for w in workers:
+        w.join()
+    return totals
+
+def ParseStream(specfile, configfile = None, source = '-', name = None, processes = False, metrics = None, profile = None):
+    """Converts a CSV read from stdin, or from the file or named pipe source, with the spec in specfile to N-Triples written to stdout as the rows are processed. The config file is optional and only its SCHEMA, CHUNKSIZE, THREADS, DETERMINISTIC_IDS, DEDUP, GEO* and METRICS settings apply. IDs are salted as if the CSV were a file called name parsed by ParseConfigSingle, so the output equals the concatenated chunks of that run. With processes set the rows are converted by THREADS workers and written in input order. The metrics directory and profile flag override METRICS and METRICS_PROFILE."""
+    config = json.load(open(configfile)) if configfile is not None else {}
+    for k,v in dict(os.environ).items():
+        try:
+            config[k] = json.loads(v)
+        except:
+            config[k] = v
+    if metrics is not None:
+        config['METRICS'] = metrics
+    if profile is not None:
+        config['METRICS_PROFILE'] = profile
+    if config.get('DEDUP') == 'run' and 'DEDUP_PATH' not in config and 'OUTPUTDIR' not in config:
+        raise Exception("Run wide DEDUP of a stream requires DEDUP_PATH")
+    SetMetrics(MetricsFromConfig(config))
+    profile = StartProfile(config)
+    SetGeoCache(GeoCacheFromConfig(config))
+    SetGeocoder(GeocoderFromConfig(config))
+    GetGeocoder().limiter.share()
+    index = DedupIndexFromConfig(config)
+    if 'SCHEMA' in list(config.keys()):
+        pt = PropertyType(config['SCHEMA'], config.get('SCHEMA_CACHE'), config.get('SCHEMA_REFRESH', 3600), config.get('SCHEMA_TIMEOUT', 30))
+    else:
+        pt = PropertyTypes()
+    if name is None:
+        name = 'stdin' if source == '-' else source.split(os.sep)[-1].split('.')[0]
+    spec = json.load(open(specfile))
+    chunksize = config.get('CHUNKSIZE', 10000)
+
+    if source == '-':
+        infile = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='ignore', newline='')
+    else:
+        infile = open(source, 'r', encoding='utf-8', errors='ignore', newline='')
+    # the triples go to the stdout file descriptor through a buffer of OUTPUT_BUFFER bytes that is flushed after every batch
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', buffering=config.get('OUTPUT_BUFFER', 1 << 20), closefd=False)
+    t = ReadCSVStream(infile, '<stdin>' if source == '-' else source)
+    if GetMetrics() is not None:
+        t = GetMetrics().iterate('read', t)
+    try:
+        header = next(t, None)
+        if header is None:
+            logger.error("No CSV header on " + ('<stdin>' if source == '-' else source))
+            return
+        plan = CompileSpec(spec, MapHeader(header), deterministic = config.get('DETERMINISTIC_IDS'), idhash = config.get('DETERMINISTIC_HASH'))
+        if processes:
+            totals = StreamOrdered(config, plan, pt, name, t, out, index)
+        else:
+            totals = [0, 0, 0]
+            seq = 0
+            row = next(t, None)
+            while row is not None:
+                rows = itertools.chain([row], itertools.islice(t, chunksize))
+                counts = WritePlan(out, name + '_' + str(seq) + '.nt', plan, rows, seq * (chunksize + 1), pt, config.get('DETERMINISTIC_IDS'), (name, chunksize), config.get('DEDUP'), index)
+                out.flush()
+                totals = [a + b for a, b in zip(totals, counts)]
+                seq += 1
+                row = next(t, None)
+        out.flush()
+    except BrokenPipeError:
+        # the reader of the output went away, for example head, so the rest of the stream is not needed
+        logger.warning("Output closed, stopping the stream")
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    finally:
+        if source != '-':
+            infile.close()
+    logger.info("Streamed {} rows to {} triples".format(totals[0], totals[1]))
+    if config.get('DEDUP') is not None:
+        logger.info("Dropped {} duplicate triples".format(totals[2]))
+    StopProfile(config, profile, 'stream')
+    if GetMetrics() is not None:
+        GetMetrics().write(config['METRICS'])
@@ -1,3 +1,3 @@
-from schema_grapher.util.misc import *
-from schema_grapher.util.rdf import *
-from schema_grapher.util.bind import *
+from schema_grapher import LazyExports
+
+__getattr__ = LazyExports('schema_grapher.util', ('schema', 'metrics', 'memory', 'collector', 'dedup', 'output', 'dates', 'ntriples', 'geocache', 'bind', 'rdf', 'misc', 'sparql', 'shard'))
@@ -1,49 +1,46 @@
 import uuid
+import math
 import hashlib
+import time
 import datetime
-import dateutil
-from geographiclib.geodesic import Geodesic
+import functools
+from schema_grapher.util.metrics import GetMetrics
+from schema_grapher.util.dates import ColumnDateParser, UnixTimestampString
 
 def ResolveBind(binding, row, header):
     """Function that resolves the bind function specified in a dataset annotation"""
-    if binding["FUNCTION"] == "GeoJSONFromLatLon":
-        return GeoJSONFromLatLon(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "GeoJSONFromCombinedLatLon":
-        return GeoJSONFromCombinedLatLon(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "GeoJSONFromCombinedLonLat":
-        return GeoJSONFromCombinedLonLat(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "GeoJSONHexFromCombinedLonLat":
-        return GeoJSONHexFromCombinedLonLat(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "GeoJSONHexFromCombinedLatLon":
-        return GeoJSONHexFromCombinedLatLon(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "DeterministicUUID":
-        return DeterministicUUID(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "Echo":
-        return Echo(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "CombineColumns":
-        return CombineColumns(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "SplitColumn":
-        return SplitColumn(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "SplitIndex":
-        return SplitIndex(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "TernaryBool":
-        return TernaryBool(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "Replace":
-        return Replace(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "ProperCase":
-        return ProperCase(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "UpCase":
-        return UpCase(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "Concatenate":
-        return Concatenate(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "OffsetDate":
-        return OffsetDate(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "UnixTimestamp":
-        return UnixTimestamp(binding["DATA"], row, header)
-    elif binding["FUNCTION"] == "ObjectTemplate":
-        return ObjectTemplate(binding["DATA"], row, header)
-    else:
+    metrics = GetMetrics()
+    if metrics is None:
+        return BindFunction(binding)(binding["DATA"], row, header)
+    start = time.perf_counter()
+    try:
+        return BindFunction(binding)(binding["DATA"], row, header)
+    finally:
+        metrics.add('bind.' + binding["FUNCTION"], time.perf_counter() - start)
+
+def BindFunction(binding):
+    """Function that looks up the bind function specified in a dataset annotation"""
+    if binding["FUNCTION"] not in BINDS.keys():
         raise Exception("Binding Function Not Found")
+    return BINDS[binding["FUNCTION"]]
+
+def ResolveBindColumn(binding, rows, header):
+    """Function that resolves a bind function for every row of a batch, using its column implementation when it has one"""
+    metrics = GetMetrics()
+    if metrics is None:
+        return BindColumn(binding, rows, header)
+    start = time.perf_counter()
+    try:
+        return BindColumn(binding, rows, header)
+    finally:
+        metrics.add('bind.' + binding["FUNCTION"], time.perf_counter() - start, len(rows))
+
+def BindColumn(binding, rows, header):
+    """Function that resolves a bind function for every row of a batch for ResolveBindColumn"""
+    function = BindFunction(binding)
+    if binding["FUNCTION"] in COLUMN_BINDS.keys():
+        return COLUMN_BINDS[binding["FUNCTION"]](binding["DATA"], rows, header)
+    return [function(binding["DATA"], row, header) for row in rows]
 
 def GeoJSONFromLatLon(data, row, header):
     """Bind function that returns a geojson object from a Latitude and Longitude. Columns expected in annotation: Latitude and Longitude"""
@@ -71,30 +68,102 @@ def GeoJSONFromCombinedLonLat(data, row, header):
     except:
         return None
 
-def PolygonLonLat(lat, lon, numvertex, distance):
-    """Function to determine where points on a polygon should be placed in geocoordinate space"""
-    geod = Geodesic.WGS84
-    angle = 360 / numvertex
-    coords = []
-    for i in range(numvertex-1,-1,-1):
-        vertex = geod.Direct(lat, lon, float(angle*i), distance)
-        coords += [[vertex['lon2'], vertex['lat2']]]
+def PolygonLonLat(lat, lon, numvertex, distance, method = "geodesic", precision = None):
+    """Function to determine where points on a polygon should be placed in geocoordinate space. The vertices are solved on the WGS84 ellipsoid with method geodesic or approximated with method local, and are cached by the center (rounded to precision decimals when it is set), number of vertices and distance"""
+    if precision is not None:
+        lat = round(lat, precision)
+        lon = round(lon, precision)
+    coords = [list(v) for v in PolygonVertices(lat, lon, numvertex, distance, method)]
     coords += [coords[0]]
     return coords
 
+@functools.lru_cache(maxsize = 65536)
+def PolygonVertices(lat, lon, numvertex, distance, method = "geodesic"):
+    """Function that returns the (longitude, latitude) vertices of a polygon for PolygonLonLat, the last cached polygons are kept"""
+    angle = 360 / numvertex
+    if method == "geodesic":
+        from geographiclib.geodesic import Geodesic
+        geod = Geodesic.WGS84
+        vertices = []
+        for i in range(numvertex-1,-1,-1):
+            vertex = geod.Direct(lat, lon, float(angle*i), distance)
+            vertices += [(vertex['lon2'], vertex['lat2'])]
+        return tuple(vertices)
+    elif method == "local":
+        return tuple(LocalDirect(lat, lon, float(angle*i), distance) for i in range(numvertex-1,-1,-1))
+    raise Exception("Unknown polygon method: " + str(method))
+
+POLYGON_METHODS = ("geodesic", "local")
+
+def PolygonMethod(data):
+    """Function that returns the polygon method of the annotation of a hexagon bind, raising an error for an unknown one"""
+    method = data.get("Method", "geodesic")
+    if method not in POLYGON_METHODS:
+        raise Exception("Unknown polygon method: " + str(method))
+    return method
+
+# WGS84 semi-major axis and squared eccentricity
+WGS84_A = 6378137.0
+WGS84_E2 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+
+def LocalDirect(lat, lon, azimuth, distance):
+    """Function that approximates the (longitude, latitude) reached from a point at an azimuth and distance in meters by a single midpoint step along the geodesic on the WGS84 ellipsoid. The error grows with the cube of the distance and steeply towards the poles, for 10km it is about 1.4cm at 59 degrees latitude but about 17m at 89 degrees."""
+    if abs(lat) > 90:
+        # as Geodesic.Direct, a latitude out of range has no solution
+        return (math.nan, math.nan)
+    phi = math.radians(lat)
+    alpha = math.radians(azimuth)
+    w = 1 - WGS84_E2 * math.sin(phi) ** 2
+    # meridional and prime vertical radii of curvature
+    m = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    n = WGS84_A / math.sqrt(w)
+    midphi = phi + distance / 2 * math.cos(alpha) / m
+    midalpha = alpha + distance / 2 * math.sin(alpha) * math.tan(phi) / n
+    w = 1 - WGS84_E2 * math.sin(midphi) ** 2
+    m = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    n = WGS84_A / math.sqrt(w)
+    lat2 = math.degrees(phi + distance * math.cos(midalpha) / m)
+    lon2 = lon + math.degrees(distance * math.sin(midalpha) / (n * math.cos(midphi)))
+    return ((lon2 + 180) % 360 - 180 if abs(lon2) > 180 else lon2, lat2)
+
+def HexagonColumn(data, rows, header, column, lonfirst):
+    """Function that returns the hexagon polygons of a column of combined coordinates for a batch, every distinct value is parsed and solved once"""
+    method = PolygonMethod(data)
+    precision = data.get("Precision")
+    polygons = {}
+    values = []
+    for v in Column(data[column], rows, header):
+        if v not in polygons:
+            try:
+                latlon = v.strip("()[]").replace(',', ' ').replace('  ', ' ').split(" ")
+                a, b = (float(latlon[0]), float(latlon[1])) if lonfirst else (float(latlon[1]), float(latlon[0]))
+                polygons[v] = PolygonVertices(round(a, precision) if precision is not None else a, round(b, precision) if precision is not None else b, 6, data['Radius'], method)
+            except:
+                polygons[v] = None
+        vertices = polygons[v]
+        if vertices is None:
+            values += [None]
+        else:
+            coords = [list(c) for c in vertices]
+            coords += [coords[0]]
+            values += [{"type": "Polygon", "coordinates": [coords]}]
+    return values
+
 def GeoJSONHexFromCombinedLonLat(data, row, header):
-    """Bind function that returns a geojson object containing a hexagon polygon with a specified radius centered on a Latitude and Longitude. Columns expected in annotation: LonLat (comma delimited longitude followed by latitude), Radius (the outer radius of the polygon)"""
+    """Bind function that returns a geojson object containing a hexagon polygon with a specified radius centered on a Latitude and Longitude. Columns expected in annotation: LonLat (comma delimited longitude followed by latitude), Radius (the outer radius of the polygon), optionally Method (geodesic, the default, or the faster local approximation, whose vertices are off by about 1.4cm at 59 degrees latitude for a 10km radius but by about 17m at 89 degrees) and Precision (decimals the center is rounded to so nearby centers share a cached polygon, default no rounding)"""
+    method = PolygonMethod(data)
     try:
         latlon = row[header[data["LonLat"]]].strip("()[]").replace(',', ' ').replace('  ', ' ').split(" ")
-        return {"type": "Polygon", "coordinates": [PolygonLonLat(float(latlon[0]), float(latlon[1]), 6, data['Radius'])]}
+        return {"type": "Polygon", "coordinates": [PolygonLonLat(float(latlon[0]), float(latlon[1]), 6, data['Radius'], method, data.get("Precision"))]}
     except:
         return None
 
 def GeoJSONHexFromCombinedLatLon(data, row, header):
-    """Bind function that returns a geojson object containing a hexagon polygon with a specified radius centered on a Latitude and Longitude. Columns expected in annotation: LatLon (comma delimited latitude followed by longitude), Radius (the outer radius of the polygon)"""
+    """Bind function that returns a geojson object containing a hexagon polygon with a specified radius centered on a Latitude and Longitude. Columns expected in annotation: LatLon (comma delimited latitude followed by longitude), Radius (the outer radius of the polygon), optionally Method and Precision as for GeoJSONHexFromCombinedLonLat"""
+    method = PolygonMethod(data)
     try:
         latlon = row[header[data["LatLon"]]].strip("()[]").replace(',', ' ').replace('  ', ' ').split(" ")
-        return {"type": "Polygon", "coordinates": [PolygonLonLat(float(latlon[1]), float(latlon[0]), 6, data['Radius'])]}
+        return {"type": "Polygon", "coordinates": [PolygonLonLat(float(latlon[1]), float(latlon[0]), 6, data['Radius'], method, data.get("Precision"))]}
     except:
         return None
 
@@ -146,7 +215,7 @@ def OffsetDate(data, row, header):
     """Bind function to shift the date of a column by a number of seconds, returns a datetime object. Columns expected in annotation: DateCol (the column with the date), Offset (the number of seconds to shift the DateCol)"""
     if row[header[data["DateCol"]]].replace(' ', '') != '':
         try:
-            return datetime.datetime.fromtimestamp(datetime.datetime.timestamp(dateutil.parser.parse(row[header[data["DateCol"]]])) + float(data["Offset"]))
+            return datetime.datetime.fromtimestamp(datetime.datetime.timestamp(ColumnDateParser(data["DateCol"]).parse(row[header[data["DateCol"]]])) + float(data["Offset"]))
         except:
             return None
     else:
@@ -155,7 +224,7 @@ def OffsetDate(data, row, header):
 def UnixTimestamp(data, row, header):
     """Bind function to convert a unix timestamp to a string representation. Columns expcted in annotation: DateCol (the column with the unix timestamp)"""
     try:
-        return str(datetime.datetime.utcfromtimestamp(int(row[header[data["DateCol"]]])))
+        return UnixTimestampString(row[header[data["DateCol"]]])
     except:
         return None
 
@@ -165,3 +234,94 @@ def ObjectTemplate(data, row, header):
     for k,v in data["Map"].items():
         nObj[k] = row[header[v]]
     return nObj
+
+def Column(name, rows, header):
+    """Function that returns the values of a column for every row of a batch"""
+    ix = header[name]
+    return [row[ix] for row in rows]
+
+def GeoJSONFromLatLonColumn(data, rows, header):
+    """Column implementation of GeoJSONFromLatLon"""
+    if data["Longitude"] not in header.keys() or data["Latitude"] not in header.keys():
+        return [None] * len(rows)
+    return [GeoJSONPoint(lon, lat) for lon, lat in zip(Column(data["Longitude"], rows, header), Column(data["Latitude"], rows, header))]
+
+def GeoJSONPoint(lon, lat):
+    """Function that returns a geojson point for a longitude and latitude, or None when either is missing or not a number"""
+    if lon == "nan" or lat == "nan":
+        return None
+    try:
+        return {"type": "Point", "coordinates": [float(lon), float(lat)]}
+    except:
+        return None
+
+def GeoJSONHexFromCombinedLonLatColumn(data, rows, header):
+    """Column implementation of GeoJSONHexFromCombinedLonLat"""
+    return HexagonColumn(data, rows, header, "LonLat", True)
+
+def GeoJSONHexFromCombinedLatLonColumn(data, rows, header):
+    """Column implementation of GeoJSONHexFromCombinedLatLon"""
+    return HexagonColumn(data, rows, header, "LatLon", False)
+
+def EchoColumn(data, rows, header):
+    """Column implementation of Echo"""
+    return [data["Echostring"]] * len(rows)
+
+def TernaryBoolColumn(data, rows, header):
+    """Column implementation of TernaryBool"""
+    return [v == data["True"] for v in Column(data["Column"], rows, header)]
+
+def ReplaceColumn(data, rows, header):
+    """Column implementation of Replace"""
+    return [v.replace(data["Key"], data["Value"]) for v in Column(data["Column"], rows, header)]
+
+def UpCaseColumn(data, rows, header):
+    """Column implementation of UpCase"""
+    return [v.upper() for v in Column(data["Column"], rows, header)]
+
+def UnixTimestampColumn(data, rows, header):
+    """Column implementation of UnixTimestamp"""
+    values = []
+    for v in Column(data["DateCol"], rows, header):
+        try:
+            values += [UnixTimestampString(v)]
+        except:
+            values += [None]
+    return values
+
+def ObjectTemplateColumn(data, rows, header):
+    """Column implementation of ObjectTemplate, every row gets a copy as ObjectTemplate fills in and returns the same object each time"""
+    return [dict(ObjectTemplate(data, row, header)) for row in rows]
+
+BINDS = {
+    "GeoJSONFromLatLon" : GeoJSONFromLatLon,
+    "GeoJSONFromCombinedLatLon" : GeoJSONFromCombinedLatLon,
+    "GeoJSONFromCombinedLonLat" : GeoJSONFromCombinedLonLat,
+    "GeoJSONHexFromCombinedLonLat" : GeoJSONHexFromCombinedLonLat,
+    "GeoJSONHexFromCombinedLatLon" : GeoJSONHexFromCombinedLatLon,
+    "DeterministicUUID" : DeterministicUUID,
+    "Echo" : Echo,
+    "CombineColumns" : CombineColumns,
+    "SplitColumn" : SplitColumn,
+    "SplitIndex" : SplitIndex,
+    "TernaryBool" : TernaryBool,
+    "Replace" : Replace,
+    "ProperCase" : ProperCase,
+    "UpCase" : UpCase,
+    "Concatenate" : Concatenate,
+    "OffsetDate" : OffsetDate,
+    "UnixTimestamp" : UnixTimestamp,
+    "ObjectTemplate" : ObjectTemplate,
+}
+
+COLUMN_BINDS = {
+    "GeoJSONFromLatLon" : GeoJSONFromLatLonColumn,
+    "GeoJSONHexFromCombinedLonLat" : GeoJSONHexFromCombinedLonLatColumn,
+    "GeoJSONHexFromCombinedLatLon" : GeoJSONHexFromCombinedLatLonColumn,
+    "Echo" : EchoColumn,
+    "TernaryBool" : TernaryBoolColumn,
+    "Replace" : ReplaceColumn,
+    "UpCase" : UpCaseColumn,
+    "UnixTimestamp" : UnixTimestampColumn,
+    "ObjectTemplate" : ObjectTemplateColumn,
+}
@@ -0,0 +1,143 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+
+from schema_grapher.util.misc import generate_md5
+from schema_grapher.util.shard import ParseShard, ShardOwner, ShardChunks, ShardManifestPath
+
+logger = logging.getLogger(__name__)
+
+# settings that change the chunks written for a file, outputs written with different values are never mixed
+SETTINGS = ['CHUNKSIZE', 'BYTE_RANGES', 'DETERMINISTIC_IDS', 'DETERMINISTIC_HASH', 'OUTPUT_COMPRESSION', 'DEDUP', 'S3_FOLDER']
+# settings added later, only part of the fingerprint when set so the manifests of earlier runs stay valid
+OPTIONAL_SETTINGS = ['PARTITIONS', 'SPARQL_ENDPOINT', 'SPARQL_GRAPH']
+
+class Checkpoint(object):
+    """Manifest of the chunks finished for each input file of a run, saved to a JSON file after every chunk so that a rerun skips the unchanged files and the finished chunks. Without a path nothing is remembered between runs. A run that is the (K, N) shard of a run split across hosts only parses the chunks that belong to its shard, and its manifest is the one the shards are merged with."""
+
+    def __init__(self, path = None, shard = None):
+        self.path = path
+        self.shard = shard
+        self.files = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+            except ValueError:
+                saved = None
+            if type(saved) is not dict or type(saved.get('files')) is not dict:
+                raise Exception("{} is not a valid manifest, remove it to start over".format(path))
+            if (tuple(saved['shard']) if saved.get('shard') is not None else None) != shard:
+                raise Exception("{} is the manifest of another shard, remove it to start over".format(path))
+            self.files = saved['files']
+
+    def begin(self, config, entry, spec, pt = None):
+        """Starts an entry of FILES, resuming it when its input, spec, schema and settings are unchanged and forgetting its chunks when any of them changed. pt is the schema the run loaded, which a schema URL is fingerprinted by."""
+        if self.path is None:
+            return
+        md5 = generate_md5(entry['FILE'])
+        fingerprint = Fingerprint(config, spec, pt)
+        with self._lock:
+            state = self.files.get(entry['FILE'])
+            if state is not None and (state['md5'] != md5 or state['fingerprint'] != fingerprint):
+                if state['md5'] != md5:
+                    logger.info("{} changed, its chunks are parsed again".format(entry['FILE']))
+                else:
+                    logger.warning("The spec, schema or settings of {} changed since its chunks were written, they are parsed again".format(entry['FILE']))
+                for chunk in state['chunks'].values():
+                    if os.path.exists(chunk['output']):
+                        os.remove(chunk['output'])
+                state = None
+            if state is None:
+                state = self.files[entry['FILE']] = {'md5' : md5, 'fingerprint' : fingerprint, 'chunks' : {}, 'total' : None}
+            elif state['total'] is not None and len(state['chunks']) >= self._owned(entry['FILE'], state['total']):
+                logger.info("Skipping {}, all of its {} chunks are finished".format(entry['FILE'], self._owned(entry['FILE'], state['total'])))
+            elif len(state['chunks']) > 0:
+                logger.info("Resuming {}, {} chunks are finished".format(entry['FILE'], len(state['chunks'])))
+            self._save()
+
+    def complete(self, file):
+        """Returns whether every chunk of a file is finished"""
+        with self._lock:
+            state = self.files.get(file)
+            return state is not None and state['total'] is not None and len(state['chunks']) >= self._owned(file, state['total'])
+
+    def owns(self, file, fcount):
+        """Returns whether the chunk fcount of a file belongs to the shard of the run, which is every chunk of an unsharded run"""
+        return self.shard is None or ShardOwner(file, fcount, self.shard[1]) == self.shard[0]
+
+    def _owned(self, file, total):
+        return total if self.shard is None else ShardChunks(file, total, self.shard)
+
+    def chunks(self, file):
+        """Returns the finished chunks of a file in the order of their rows"""
+        with self._lock:
+            state = self.files.get(file)
+            if state is None:
+                return []
+            return sorted(state['chunks'].keys(), key = lambda c: state['chunks'][c]['offset'])
+
+    def finished(self, file, fname, offset):
+        """Returns whether the chunk fname of a file, starting at row offset, is finished"""
+        with self._lock:
+            state = self.files.get(file)
+            if state is None or fname not in state['chunks']:
+                return False
+            return state['chunks'][fname]['offset'] == offset
+
+    def done(self, file, fname, output, offset, rows, triples = None):
+        """Records that the chunk fname of a file, the rows offset to offset + rows, was written to output (and uploaded)"""
+        with self._lock:
+            state = self.files.setdefault(file, {'md5' : None, 'fingerprint' : None, 'chunks' : {}, 'total' : None})
+            state['chunks'][fname] = {'output' : output, 'offset' : offset, 'rows' : rows, 'triples' : triples}
+            self._save()
+
+    def total(self, file, chunks):
+        """Records the number of chunks of a file once all of them were queued"""
+        with self._lock:
+            if file in self.files:
+                self.files[file]['total'] = chunks
+                self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        saved = {'files' : self.files}
+        if self.shard is not None:
+            saved['shard'] = list(self.shard)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(saved, f, indent = 2)
+        os.replace(self.path + '.tmp', self.path)
+
+def CheckpointFromConfig(config):
+    """Function that builds the Checkpoint of the CHECKPOINT and SHARD settings of a config, a shard always keeps a manifest and keeps it in shard_<K>_of_<N>.json in OUTPUTDIR unless CHECKPOINT is set"""
+    if config.get('CHECKPOINT') is not None and config.get('DEDUP') == 'run':
+        # a resumed run would need an index holding the triples of the finished chunks and none of the chunks parsed again
+        raise Exception("Run wide DEDUP cannot be combined with CHECKPOINT")
+    if config.get('SHARD') is None:
+        return Checkpoint(config.get('CHECKPOINT'))
+    shard = ParseShard(config['SHARD'])
+    if config.get('PARTITIONS') is not None:
+        raise Exception("PARTITIONS cannot be combined with SHARD")
+    if config.get('DEDUP') == 'run':
+        # the hosts do not share an index, so the union of the shards would keep triples a single host drops
+        raise Exception("Run wide DEDUP cannot be combined with SHARD")
+    return Checkpoint(config.get('CHECKPOINT', ShardManifestPath(config, shard)), shard)
+
+def Fingerprint(config, spec, pt = None):
+    """Function that returns a digest of a spec, the schema and the settings that determine the chunks written for a file, a schema file is digested by its content and a schema URL by pt, the schema fetched from it"""
+    h = hashlib.md5(json.dumps(spec, sort_keys = True).encode("utf-8"))
+    if 'SCHEMA' in config.keys():
+        if os.path.exists(config['SCHEMA']):
+            h.update(generate_md5(config['SCHEMA']).encode("utf-8"))
+        elif pt is not None:
+            h.update(pt.digest().encode("utf-8"))
+        else:
+            raise Exception("The schema {} has to be loaded to fingerprint it".format(config['SCHEMA']))
+    settings = {k : config.get(k) for k in SETTINGS}
+    settings.update({k : config[k] for k in OPTIONAL_SETTINGS if config.get(k) is not None})
+    h.update(json.dumps(settings, sort_keys = True).encode("utf-8"))
+    return h.hexdigest()
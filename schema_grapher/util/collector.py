@@ -0,0 +1,133 @@
+import logging
+
+from schema_grapher.util.dedup import TripleKey
+
+logger = logging.getLogger(__name__)
+
+DEDUPS = (None, 'row', 'chunk', 'run')
+
+class TripleCollector(object):
+    """Collects the triples of rows as they are emitted, indexes them by subject and predicate for the merge of geolocation triples and optionally drops triples already seen in the same row or chunk, or anywhere in the run through a shared index (an ExactIndex or BloomIndex). With a sink (a function called with lists of triples) each row is written as soon as it is done, and a row is written in parts of flush triples while it is still being emitted. With a sink and run wide dedup the rows are instead written once flush of their triples can be looked up in the index at once, and finish writes the rest."""
+
+    def __init__(self, dedup = None, index = None, sink = None, flush = None):
+        if dedup not in DEDUPS:
+            raise Exception("Unknown triple dedup: " + str(dedup))
+        if dedup == 'run' and index is None:
+            raise Exception("Run wide triple dedup requires an index")
+        self.dedup = dedup
+        self.index = index
+        self.sink = sink
+        self.flush = flush
+        self.triples = []
+        self.count = 0
+        self.dropped = 0
+        self._seen = set()
+        self._pairs = {}
+        self._indexed = 0
+        self._base = 0
+        self._written = 0
+        self._pending = []
+
+    def add(self, triple):
+        """Adds a triple, unless dedup is per row or chunk and it was already seen"""
+        if self.dedup == 'row' or self.dedup == 'chunk':
+            if triple in self._seen:
+                self.dropped += 1
+                # the pair still counts as emitted at this position for the merge
+                self._pairs[(triple[0], triple[1])] = self.position()
+                return
+            self._seen.add(triple)
+        self.triples.append(triple)
+
+    def emitter(self):
+        """Returns the function PlanTriples calls for every triple"""
+        return self.add if self.dedup == 'row' or self.dedup == 'chunk' else self.triples.append
+
+    def position(self):
+        """Returns the position of the next triple of the current row"""
+        return self._base + len(self.triples)
+
+    def has(self, subject, predicate, start = 0):
+        """Returns whether a triple with the subject and predicate was emitted at or after position start of the current row"""
+        self._index()
+        return self._pairs.get((subject, predicate), -1) >= start
+
+    def _index(self):
+        for n in range(self._indexed, len(self.triples)):
+            t = self.triples[n]
+            if self._pairs.get((t[0], t[1]), -1) < self._base + n:
+                self._pairs[(t[0], t[1])] = self._base + n
+        self._indexed = len(self.triples)
+
+    def merge(self, start, ltriples):
+        """Adds the geolocation triples whose subject and predicate were not emitted since position start"""
+        if len(ltriples) == 0:
+            return
+        for t in [t for t in ltriples if not self.has(t[0], t[1], start)]:
+            self.add(t)
+
+    def _filter(self, triples):
+        if self.dedup == 'run' and len(triples) > 0:
+            new = self.index.filter([TripleKey(t) for t in triples])
+            self.dropped += len(triples) - sum(new)
+            triples = [t for t, n in zip(triples, new) if n]
+        self.count += len(triples)
+        return triples
+
+    def _batched(self):
+        return self.dedup == 'run' and self.sink is not None
+
+    def _drain(self):
+        """Looks up the triples waiting for the run wide index in one transaction and writes the new ones to the sink"""
+        triples = self._filter(self._pending)
+        self._pending = []
+        if len(triples) > 0:
+            self.sink(triples)
+
+    def spill(self):
+        """Writes the triples of the current row emitted so far to the sink when there are flush of them, they stay indexed for the merge"""
+        if self.sink is None or self.flush is None or len(self.triples) < self.flush:
+            return
+        self._index()
+        if self._batched():
+            self._pending += self.triples
+            self._drain()
+        else:
+            triples = self._filter(self.triples)
+            if len(triples) > 0:
+                self.sink(triples)
+                self._written += len(triples)
+        self._base += len(self.triples)
+        # cleared in place, PlanTriples holds the append method of the list
+        del self.triples[:]
+        self._indexed = 0
+
+    def take(self):
+        """Returns the triples of the current row (writing them to the sink) and starts the next one, the triples seen are forgotten when dedup is per row and looked up in the index when it is run wide. Rows waiting for the index are not returned."""
+        if self._batched():
+            self._pending += self.triples
+            triples = []
+            if self.flush is not None and len(self._pending) >= self.flush:
+                self._drain()
+        else:
+            triples = self._filter(self.triples)
+            if self.sink is not None and (len(triples) > 0 or self._written == 0):
+                self.sink(triples)
+        self.triples = []
+        self._pairs = {}
+        self._indexed = 0
+        self._base = 0
+        self._written = 0
+        if self.dedup == 'row':
+            self._seen = set()
+        return triples
+
+    def finish(self):
+        """Writes the rows still waiting for the run wide index, once the last row is taken"""
+        if len(self._pending) > 0:
+            self._drain()
+
+    def report(self, name):
+        """Logs the number of duplicate triples dropped from an output file"""
+        if self.dropped > 0:
+            logger.info("Dropped {} duplicate triples from {}".format(self.dropped, name))
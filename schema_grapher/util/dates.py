@@ -0,0 +1,128 @@
+import re
+import datetime
+import collections
+
+# ISO-8601 subset whose values are built directly, it parses identically to dateutil
+ISODATETIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?(Z|[+-]\d{2}:\d{2})?)?')
+
+# strptime formats a column may be inferred to use, four digit years only as dateutil and strptime disagree on the century of two digit years
+FORMATS = [
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %I:%M:%S %p',
+    '%m-%d-%Y',
+    '%Y/%m/%d',
+    '%Y/%m/%d %H:%M:%S',
+    '%d %b %Y',
+    '%b %d %Y',
+    '%b %d, %Y',
+    '%d-%b-%Y',
+    '%a %b %d %H:%M:%S %Y',
+]
+
+UTC = datetime.timezone.utc
+
+class DateParser(object):
+    """Parses the dates of a single column, trying an ISO-8601 fast path and a strptime format inferred from a sample of the column before falling back to dateutil, and memoizing recent distinct values"""
+
+    def __init__(self, size = 4096, sample = 32):
+        self.size = size
+        self.sample = sample
+        self.format = None
+        self._samples = []
+        self._memo = collections.OrderedDict()
+
+    def parse(self, s):
+        """Returns the datetime dateutil.parser.parse would return for s, raising ValueError if it cannot be parsed"""
+        if s in self._memo:
+            self._memo.move_to_end(s)
+            value = self._memo[s]
+        else:
+            value = self._parse(s)
+            self._memo[s] = value
+            if len(self._memo) > self.size:
+                self._memo.popitem(last = False)
+        if value is None:
+            raise ValueError("Could not parse date: " + str(s))
+        return value
+
+    def _parse(self, s):
+        m = ISODATETIME.fullmatch(s)
+        if m is not None:
+            try:
+                return ISOFromMatch(m)
+            except ValueError:
+                pass
+        if self.format is not None:
+            try:
+                value = datetime.datetime.strptime(s, self.format)
+                # dateutil may read years below 100 as two digit years
+                if value.year >= 100:
+                    return value
+            except ValueError:
+                pass
+        import dateutil.parser
+        try:
+            value = dateutil.parser.parse(s)
+        except (ValueError, OverflowError):
+            return None
+        if self.format is None and m is None and len(self._samples) < self.sample:
+            self._samples += [(s, value)]
+            if len(self._samples) == self.sample:
+                self.format = InferFormat(self._samples)
+        return value
+
+def ISOFromMatch(m):
+    """Function that builds a datetime from a match of ISODATETIME"""
+    year, month, day, hour, minute, second, fraction, tz = m.groups()
+    tzinfo = None
+    if tz == 'Z':
+        tzinfo = UTC
+    elif tz is not None:
+        offset = datetime.timedelta(hours = int(tz[1:3]), minutes = int(tz[4:6]))
+        tzinfo = datetime.timezone(-offset if tz[0] == '-' else offset)
+    return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0), int((fraction or '0').ljust(6, '0')), tzinfo)
+
+def InferFormat(samples):
+    """Function that returns the strptime format that agrees with dateutil on the most sampled values (and on every value it accepts), or None"""
+    best = None
+    bestcount = 0
+    for f in FORMATS:
+        count = 0
+        for s, value in samples:
+            try:
+                parsed = datetime.datetime.strptime(s, f)
+            except ValueError:
+                continue
+            if parsed.year < 100:
+                continue
+            if parsed != value or parsed.tzinfo != value.tzinfo:
+                count = 0
+                break
+            count += 1
+        if count > bestcount:
+            best = f
+            bestcount = count
+    return best if bestcount * 2 >= len(samples) else None
+
+_parsers = {}
+
+def ColumnDateParser(column):
+    """Function that returns the DateParser of a column or property, creating it on first use"""
+    parser = _parsers.get(column)
+    if parser is None:
+        parser = _parsers[column] = DateParser()
+    return parser
+
+_timestamps = collections.OrderedDict()
+
+def UnixTimestampString(timestamp, size = 4096):
+    """Function that renders a unix timestamp as the string of its UTC datetime, memoizing recent distinct values"""
+    if timestamp in _timestamps:
+        return _timestamps[timestamp]
+    value = str(datetime.datetime.fromtimestamp(int(timestamp), UTC).replace(tzinfo = None))
+    _timestamps[timestamp] = value
+    if len(_timestamps) > size:
+        _timestamps.popitem(last = False)
+    return value
@@ -0,0 +1,135 @@
+import os
+import math
+import mmap
+import fcntl
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+def TripleKey(triple):
+    """Function that returns the 16 byte digest a triple is remembered by"""
+    return hashlib.blake2b((triple[0] + ' ' + triple[1] + ' ' + triple[2]).encode('utf-8'), digest_size = 16).digest()
+
+class ExactIndex(object):
+    """Disk backed set of the triples written in a run, kept in a SQLite file shared by every process of the run"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    def _connection(self):
+        """Returns the connection of this process to the index file, a forked worker opens its own on its first lookup"""
+        if self._pid != os.getpid():
+            import sqlite3
+            self._conn = sqlite3.connect(self.path, timeout = 600, isolation_level = None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # the index only lives as long as the run, it does not need to survive a crash
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY) WITHOUT ROWID")
+            self._pid = os.getpid()
+        return self._conn
+
+    def filter(self, keys):
+        """Records the keys and returns for each of them whether it was new"""
+        conn = self._connection()
+        new = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for k in keys:
+                new += [conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (k,)).rowcount == 1]
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        return new
+
+    def clear(self):
+        """Forgets every key"""
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        self._conn = None
+        self._pid = None
+
+class BloomIndex(object):
+    """Bloom filter of the triples written in a run, kept in a memory mapped file shared by every process of the run. A triple is wrongly taken for a duplicate with a probability of about error once capacity triples were written."""
+
+    def __init__(self, path, capacity = 10000000, error = 0.001):
+        self.path = path
+        self.capacity = capacity
+        self.error = error
+        self.bits = max(8, int(math.ceil(-capacity * math.log(error) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self._mm = None
+        self._file = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        state['_file'] = None
+        state['_pid'] = None
+        return state
+
+    def _map(self):
+        """Maps the filter file once per process and keeps it open to lock it"""
+        if self._pid != os.getpid():
+            size = (self.bits + 7) // 8
+            self._file = open(self.path, 'a+b')
+            if os.path.getsize(self.path) < size:
+                self._file.truncate(size)
+            self._mm = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+        return self._mm
+
+    def filter(self, keys):
+        """Records the keys and returns for each of them whether it was (probably) new"""
+        mm = self._map()
+        new = []
+        # the bits are tested and set under a lock on the file, a key two processes add at once would otherwise be new to both of them
+        fcntl.lockf(self._file, fcntl.LOCK_EX)
+        try:
+            for k in keys:
+                h1 = int.from_bytes(k[:8], 'little')
+                h2 = int.from_bytes(k[8:], 'little') | 1
+                found = True
+                for i in range(self.hashes):
+                    bit = (h1 + i * h2) % self.bits
+                    byte = mm[bit >> 3]
+                    if not byte & (1 << (bit & 7)):
+                        found = False
+                        mm[bit >> 3] = byte | (1 << (bit & 7))
+                new += [not found]
+        finally:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+        return new
+
+    def clear(self):
+        """Forgets every key"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._mm = None
+        self._file = None
+        self._pid = None
+
+def DedupIndexFromConfig(config):
+    """Function that builds an empty run wide dedup index from the DEDUP settings of a config, or returns None when DEDUP is not run"""
+    if config.get('DEDUP') != 'run':
+        return None
+    kind = config.get('DEDUP_INDEX', 'exact')
+    if kind == 'exact':
+        index = ExactIndex(config.get('DEDUP_PATH', os.path.join(config['OUTPUTDIR'], 'dedup.sqlite')))
+    elif kind == 'bloom':
+        index = BloomIndex(config.get('DEDUP_PATH', os.path.join(config['OUTPUTDIR'], 'dedup.bloom')), config.get('DEDUP_CAPACITY', 10000000), config.get('DEDUP_ERROR', 0.001))
+    else:
+        raise Exception("Unknown dedup index: " + str(kind))
+    index.clear()
+    return index
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import random
+import threading
+import urllib.parse
+import logging
+
+from schema_grapher.util.geocache import GetGeoCache, NormalizeQuery
+
+logger = logging.getLogger(__name__)
+
+NOMINATIM = 'https://nominatim.openstreetmap.org'
+
+class RateLimiter(object):
+    """Limits the number of calls per second across all threads of a process, or across all processes once it is shared"""
+
+    def __init__(self, rate = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+        self._shared = None
+
+    def share(self):
+        """Keeps the next free slot in shared memory, so the workers the limiter is handed to draw from one request budget and GEOCODER_RATE holds for the run rather than for every worker"""
+        if self._shared is None:
+            import multiprocessing
+            self._shared = multiprocessing.Value('d', self._next)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call is allowed"""
+        if self.interval == 0.0:
+            return
+        if self._shared is not None:
+            with self._shared.get_lock():
+                now = time.monotonic()
+                slot = max(now, self._shared.value)
+                self._shared.value = slot + self.interval
+        else:
+            with self._lock:
+                now = time.monotonic()
+                slot = max(now, self._next)
+                self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class Geocoder(object):
+    """Resolves addresses against a nominatim server concurrently over keep-alive connections, with a request rate limit and retries"""
+
+    def __init__(self, server = NOMINATIM, concurrency = 4, rate = 1.0, retries = 3, backoff = 1.0, timeout = 30, batch = 1000):
+        self.server = server.rstrip('/')
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.batch = batch
+        self._local = threading.local()
+        self._executor = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_local'] = None
+        state['_executor'] = None
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self):
+        """Returns the keep-alive connection of the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import http.client
+            url = urllib.parse.urlparse(self.server)
+            if url.scheme == 'https':
+                conn = http.client.HTTPSConnection(url.netloc, timeout = self.timeout)
+            else:
+                conn = http.client.HTTPConnection(url.netloc, timeout = self.timeout)
+            self._local.conn = conn
+            self._local.base = url.path
+        return conn
+
+    def _get(self, path):
+        """Performs a rate limited GET on the server, retrying failures with exponential backoff, returns None if every attempt failed"""
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+            self.limiter.wait()
+            conn = self._connection()
+            try:
+                conn.request('GET', self._local.base + path, headers = {'Connection': 'keep-alive'})
+                resp = conn.getresponse()
+                body = resp.read()
+                if resp.status == 200:
+                    return json.loads(body)
+                logger.debug("Nominatim returned HTTP {} for {}".format(resp.status, path))
+                if resp.status < 500 and resp.status != 429:
+                    return None
+            except Exception as e:
+                logger.debug("Nominatim request failed for " + path, exc_info=e)
+                conn.close()
+                self._local.conn = None
+        return None
+
+    def search(self, q):
+        """Geolocates a query produced by BuildAddress, returning the same structure as AddressQuery"""
+        nominatim = self.server + '/search?format=geojson&limit=1&addressdetails=1&'
+        key = nominatim + NormalizeQuery(q)
+        found, data = GetGeoCache().get(key)
+        if found:
+            return data
+        data = self._get('/search?format=geojson&limit=1&addressdetails=1&' + q)
+        if data is None:
+            # a failed lookup is not cached, the address is looked up again the next time it is seen
+            logger.error('Nominatim lookup failed for this url (skipping this line of data):' + nominatim + q)
+            return {}
+        GetGeoCache().put(key, data, negative = type(data) is not dict or len(data.get('features', [])) == 0)
+        return data
+
+    def prefetch(self, queries):
+        """Resolves the distinct queries concurrently and returns a dictionary mapping each query to its result"""
+        queries = list(dict.fromkeys(queries))
+        if len(queries) == 0:
+            return {}
+        if self._pid != os.getpid():
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.concurrency)
+            self._pid = os.getpid()
+        return dict(zip(queries, self._executor.map(self.search, queries)))
+
+def GeocoderFromConfig(config):
+    """Function that builds a Geocoder from the GEOCODER settings of a config"""
+    return Geocoder(config.get('GEOCODER', NOMINATIM), config.get('GEOCODER_CONCURRENCY', 4), config.get('GEOCODER_RATE', 1.0), config.get('GEOCODER_RETRIES', 3), config.get('GEOCODER_BACKOFF', 1.0), config.get('GEOCODER_TIMEOUT', 30), config.get('GEOCODER_BATCH', 1000))
+
+_geocoder = Geocoder()
+
+def GetGeocoder():
+    """Function that returns the geocoder used for GEOLOOKUP"""
+    return _geocoder
+
+def SetGeocoder(geocoder):
+    """Function that replaces the geocoder used for GEOLOOKUP"""
+    global _geocoder
+    _geocoder = geocoder
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+import collections
+import logging
+
+from schema_grapher.util.metrics import GetMetrics
+
+logger = logging.getLogger(__name__)
+
+class GeoCache(object):
+    """Cache of geocoder responses held in a bounded in-memory LRU and optionally persisted to a SQLite file that can be shared by multiple processes"""
+
+    def __init__(self, path = None, size = 10000, ttl = None, negative_ttl = 3600):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_memory'] = collections.OrderedDict()
+        state['_lock'] = None
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Returns the connection of this process to the cache file in WAL mode, or None when the cache is only held in memory"""
+        if self.path is None:
+            return None
+        if self._pid != os.getpid():
+            import sqlite3
+            self._conn = sqlite3.connect(self.path, timeout = 60, check_same_thread = False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS geocache (key TEXT PRIMARY KEY, value TEXT, created REAL, negative INTEGER)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _expired(self, created, negative):
+        ttl = self.negative_ttl if negative else self.ttl
+        return ttl is not None and time.time() - created > ttl
+
+    def get(self, key):
+        """Returns a (found, value) tuple for a cache key"""
+        with self._lock:
+            if key in self._memory:
+                value, created, negative = self._memory[key]
+                if not self._expired(created, negative):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self._count('geocache_hits')
+                    return True, value
+                del self._memory[key]
+            conn = self._connection()
+            if conn is not None:
+                import sqlite3
+                try:
+                    row = conn.execute("SELECT value, created, negative FROM geocache WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.error("Could not read from geocoding cache " + self.path, exc_info=e)
+                    row = None
+                if row is not None and not self._expired(row[1], row[2]):
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1], row[2])
+                    self.hits += 1
+                    self._count('geocache_hits')
+                    return True, value
+            self.misses += 1
+            self._count('geocache_misses')
+            return False, None
+
+    def _count(self, name):
+        metrics = GetMetrics()
+        if metrics is not None:
+            metrics.count(name)
+
+    def put(self, key, value, negative = False):
+        """Stores a geocoder response, negative responses (lookups that found nothing) expire after negative_ttl"""
+        if negative and self.negative_ttl == 0:
+            return
+        created = time.time()
+        with self._lock:
+            self._remember(key, value, created, negative)
+            conn = self._connection()
+            if conn is not None:
+                import sqlite3
+                try:
+                    conn.execute("INSERT OR REPLACE INTO geocache VALUES (?, ?, ?, ?)", (key, json.dumps(value), created, 1 if negative else 0))
+                    conn.commit()
+                except sqlite3.Error as e:
+                    logger.error("Could not write to geocoding cache " + self.path, exc_info=e)
+
+    def _remember(self, key, value, created, negative):
+        self._memory[key] = (value, created, negative)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last = False)
+
+def NormalizeQuery(q):
+    """Function that normalizes a query string produced by BuildAddress so equivalent addresses share a cache key"""
+    return '&'.join(sorted(p.strip().lower() for p in q.split('&') if p.strip() != ''))
+
+def GeoCacheFromConfig(config):
+    """Function that builds a GeoCache from the GEOCACHE settings of a config"""
+    return GeoCache(config.get('GEOCACHE'), config.get('GEOCACHE_SIZE', 10000), config.get('GEOCACHE_TTL'), config.get('GEOCACHE_NEGATIVE_TTL', 3600))
+
+_geocache = GeoCache()
+
+def GetGeoCache():
+    """Function that returns the geocoding cache used by AddressQuery and LatLonQuery"""
+    return _geocache
+
+def SetGeoCache(cache):
+    """Function that replaces the geocoding cache used by AddressQuery and LatLonQuery"""
+    global _geocache
+    _geocache = cache
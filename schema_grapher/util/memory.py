@@ -0,0 +1,65 @@
+import sys
+import resource
+import logging
+
+logger = logging.getLogger(__name__)
+
+def ProcessRSS(pid = None):
+    """Function that returns the resident memory of a process in MB, or None where /proc cannot be read"""
+    try:
+        with open('/proc/{}/status'.format(pid if pid is not None else 'self')) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, ValueError):
+        pass
+    return None
+
+def PeakRSS(children = False):
+    """Function that returns the peak resident memory in MB of this process, or of its largest finished child process"""
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 1024.0 / 1024.0 if sys.platform == 'darwin' else peak / 1024.0
+
+def RowsSize(rows):
+    """Function that estimates the memory in MB taken by a list of rows from a sample of them"""
+    if len(rows) == 0:
+        return 0.0
+    sample = rows[:: max(1, len(rows) // 100)]
+    size = sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r) for r in sample)
+    return size / len(sample) * len(rows) / 1024.0 / 1024.0
+
+class MemoryBudget(object):
+    """Keeps the chunks in flight in a run of ParseConfigMulti within a budget for the resident memory of the parent and the workers together, without a limit any number of chunks may be in flight"""
+
+    def __init__(self, limit = None):
+        self.limit = limit
+        self.chunk = None
+        self.peak = 0.0
+
+    def observe(self, size):
+        """Records the estimated memory in MB a chunk takes while it is in flight"""
+        self.chunk = max(self.chunk or 0.0, size)
+
+    def used(self, pids):
+        """Returns the resident memory in MB of this process and the given processes, and records its peak"""
+        used = sum(ProcessRSS(p) or 0.0 for p in [None] + list(pids))
+        self.peak = max(self.peak, used)
+        return used
+
+    def wait(self, pending, pids):
+        """Returns whether the parent should wait for a chunk in flight to finish before it queues another one"""
+        if self.limit is None or pending == 0:
+            return False
+        if self.chunk is not None and pending >= max(1, int(self.limit / self.chunk)):
+            return True
+        return self.used(pids) + (self.chunk or 0.0) > self.limit
+
+    def report(self, workers = True):
+        """Logs the peak memory of the run"""
+        message = "Peak memory: {:.0f} MB".format(PeakRSS())
+        if workers:
+            message += " in the parent, {:.0f} MB in the largest worker".format(PeakRSS(children = True))
+        if self.limit is not None:
+            message += ", {:.0f} MB sampled in total with a budget of {} MB".format(self.peak, self.limit)
+        logger.info(message)
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Metrics(object):
+    """Timers and counters of the stages of a run. Timers are named stage or stage.name (for example bind.Echo or parse.Decimal) and record the number of calls and the seconds spent, counters record rows, triples, parse failures and cache hits. The metrics of the workers of a multiprocess run are merged into those of the parent."""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, calls = 1):
+        """Records calls to the timer name that took seconds in total"""
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0]
+            timer[0] += calls
+            timer[1] += seconds
+
+    def count(self, name, n = 1):
+        """Adds n to the counter name"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Times the block it is used with"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timed(self, name, function):
+        """Returns function wrapped so every call is recorded by the timer name"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def iterate(self, name, items):
+        """Yields the items of an iterable, recording the time taken to produce each of them by the timer name"""
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            item = next(items, StopIteration)
+            self.add(name, time.perf_counter() - start)
+            if item is StopIteration:
+                return
+            yield item
+
+    def take(self):
+        """Returns the timers and counters recorded so far and starts over, a worker hands them to the parent after every chunk"""
+        with self._lock:
+            snapshot = {'timers' : self.timers, 'counters' : self.counters}
+            self.timers = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Adds the timers and counters returned by take"""
+        for name, (calls, seconds) in snapshot['timers'].items():
+            self.add(name, seconds, calls)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+
+    def report(self):
+        """Returns the metrics as a dictionary"""
+        with self._lock:
+            return {
+                'started' : self.started,
+                'seconds' : time.time() - self.started,
+                'timers' : {k : {'calls' : v[0], 'seconds' : v[1]} for k, v in sorted(self.timers.items())},
+                'counters' : dict(sorted(self.counters.items())),
+            }
+
+    def write(self, directory):
+        """Writes the JSON report metrics.json and the Prometheus textfile metrics.prom to a directory"""
+        os.makedirs(directory, exist_ok = True)
+        report = self.report()
+        with open(os.path.join(directory, 'metrics.json'), 'w') as f:
+            json.dump(report, f, indent = 2)
+        with open(os.path.join(directory, 'metrics.prom.tmp'), 'w') as f:
+            f.write(PrometheusText(report))
+        # the node exporter may read the textfile at any time, so it is replaced in one step
+        os.replace(os.path.join(directory, 'metrics.prom.tmp'), os.path.join(directory, 'metrics.prom'))
+        logger.info("Wrote metrics to " + directory)
+
+def PrometheusText(report):
+    """Function that renders a metrics report in the Prometheus text exposition format"""
+    lines = [
+        '# HELP schema_grapher_run_seconds Wall clock seconds of the run.',
+        '# TYPE schema_grapher_run_seconds gauge',
+        'schema_grapher_run_seconds {:.6f}'.format(report['seconds']),
+        '# HELP schema_grapher_stage_calls_total Calls to each stage of the conversion.',
+        '# TYPE schema_grapher_stage_calls_total counter',
+    ]
+    labels = {k : PrometheusLabels(k) for k in report['timers'].keys()}
+    lines += ['schema_grapher_stage_calls_total{{{}}} {}'.format(labels[k], v['calls']) for k, v in report['timers'].items()]
+    lines += [
+        '# HELP schema_grapher_stage_seconds_total Seconds spent in each stage of the conversion, summed over the workers.',
+        '# TYPE schema_grapher_stage_seconds_total counter',
+    ]
+    lines += ['schema_grapher_stage_seconds_total{{{}}} {:.6f}'.format(labels[k], v['seconds']) for k, v in report['timers'].items()]
+    for k, v in report['counters'].items():
+        lines += ['# TYPE schema_grapher_{}_total counter'.format(k), 'schema_grapher_{}_total {}'.format(k, v)]
+    return "\n".join(lines) + "\n"
+
+def PrometheusLabels(name):
+    """Function that returns the stage and name labels of a timer"""
+    stage, _, name = name.partition('.')
+    return 'stage="{}",name="{}"'.format(stage, name.replace('\\', '\\\\').replace('"', '\\"'))
+
+def MetricsFromConfig(config):
+    """Function that returns a Metrics when METRICS is set in a config, otherwise None"""
+    return Metrics() if config.get('METRICS') is not None else None
+
+def StartProfile(config):
+    """Function that starts cProfile when METRICS_PROFILE is set in a config and returns the profile, otherwise None"""
+    if config.get('METRICS') is None or config.get('METRICS_PROFILE') != True:
+        return None
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+def StopProfile(config, profile, name):
+    """Function that stops a profile returned by StartProfile and dumps it to METRICS/profile_<name>.prof"""
+    if profile is None:
+        return
+    profile.disable()
+    os.makedirs(config['METRICS'], exist_ok = True)
+    profile.dump_stats(os.path.join(config['METRICS'], 'profile_{}.prof'.format(name)))
+
+_metrics = None
+
+def GetMetrics():
+    """Function that returns the metrics of this process, or None when they are not recorded"""
+    return _metrics
+
+def SetMetrics(metrics):
+    """Function that replaces the metrics of this process"""
+    global _metrics
+    _metrics = metrics
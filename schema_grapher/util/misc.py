@@ -1,17 +1,27 @@
+import io
+import re
 import json
+import mmap
 import codecs
-import urllib
+import urllib.parse
 import random
 import csv
 import os
 import hashlib
 import logging
 
+from schema_grapher.util.geocache import GetGeoCache, NormalizeQuery
+
 logger = logging.getLogger(__name__)
 
 def AddressQuery(q, saddress = 'https://nominatim.openstreetmap.org'):
-    """Function to geolocate an address using a nominatim server"""
+    """Function to geolocate an address using a nominatim server, responses are cached by normalized query"""
     nominatim = saddress.rstrip('/') + '/search?format=geojson&limit=1&addressdetails=1&'
+    key = nominatim + NormalizeQuery(q)
+    found, data = GetGeoCache().get(key)
+    if found:
+        return data
+    import urllib.request
     try:
         logger.debug("Calling Address query with data:" + nominatim + q)
         qr = urllib.request.urlopen(nominatim + q)
@@ -20,14 +30,23 @@ def AddressQuery(q, saddress = 'https://nominatim.openstreetmap.org'):
         logger.error('Nominatim returned a 500 HTTP error for this url (skipping this line of data):' + nominatim + q)
         return {}
     data = json.loads(qr.read())
+    GetGeoCache().put(key, data, negative = type(data) is not dict or len(data.get('features', [])) == 0)
     return data
 
 def LatLonQuery(lat, lon, saddress = 'https://nominatim.openstreetmap.org'):
     """Function to perform a reverse lookup on a latitude and longitude and determine street address."""
     nominatim = saddress.rstrip('/') + '/reverse?format=geojson&zoom=18&addressdetails=1'
-    qr = urllib.request.urlopen(nominatim + '&lat=' + urllib.parse.quote_plus(str(lat)) + '&lon=' + urllib.parse.quote_plus(str(lon)))
+    q = '&lat=' + urllib.parse.quote_plus(str(lat)) + '&lon=' + urllib.parse.quote_plus(str(lon))
+    key = nominatim + q
+    found, data = GetGeoCache().get(key)
+    if found:
+        return data
+    import urllib.request
+    qr = urllib.request.urlopen(nominatim + q)
     data = json.loads(qr.read())
-    return [data] if type(data) == dict else data
+    data = [data] if type(data) == dict else data
+    GetGeoCache().put(key, data, negative = len(data) == 0 or 'error' in data[0])
+    return data
 
 def ReadCSV(rawfile):
     """Function to read a CSV lazy"""
@@ -37,10 +56,114 @@ def ReadCSV(rawfile):
             for row in csv_reader:
                 if "".join(row) != "":
                     yield CleanRow(row)
-        except:
+        except Exception:
             logger.error("Missed Row: " + rawfile)
             yield ""
 
+def ReadCSVHeader(rawfile):
+    """Function that reads the header of a CSV, the first row that is not empty, and closes the file"""
+    with codecs.open(rawfile, 'r', encoding='utf-8', errors='ignore') as f:
+        for row in csv.reader(f, delimiter=',', quotechar='"'):
+            if "".join(row) != "":
+                return CleanRow(row)
+    return []
+
+def ReadCSVStream(stream, name = '<stdin>'):
+    """Function to read the rows of a CSV lazy from an open text stream such as stdin or a named pipe, skipping empty rows in the same way as ReadCSV"""
+    csv_reader = csv.reader(stream, delimiter=',', quotechar='"')
+    try:
+        for row in csv_reader:
+            if "".join(row) != "":
+                yield CleanRow(row)
+    except Exception:
+        logger.error("Missed Row: " + name)
+        yield ""
+
+def ReadCSVBytes(data):
+    """Function to read CSV rows lazy from a bytes object, skipping empty rows in the same way as ReadCSV"""
+    reader = codecs.getreader('utf-8')(io.BytesIO(data), errors='ignore')
+    csv_reader = csv.reader(reader, delimiter=',', quotechar='"')
+    for row in csv_reader:
+        if "".join(row) != "":
+            yield CleanRow(row)
+
+def ReadCSVRange(rawfile, start, end):
+    """Function to read the rows of a CSV lazy between two byte offsets that are record starts"""
+    with open(rawfile, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    try:
+        for row in ReadCSVBytes(data):
+            yield row
+    except Exception:
+        logger.error("Missed Row: " + rawfile)
+        yield ""
+
+# a line that holds no field that is not empty, unless it is inside a quoted field
+EMPTY_LINE = re.compile(rb'^(?:"")?(?:,(?:"")?)*\r?\n', re.M)
+
+def CountCSVBytes(data):
+    """Function to count the rows ReadCSVBytes yields from a bytes object of whole records without parsing them, newlines between an odd and an even quote are inside a field"""
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    count = sum(part.count(b'\n') for part in data.split(b'"')[::2])
+    quotes = 0
+    pos = 0
+    for m in EMPTY_LINE.finditer(data):
+        quotes += data.count(b'"', pos, m.start())
+        pos = m.start()
+        if quotes % 2 == 0:
+            count -= 1
+    return count
+
+def NextRecordStart(mm, pos, inquote = False):
+    """Function that returns the offset after the first newline at or after pos that is not inside a quoted field"""
+    while True:
+        q = mm.find(b'"', pos)
+        if inquote:
+            if q == -1:
+                return len(mm)
+            inquote = False
+        else:
+            n = mm.find(b'\n', pos)
+            if n == -1:
+                return len(mm)
+            if q == -1 or n < q:
+                return n + 1
+            inquote = True
+        pos = q + 1
+
+def CSVRecordStarts(rawfile, rows, sample = 1000):
+    """Function that memory maps a CSV and returns the byte offsets of record starts splitting it into slices of roughly the given number of rows, and the number of rows of every slice. The first offset is the end of the header and the last is the end of the file. Boundaries are found by tracking quotes, so newlines inside quoted fields are respected."""
+    if os.path.getsize(rawfile) == 0:
+        return [0], []
+    with open(rawfile, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < len(mm):
+                end = NextRecordStart(mm, start)
+                header = next(ReadCSVBytes(mm[start:end]), None)
+                start = end
+                if header is not None:
+                    break
+            pos = start
+            records = 0
+            while records < sample and pos < len(mm):
+                pos = NextRecordStart(mm, pos)
+                records += 1
+            size = max(1, (pos - start) * (rows + 1) // max(1, records))
+            starts = [start]
+            counts = []
+            while starts[-1] < len(mm):
+                target = min(starts[-1] + size, len(mm))
+                inquote = mm[starts[-1]:target].count(b'"') % 2 == 1
+                starts += [NextRecordStart(mm, target, inquote) if target < len(mm) else target]
+                counts += [CountCSVBytes(mm[starts[-2]:starts[-1]])]
+        finally:
+            mm.close()
+    return starts, counts
+
 def CleanRow(row):
     """Function to clean a CSV row of various control characters"""
     return [i.strip("\ufeff").replace("\r", " ").replace("\n", " ") for i in row]
@@ -53,7 +176,7 @@ def generate_md5(local_filepath):
     """Function to generate the md5 hash of a file"""
     hasher = hashlib.md5()
     with open(local_filepath, 'rb') as rf:
-        for chunk in iter(lambda: rf.read(4096), b""):
+        for chunk in iter(lambda: rf.read(1 << 20), b""):
             hasher.update(chunk)
     final_hash = hasher.hexdigest()
     return final_hash
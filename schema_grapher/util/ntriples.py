@@ -0,0 +1,96 @@
+import math
+import json
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+XSDINTEGER = '^^<' + XSD + 'integer>'
+XSDDOUBLE = '^^<' + XSD + 'double>'
+XSDBOOLEAN = '^^<' + XSD + 'boolean>'
+XSDDATETIME = '^^<' + XSD + 'dateTime>'
+XSDDATE = '^^<' + XSD + 'date>'
+GEOJSON = '^^<http://schema.localhost/GeoJSON>'
+
+# characters that must be escaped inside an N-Triples STRING_LITERAL_QUOTE
+ESCAPES = str.maketrans({'"' : '\\"', '\\' : '\\\\', '\n' : '\\n', '\r' : '\\r'})
+
+def StringLiteral(s):
+    """Function that renders a string as an N-Triples plain literal"""
+    return '"' + s.translate(ESCAPES) + '"'
+
+def IntegerLiteral(i):
+    """Function that renders an integer as an N-Triples xsd:integer literal"""
+    return '"' + str(int(i)) + '"' + XSDINTEGER
+
+def DoubleLiteral(f):
+    """Function that renders a float as an N-Triples xsd:double literal"""
+    if math.isnan(f):
+        lexical = 'NaN'
+    elif math.isinf(f):
+        lexical = 'INF' if f > 0 else '-INF'
+    else:
+        lexical = repr(float(f))
+    return '"' + lexical + '"' + XSDDOUBLE
+
+def BooleanLiteral(b):
+    """Function that renders a boolean as an N-Triples xsd:boolean literal"""
+    return '"true"' + XSDBOOLEAN if b else '"false"' + XSDBOOLEAN
+
+def DateTimeLiteral(d):
+    """Function that renders a datetime as an N-Triples xsd:dateTime literal"""
+    return '"' + d.isoformat() + '"' + XSDDATETIME
+
+def DateLiteral(d):
+    """Function that renders a date as an N-Triples xsd:date literal"""
+    return '"' + d.isoformat() + '"' + XSDDATE
+
+def GeoJSONLiteral(obj):
+    """Function that renders a GeoJSON object as an N-Triples literal typed with the schema GeoJSON datatype"""
+    return StringLiteral(json.dumps(obj)) + GEOJSON
+
+SERIALIZERS = {
+    str : StringLiteral,
+    bool : BooleanLiteral,
+    int : IntegerLiteral,
+    float : DoubleLiteral,
+    datetime.datetime : DateTimeLiteral,
+    datetime.date : DateLiteral,
+}
+
+def FallbackLiteral(value):
+    """Function that renders any other value with rdflib"""
+    import rdflib
+    return rdflib.Literal(value).n3()
+
+def NTLiteral(value):
+    """Function that renders a python value as an N-Triples literal with the datatype rdflib would give it"""
+    serializer = SERIALIZERS.get(type(value))
+    if serializer is None:
+        if hasattr(value, 'n3'):
+            # rdflib terms are str subclasses that render themselves with their language tag or datatype
+            return value.n3()
+        for t, s in SERIALIZERS.items():
+            if isinstance(value, t):
+                serializer = s
+                break
+        else:
+            serializer = FallbackLiteral
+    return serializer(value)
+
+def NTLiterals(values):
+    """Function that renders a column of python values as N-Triples literals, resolving the serializer once for each run of values of the same type"""
+    literals = []
+    vtype = None
+    serializer = None
+    for v in values:
+        if type(v) is not vtype:
+            vtype = type(v)
+            serializer = SERIALIZERS.get(vtype, NTLiteral)
+        literals += [serializer(v)]
+    return literals
+
+def StringLiterals(values):
+    """Function that renders a column of strings as N-Triples plain literals"""
+    return ['"' + s.translate(ESCAPES) + '"' for s in values]
@@ -0,0 +1,227 @@
+import io
+import os
+import gzip
+import json
+import time
+import zlib
+import random
+import shutil
+import threading
+import logging
+
+from schema_grapher.util.misc import generate_md5
+from schema_grapher.util.metrics import GetMetrics
+
+logger = logging.getLogger(__name__)
+
+SUFFIXES = {None : '', 'none' : '', 'gzip' : '.gz', 'zstd' : '.zst'}
+
+def OutputName(fname, compression = None):
+    """Function that returns the name of the file written for an output chunk with the given compression"""
+    if compression not in SUFFIXES.keys():
+        raise Exception("Unknown output compression: " + str(compression))
+    return fname + SUFFIXES[compression]
+
+def OpenOutput(fname, compression = None, buffering = 1 << 20):
+    """Function that opens an output chunk for writing N-Triples text, compressing it as it is written"""
+    path = OutputName(fname, compression)
+    if compression == 'gzip':
+        raw = gzip.GzipFile(path, 'wb', compresslevel = 6)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstd output compression requires the zstandard package")
+        raw = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd = True)
+    else:
+        return open(path, 'w', buffering = buffering)
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffer_size = buffering), encoding = 'utf-8')
+
+def PartitionName(fname, k):
+    """Function that returns the name of the piece of partition k of an output chunk"""
+    return os.path.splitext(fname)[0] + '.p' + str(k) + '.nt'
+
+def PartitionCountsName(fname):
+    """Function that returns the name of the file holding the triple count of every partition piece of an output chunk"""
+    return os.path.splitext(fname)[0] + '.partitions.json'
+
+class PartitionedOutput(object):
+    """Output of a chunk split into n partition pieces by a stable hash of the subject of every triple, so each partition holds a disjoint set of subjects. Every piece has its own write buffer, and the triple counts of the pieces are saved next to them when the output is closed."""
+
+    def __init__(self, fname, n, compression = None, buffering = 1 << 20):
+        self.fname = fname
+        self.n = n
+        self.counts = [0] * n
+        # the pieces share the write buffer of a chunk
+        self._files = [OpenOutput(PartitionName(fname, k), compression, max(1 << 16, buffering // n)) for k in range(n)]
+
+    def write_triples(self, triples, render):
+        """Writes a list of triples, rendered by render, to the pieces of their subjects"""
+        groups = {}
+        subject = None
+        for t in triples:
+            if t[0] != subject:
+                subject = t[0]
+                k = zlib.crc32(subject.encode('utf-8')) % self.n
+            groups.setdefault(k, []).append(t)
+        for k, group in groups.items():
+            self._files[k].write(render(group))
+            self.counts[k] += len(group)
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        with open(PartitionCountsName(self.fname), 'w') as f:
+            json.dump(self.counts, f)
+
+def MergePartitions(outputdir, chunks, n, compression = None):
+    """Function that concatenates the pieces of the chunks, in order, into one file per partition named partition_<k>.nt in outputdir and removes the pieces. Plain and compressed pieces both stay valid when concatenated, so nothing is decompressed. Returns the file and triple count of every partition, or None when the pieces of a chunk are missing."""
+    missing = [c for c in chunks if not os.path.exists(PartitionCountsName(c))]
+    if len(missing) == len(chunks) and all(os.path.exists(OutputName(os.path.join(outputdir, 'partition_' + str(k) + '.nt'), compression)) for k in range(n)):
+        logger.info("The partitions in {} are already merged".format(outputdir))
+        return None
+    if len(missing) > 0:
+        logger.error("Not merging the partitions, the pieces of {} chunks are missing (e.g. {})".format(len(missing), missing[0]))
+        return None
+    counts = [0] * n
+    for c in chunks:
+        with open(PartitionCountsName(c)) as f:
+            counts = [a + b for a, b in zip(counts, json.load(f))]
+    partitions = []
+    for k in range(n):
+        path = OutputName(os.path.join(outputdir, 'partition_' + str(k) + '.nt'), compression)
+        with open(path + '.tmp', 'wb') as out:
+            for c in chunks:
+                with open(OutputName(PartitionName(c, k), compression), 'rb') as piece:
+                    shutil.copyfileobj(piece, out, 1 << 20)
+        os.replace(path + '.tmp', path)
+        partitions += [{'partition' : k, 'file' : path, 'triples' : counts[k]}]
+    for c in chunks:
+        for k in range(n):
+            os.remove(OutputName(PartitionName(c, k), compression))
+        os.remove(PartitionCountsName(c))
+    return partitions
+
+def SubmitPartitions(config, uploader, chunks):
+    """Function that merges the partition pieces of the chunks of a run, queues the partitions for upload and records their triple counts in the manifest"""
+    partitions = MergePartitions(config['OUTPUTDIR'], chunks, config['PARTITIONS'], config.get('OUTPUT_COMPRESSION'))
+    if partitions is None:
+        return
+    for p in partitions:
+        logger.info("Partition {}: {} triples".format(p['partition'], p['triples']))
+        uploader.submit(p['file'], ObjectName(config, p['file']))
+    uploader.partitions = partitions
+
+class S3Backend(object):
+    """Upload backend that stores objects in S3 through schema_grapher.util.s3, the managed transfer of the S3 client splits large files into multipart uploads"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def upload(self, path, key):
+        s3 = getattr(self._local, 's3', None)
+        if s3 is None:
+            from schema_grapher.util.s3 import S3
+            logger.info("Connecting to AWS S3.")
+            s3 = self._local.s3 = S3()
+        # files that were not compressed as they were written are still zipped on upload
+        s3.upload_file(path, key, zip = not path.endswith((SUFFIXES['gzip'], SUFFIXES['zstd'])))
+
+class LocalBackend(object):
+    """Upload backend that copies objects into a local directory, a stand-in for S3 when testing"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def upload(self, path, key):
+        dest = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok = True)
+        shutil.copyfile(path, dest + '.part')
+        os.replace(dest + '.part', dest)
+
+class Uploader(object):
+    """Uploads finished output chunks on a bounded pool of background threads with retries, and records every upload in a manifest"""
+
+    def __init__(self, backend, concurrency = 4, retries = 3, backoff = 1.0, manifest = None):
+        self.backend = backend
+        self.retries = retries
+        self.backoff = backoff
+        self.manifest = manifest
+        self.entries = []
+        self.partitions = None
+        self._futures = []
+        self._executor = None
+        if backend is not None:
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = concurrency)
+
+    def submit(self, path, key, done = None):
+        """Queues a finished file for upload under key and returns immediately, done is called without arguments once the file is uploaded (or at once without a backend)"""
+        if self._executor is None:
+            self.entries += [self._entry(path, key)]
+            if done is not None:
+                done()
+        else:
+            self._futures += [self._executor.submit(self._upload, path, key, done)]
+
+    def _entry(self, path, key):
+        return {'key' : key, 'file' : path, 'size' : os.path.getsize(path), 'md5' : generate_md5(path), 'uploaded' : False}
+
+    def _upload(self, path, key, done = None):
+        entry = self._entry(path, key)
+        # only the transfer is retried, an error of done is raised by close
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+            try:
+                logger.info("Uploading {} to {}".format(path, key))
+                if GetMetrics() is not None:
+                    with GetMetrics().timer('upload'):
+                        self.backend.upload(path, key)
+                else:
+                    self.backend.upload(path, key)
+            except Exception as e:
+                logger.error("Upload of {} failed (attempt {})".format(path, attempt + 1), exc_info=e)
+                if GetMetrics() is not None:
+                    GetMetrics().count('upload_failures')
+                continue
+            entry['uploaded'] = True
+            break
+        if entry['uploaded'] and done is not None:
+            done()
+        return entry
+
+    def close(self):
+        """Waits for the queued uploads, writes the manifest (with the triple counts of the partitions of a partitioned run) and returns its entries, raising the error of a done callback that failed"""
+        if self._executor is not None:
+            self._executor.shutdown()
+        futures, self._futures = self._futures, []
+        self.entries += [f.result() for f in futures]
+        if self.manifest is not None:
+            manifest = {'objects' : self.entries}
+            if self.partitions is not None:
+                manifest['partitions'] = self.partitions
+            with open(self.manifest, 'w') as f:
+                json.dump(manifest, f, indent = 2)
+        failed = [e['file'] for e in self.entries if self.backend is not None and not e['uploaded']]
+        if len(failed) > 0:
+            logger.error("Failed to upload: " + ", ".join(failed))
+        return self.entries
+
+def UploaderFromConfig(config):
+    """Function that builds the Uploader selected by the UPLOAD settings of a config"""
+    backend = config.get('UPLOAD_BACKEND', 's3')
+    if backend == 's3':
+        backend = S3Backend()
+    elif backend == 'local':
+        backend = LocalBackend(config['UPLOAD_DIR'])
+    elif backend == 'none':
+        backend = None
+    else:
+        raise Exception("Unknown upload backend: " + str(backend))
+    manifest = config.get('UPLOAD_MANIFEST', os.path.join(config['OUTPUTDIR'], 'manifest.json'))
+    return Uploader(backend, config.get('UPLOAD_CONCURRENCY', 4), config.get('UPLOAD_RETRIES', 3), config.get('UPLOAD_BACKOFF', 1.0), manifest)
+
+def ObjectName(config, path):
+    """Function that returns the object key of an output file, the S3 folder followed by the file name"""
+    return config['S3_FOLDER'] + os.path.split(path)[1]
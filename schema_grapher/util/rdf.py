@@ -1,14 +1,16 @@
 import os
-import copy
+import functools
+import itertools
+import collections
+import heapq
 import uuid
 import hashlib
-import rdflib
 import json
 import datetime
-import dateutil
 import sys
+import time
 import logging
-import urllib
+import urllib.parse
 
 logger = logging.getLogger(__name__)
 
@@ -21,206 +23,562 @@ RDFRANGE = 'http://schema.localhost/rangeIncludes'
 RDFDATATYPE = 'http://schema.localhost/DataType'
 RDFNS = 'http://schema.localhost/'
 
-from schema_grapher.util.bind import ResolveBind
+from schema_grapher.util.bind import ResolveBind, ResolveBindColumn
 from schema_grapher.util.misc import AddressQuery, LatLonQuery
+from schema_grapher.util.geobatch import GetGeocoder
+from schema_grapher.util.ntriples import NTLiteral, NTLiterals, StringLiteral, StringLiterals, IntegerLiteral, DoubleLiteral, BooleanLiteral, DateTimeLiteral, GeoJSONLiteral
+from schema_grapher.util.dates import ColumnDateParser
+from schema_grapher.util.output import OpenOutput, PartitionedOutput
+from schema_grapher.util.sparql import GraphStoreOutput
+from schema_grapher.util.collector import TripleCollector
+from schema_grapher.util.metrics import GetMetrics
+from schema_grapher.util.schema import LoadSchema, PropertyTypes
 
-def PropertyType(schema_jsonld):
-    """Generates a dictionary mapping each attribute of the schema to it's basic type"""
-    pt = {}
-    schema = None
-    if 'http://' in schema_jsonld:
-        try:
-            qr = urllib.request.urlopen(schema_jsonld)
-            schema = json.loads(qr.read().decode())
-        except Exception as e:
-            logger.error("Could not retrieve schema from external server", exc_info=e)
-    elif os.path.exists(schema_jsonld):
-        with open(schema_jsonld) as f:
-            schema = json.load(f)
-    if type(schema) is dict and '@graph' in schema.keys():
-        pt = {i['@id'].replace(RDFNS, '') : i[RDFNS + 'rangeIncludes']['@id'].replace(RDFNS, '') for i in schema['@graph'] if RDFNS + 'rangeIncludes' in i.keys()}
+def PropertyType(schema_jsonld, cache = None, refresh = 3600, timeout = 30):
+    """Generates a dictionary mapping each attribute of the schema to it's basic type, compiled to an artifact in the cache directory when one is given, with the datum converter of each attribute resolved up front"""
+    pt = LoadSchema(schema_jsonld, cache, refresh, timeout)
+    for prop, ptype in pt.items():
+        pt.converters[prop] = BuildConverter(prop, ptype)
     return pt
 
 def ProcessParser(fname, spec, header, rows, offset, pt, deterministic = None):
     """This function parses a set of rows to RDF and writes to the defined output file"""
-    f = open(fname, 'w')
-    for cnt, i in enumerate(rows):
-        if i != "":
-            f.write(RenderTriples(RowTriples(spec, header, i, os.path.split(fname)[1], cnt + offset, pt, deterministic = deterministic)))
+    return ProcessPlan(fname, CompileSpec(spec, header, deterministic = deterministic), rows, offset, pt, deterministic)
+
+def ProcessPlan(fname, plan, rows, offset, pt, deterministic = None, chunknames = None, compression = None, buffering = 1 << 20, dedup = None, index = None, flush = 10000, partitions = None, store = None):
+    """This function parses a set of rows to RDF using a compiled plan, writes them to the defined output file, and returns the number of rows, triples and dropped duplicates"""
+    if store is not None:
+        f = store.open(fname)
+    elif partitions is not None:
+        f = PartitionedOutput(fname, partitions, compression, buffering)
+    else:
+        f = OpenOutput(fname, compression, buffering)
+    counts = WritePlan(f, fname, plan, rows, offset, pt, deterministic, chunknames, dedup, index, flush)
     f.close()
+    return counts
+
+def WritePlan(f, fname, plan, rows, offset, pt, deterministic = None, chunknames = None, dedup = None, index = None, flush = 10000):
+    """This function parses a set of rows to RDF using a compiled plan like ProcessPlan, but writes the triples to an open text stream, GraphStoreOutput or PartitionedOutput, which is left open. fname is the name of the output the IDs are salted with and the dropped duplicates are reported for."""
+    sname = os.path.split(fname)[1]
+    rowcount = 0
+    metrics = GetMetrics()
+    if type(f) in (PartitionedOutput, GraphStoreOutput):
+        render = RenderTriples if metrics is None else metrics.timed('render', RenderTriples)
+        collector = TripleCollector(dedup, index, lambda triples: f.write_triples(triples, render), flush)
+    elif metrics is None:
+        collector = TripleCollector(dedup, index, lambda triples: f.write(RenderTriples(triples)), flush)
+    else:
+        render = metrics.timed('render', RenderTriples)
+        write = metrics.timed('write', f.write)
+        collector = TripleCollector(dedup, index, lambda triples: write(render(triples)), flush)
+    for cnt, (i, prepared, geocoded) in enumerate(PrepareRows(plan, rows, pt)):
+        if i != "":
+            if chunknames is not None:
+                sname = chunknames[0] + '_' + str((cnt + offset) // (chunknames[1] + 1)) + '.nt'
+            PlanTriples(plan, i, sname, cnt + offset, pt, deterministic = deterministic, geocoded = geocoded, prepared = prepared, collector = collector)
+            rowcount += 1
+    collector.finish()
+    collector.report(fname)
+    if metrics is not None:
+        metrics.count('rows', rowcount)
+        metrics.count('triples', collector.count)
+        metrics.count('duplicates', collector.dropped)
+    return rowcount, collector.count, collector.dropped
 
 def ParseDatum(prop, datum, pt):
     """This function attempts to properly types a datum depending on the type of attribute it is in the schema"""
+    return DatumConverter(prop, pt)(datum)
+
+def DatumConverter(prop, pt):
+    """This function resolves the conversion ParseDatum applies to the datums of a property once and returns it as a function that returns None when a datum cannot be converted, timed by datatype when metrics are recorded"""
+    metrics = GetMetrics()
+    if metrics is None and type(pt) is PropertyTypes:
+        converter = pt.converters.get(prop)
+        if converter is None:
+            converter = pt.converters[prop] = BuildConverter(prop, pt.get(prop))
+        return converter
+    key = (prop, pt[prop] if prop in pt.keys() else None, metrics)
+    converter = _converters.get(key)
+    if converter is None:
+        converter = _converters[key] = BuildConverter(prop, key[1], metrics)
+    return converter
+
+def BuildConverter(prop, ptype, metrics = None):
+    """This function builds the conversion of the datums of a property of a schema datatype, timed by datatype when metrics are given"""
+    if ptype is None:
+        #if schema not available default to using datum type
+        cast = UntypedDatum
+    elif ptype == 'DateTime':
+        cast = functools.partial(DateTimeDatum, ColumnDateParser(prop))
+    elif ptype in DATUMTYPES.keys():
+        cast = DATUMTYPES[ptype]
+    elif prop == 'metaData':
+        cast = MetaDataDatum
+    else:
+        cast = functools.partial(TypedDatum, ptype)
+    if metrics is None:
+        return functools.partial(SafeDatum, cast)
+    return functools.partial(MeasuredDatum, metrics, 'parse.' + (ptype if ptype is not None else 'untyped'), cast)
+
+_converters = {}
+
+def SafeDatum(cast, datum):
+    """This function applies a datum conversion, returning None if it fails"""
     try:
-        pdat = datum
-        if prop in pt.keys():
-            #if schema is availabe use schema attribute type for datum
-            if pt[prop] == 'DateTime':
-                if type(datum) is datetime.datetime:
-                    pdat = WrapDQ(datum)
-                else:
-                    pdat =  WrapDQ(dateutil.parser.parse(datum))
-            elif pt[prop] == 'Decimal':
-                pdat = WrapDQ(float(datum))
-            elif pt[prop] == 'String':
-                pdat = WrapDQ(str(datum))
-            elif pt[prop] == 'Integer':
-                pdat = WrapDQ(int(datum))
-            elif pt[prop] == 'DecimalList':
-                pdat = WrapDQ(float(datum))
-            elif pt[prop] == 'StringList':
-                pdat = WrapDQ(str(datum))
-            elif pt[prop] == 'IntegerList':
-                pdat = WrapDQ(int(datum))
-            elif pt[prop] == 'DecimalSet':
-                pdat = WrapDQ(float(datum))
-            elif pt[prop] == 'StringSet':
-                pdat = WrapDQ(str(datum))
-            elif pt[prop] == 'IntegerSet':
-                pdat = WrapDQ(int(datum))
-            elif pt[prop] == 'Boolean':
-                pdat = WrapDQ(bool(datum))
-            elif pt[prop] == 'GeoJSON':
-                pdat = WrapDQ(str(json.dumps(datum))) + "^^" + WrapNS("GeoJSON")
-            elif prop == 'metaData':
-                pdat = WrapDQ(str(json.dumps(datum)))
-            else:
-                pdat = WrapDQ(str(datum)) + "^^" + WrapNS(pt[prop])
-            return pdat
-        else:
-            #if schema not available default to using datum type
-            if type(datum) is datetime.datetime:
-                pdat = WrapDQ(datum)
-            elif type(datum) is float:
-                pdat = WrapDQ(float(datum))
-            elif type(datum) is str:
-                pdat = WrapDQ(str(datum))
-            elif type(datum) is int:
-                pdat = WrapDQ(int(datum))
-            elif type(datum) is bool:
-                pdat = WrapDQ(bool(datum))
-            elif type(datum) is dict:
-                pdat = WrapDQ(str(json.dumps(datum))) + "^^" + WrapNS("GeoJSON")
-            return pdat
+        return cast(datum)
+    except:
+        return None
+
+def MeasuredDatum(metrics, name, cast, datum):
+    """This function applies a datum conversion like SafeDatum, recording its time and counting the datums that fail"""
+    start = time.perf_counter()
+    try:
+        return cast(datum)
     except:
-        
+        metrics.count('parse_failures')
         return None
+    finally:
+        metrics.add(name, time.perf_counter() - start)
+
+def DateTimeDatum(parser, datum):
+    """This function renders a datum of a DateTime property"""
+    if type(datum) is datetime.datetime:
+        return DateTimeLiteral(datum)
+    return DateTimeLiteral(parser.parse(datum))
+
+def DecimalDatum(datum):
+    """This function renders a datum of a Decimal property"""
+    return DoubleLiteral(float(datum))
+
+def StringDatum(datum):
+    """This function renders a datum of a String property"""
+    return StringLiteral(str(datum))
 
-def DeterministicGensym(deterministic, rowplus, headerplus, template, fname):
-    """This function generates UUID for the gensyms in an annotation template based on their dependency relationship"""
-    ntemplate = []
+def IntegerDatum(datum):
+    """This function renders a datum of an Integer property"""
+    return IntegerLiteral(int(datum))
+
+def BooleanDatum(datum):
+    """This function renders a datum of a Boolean property"""
+    return BooleanLiteral(bool(datum))
+
+def GeoJSONDatum(datum):
+    """This function renders a datum of a GeoJSON property"""
+    return GeoJSONLiteral(datum)
+
+def MetaDataDatum(datum):
+    """This function renders the metaData property"""
+    return WrapDQ(str(json.dumps(datum)))
+
+def TypedDatum(ptype, datum):
+    """This function renders a datum of a property with any other schema type"""
+    return WrapDQ(str(datum)) + "^^" + WrapNS(ptype)
+
+def UntypedDatum(datum):
+    """This function renders a datum of a property that is not in the schema depending on its python type"""
+    if type(datum) is dict:
+        return GeoJSONDatum(datum)
+    elif type(datum) in (datetime.datetime, float, str, int, bool):
+        return WrapDQ(datum)
+    return datum
+
+DATUMTYPES = {
+    'Decimal' : DecimalDatum,
+    'String' : StringDatum,
+    'Integer' : IntegerDatum,
+    'DecimalList' : DecimalDatum,
+    'StringList' : StringDatum,
+    'IntegerList' : IntegerDatum,
+    'DecimalSet' : DecimalDatum,
+    'StringSet' : StringDatum,
+    'IntegerSet' : IntegerDatum,
+    'Boolean' : BooleanDatum,
+    'GeoJSON' : GeoJSONDatum,
+}
+
+# the serializer that renders the plain datums of a column of a datatype together, and the python types of the datums it renders as its converter would
+COLUMN_SERIALIZERS = {
+    'String' : (StringLiterals, (str,)),
+    'StringList' : (StringLiterals, (str,)),
+    'StringSet' : (StringLiterals, (str,)),
+    None : (NTLiterals, (str, int, float, bool, datetime.datetime)),
+}
+
+def DeterministicGensym(deterministic, rowplus, headerplus, order, fname, idhash = None):
+    """This function generates UUID for the gensyms in an annotation template based on their dependency relationship, order is the GensymOrder of the template (or the template itself) and idhash is md5 (the default) or blake2b"""
+    if type(order) is not GensymOrder:
+        order = CompileGensymOrder(order)
+    salt = fname if deterministic == "FILE" else ""
+    values = []
+    for step in order.steps:
+        fields = []
+        for ref, k in step:
+            if ref:
+                fields += [values[k]]
+            else:
+                ix = headerplus[k]
+                fields += [(rowplus[ix] if rowplus[ix] != None else '') if len(rowplus) - 1 >= ix else '']
+        values += [GensymID(fields, salt, idhash)]
+    return {g : values[ix] for g, ix in order.gensyms}
+
+GensymOrder = collections.namedtuple('GensymOrder', ['steps', 'gensyms'])
+
+def CompileGensymOrder(template):
+    """This function orders the gensyms of an annotation template so that each is derived after the gensyms it depends on, raising an error for cycles and undefined gensyms. Each step is a tuple of (ref, key) fields, where key is the index of an earlier step when ref is set and a column otherwise, and gensyms maps every gensym to the step its ID is taken from."""
+    entries = []
     for i in template:
         gensym = [v for k,v in i[1].items() if k == "GENSYM"][0]
-        ntemplate += [[gensym, [k if "GENSYM_" in k else ((rowplus[headerplus[k]] if rowplus[headerplus[k]] != None else '')if len(rowplus)-1 >= headerplus[k] else '') for k,v in i[1].items() if k != "GENSYM"]]]
-        
-    gsMap = {i[0] : None for i in ntemplate}
-    
-    while(None in gsMap.values()):
-        obj = ntemplate.pop()
-        resolved = True
-        for ix,i in enumerate(obj[1]):
-            if "GENSYM_" in i:
-                if gsMap[i.split('_')[-1]] != None:
-                    obj[1][ix] = gsMap[i.split('_')[-1]]
-                else:
-                    resolved = False
-        if resolved == True:
-            if deterministic == "GLOBAL":
-                gsMap[obj[0]] = str(uuid.UUID(hashlib.md5(json.dumps(obj[1]).encode("utf-8")).hexdigest()))
-            elif deterministic == "FILE":
-                gsMap[obj[0]] = str(uuid.UUID(hashlib.md5((json.dumps(obj[1]) + fname).encode("utf-8")).hexdigest()))
-        ntemplate.insert(0,obj)
-            
-    return gsMap
-        
+        entries += [(gensym, [(True, k.split('_')[-1]) if "GENSYM_" in k else (False, k) for k in i[1].keys() if k != "GENSYM"])]
+    names = set(g for g, fields in entries)
+    for g, fields in entries:
+        for ref, k in fields:
+            if ref and k not in names:
+                raise Exception("Deterministic IDs: GENSYM {} refers to GENSYM {} which is not defined in its template".format(g, k))
+    # Kahn's algorithm, an entry is ready once every gensym it refers to has an ID. The resolution loop this replaces visited the
+    # entries round robin from the last one, and the ready entries are taken in the order it reached them so IDs stay unchanged: at is
+    # the first visit to an entry from a time on and last the latest up to a time, a reference takes the ID of the entry of its gensym
+    # visited last before its own entry was first visited with that gensym resolved, and the loop stopped once every gensym had an ID.
+    n = len(entries)
+    at = lambda e, t: t + (n - 1 - e - t) % n
+    last = lambda e, t: t - (t - (n - 1 - e)) % n
+    waiting = [len(set(k for ref, k in fields if ref)) for g, fields in entries]
+    dependents = collections.defaultdict(list)
+    byname = collections.defaultdict(list)
+    for e, (g, fields) in enumerate(entries):
+        byname[g] += [e]
+        for k in set(k for ref, k in fields if ref):
+            dependents[k] += [e]
+    ready = [(at(e, 0), e) for e in range(n) if waiting[e] == 0]
+    heapq.heapify(ready)
+    first = {}
+    resolved = {}
+    while ready and len(resolved) < len(names):
+        t, e = heapq.heappop(ready)
+        first[e] = t
+        g = entries[e][0]
+        if g not in resolved:
+            resolved[g] = t
+            for d in dependents[g]:
+                waiting[d] -= 1
+                if waiting[d] == 0:
+                    heapq.heappush(ready, (at(d, t + 1), d))
+    if len(resolved) < len(names):
+        unresolved = sorted(g for g in names if g not in resolved)
+        raise Exception("Deterministic IDs: cyclic GENSYM dependency between " + ", ".join(unresolved))
+    end = max(resolved.values(), default = 0)
+    order = sorted(first, key = first.get)
+    stepof = {e : ix for ix, e in enumerate(order)}
+    writer = lambda g, t: stepof[max((x for x in byname[g] if x in first and first[x] < t), key = lambda x: last(x, t - 1))]
+    steps = tuple(tuple((True, writer(k, at(e, resolved[k] + 1))) if ref else (False, k) for ref, k in entries[e][1]) for e in order)
+    return GensymOrder(steps, tuple((g, writer(g, end + 1)) for g in sorted(resolved, key = resolved.get)))
+
+def GensymID(fields, salt = "", idhash = None):
+    """This function derives the ID of a gensym from its field values, the md5 of their JSON encoding by default or the blake2b of a length prefixed encoding"""
+    if idhash == None or idhash == "md5":
+        encoded = '[' + ', '.join([JSONSTRING(f) if type(f) is str else json.dumps(f, default = str) for f in fields]) + ']'
+        return str(uuid.UUID(hashlib.md5((encoded + salt).encode("utf-8")).hexdigest()))
+    elif idhash == "blake2b":
+        h = hashlib.blake2b(digest_size = 16)
+        for f in fields + [salt]:
+            b = f.encode("utf-8") if type(f) is str else b'\x00' + json.dumps(f, default = str).encode("utf-8")
+            h.update(len(b).to_bytes(8, 'little'))
+            h.update(b)
+        return str(uuid.UUID(bytes = h.digest()))
+    raise Exception("Unknown ID hash: " + str(idhash))
+
+IDHASHES = (None, "md5", "blake2b")
+
+# json.dumps of a string, json.dumps of a list of field values is kept byte for byte
+JSONSTRING = json.encoder.encode_basestring_ascii
+
 def RowTriples(spec, header, row, fname, cnt, pt, gsMap = None, subiter = None, deterministic = None):
     """This function parses a row of data"""
-    template = copy.deepcopy(spec["TEMPLATE"])
-    rowplus = list(copy.deepcopy(row))
-    headerplus = header
-    gensymMap = copy.deepcopy(gsMap) if gsMap is not None else {}
-    triples = []
-    ltriples = []
-    subiterval = str(subiter) if subiter is not None else ""
+    return PlanTriples(CompileSpec(spec, header, deterministic = deterministic), row, fname, cnt, pt, gsMap, subiter, deterministic)
 
-    for j in spec['BIND'].keys():
-        rowplus += [ResolveBind(spec['BIND'][j], rowplus, headerplus)]
-        headerplus[j] = len(rowplus)-1
+RowPlan = collections.namedtuple('RowPlan', ['template', 'columns', 'header', 'width', 'inherited', 'bindnames', 'binds', 'gensyms', 'classes', 'addresses', 'data', 'hashed', 'geolookup', 'gensymorder', 'idhash'])
+ClassPlan = collections.namedtuple('ClassPlan', ['gensym', 'ops'])
+TypeOp = collections.namedtuple('TypeOp', ['object'])
+LinkOp = collections.namedtuple('LinkOp', ['predicate', 'gensym'])
+DataOp = collections.namedtuple('DataOp', ['prop', 'predicate', 'column', 'index', 'slot'])
+SubOp = collections.namedtuple('SubOp', ['predicate', 'gensym', 'bindgensym', 'iterable', 'plan'])
+
+def CompileSpec(spec, header, inherited = (), width = None, deterministic = None, idhash = None):
+    """This function compiles an annotation spec and a header (from MapHeader) into an immutable plan that is run for every row by PlanTriples. With deterministic IDs the gensym order is compiled too, so a spec whose gensyms cannot be ordered is rejected here."""
+    bindnames = tuple(spec['BIND'].keys())
+    columns = {k : v for k,v in header.items() if k not in bindnames and k not in inherited}
+    if width is None:
+        width = max(columns.values()) + 1 if len(columns) > 0 else 0
+    planheader = RebaseHeader(columns, inherited, bindnames, width)
+    gensyms = []
+    for j in spec['TEMPLATE']:
+        if j[1]['GENSYM'] not in [g[0] for g in gensyms]:
+            gensyms += [(j[1]['GENSYM'], 'BIND' in j[1]['GENSYM'])]
+    classes = []
+    addresses = []
+    data = []
+    for j in spec['TEMPLATE']:
+        ops = []
+        for k,v in j[1].items():
+            if k == "GENSYM":
+                ops += [TypeOp(WrapNS(j[0]))]
+            elif "SUBTEMPLATE" in k:
+                subspec = spec["SUBTEMPLATES"][k.split('.')[0].split('_')[-1]]
+                subgensym = k.split('.')[1].split('_')[-1]
+                iterable = subspec["ITERABLE"][0]
+                subplan = CompileSpec(subspec, columns, tuple(inherited) + bindnames + (iterable[1],), width + len(bindnames) + 1, deterministic, idhash)
+                ops += [SubOp(WrapNS(a), subgensym, 'BIND' in subgensym, iterable[0], subplan) for a in v]
+            elif "GENSYM_" in k:
+                ops += [LinkOp(WrapNS(a), k.split('_')[-1]) for a in v]
+            else:
+                for a in v:
+                    if (a, k) not in data:
+                        data += [(a, k)]
+                    ops += [DataOp(a, WrapNS(a), k, planheader.get(k), data.index((a, k)))]
+        classes += [ClassPlan(j[1]['GENSYM'], tuple(ops))]
+        if j[0] == 'AddressLocation':
+            addresses += [(j[1]['GENSYM'], tuple((v[0], k) for k,v in j[1].items() if k != "GENSYM"))]
+    hashed = "HASHED_IDS" in spec['OPTIONS'].keys() and spec['OPTIONS']['HASHED_IDS'] == True
+    geolookup = "GEOLOOKUP" in spec["OPTIONS"] and spec['OPTIONS']['GEOLOOKUP'] == True
+    if deterministic == "GLOBAL" or deterministic == "FILE":
+        gensymorder = CompileGensymOrder(spec['TEMPLATE'])
+        if idhash not in IDHASHES:
+            raise Exception("Unknown DETERMINISTIC_HASH setting: " + str(idhash))
+    elif deterministic == None or deterministic == "NONE":
+        gensymorder = None
+    else:
+        raise Exception("Unknown DETERMINISTIC_IDS setting: " + str(deterministic))
+    return RowPlan(spec['TEMPLATE'], columns, planheader, width, tuple(inherited), bindnames, tuple(spec['BIND'].values()), tuple(gensyms), tuple(classes), tuple(addresses), tuple(data), hashed, geolookup, gensymorder, idhash)
+
+def RebaseHeader(columns, inherited, bindnames, width):
+    """This function maps the columns of a row of the given width, followed by the values appended by bind functions, to their index"""
+    header = dict(columns)
+    for ix, k in enumerate(inherited):
+        header[k] = width - len(inherited) + ix
+    for ix, k in enumerate(bindnames):
+        header[k] = width + ix
+    return header
+
+def PlanTriples(plan, row, fname, cnt, pt, gsMap = None, subiter = None, deterministic = None, geocoded = None, prepared = None, collector = None):
+    """This function parses a row of data using a plan compiled by CompileSpec and returns the triples of the row that the sink of its collector has not written yet"""
+    if collector is None:
+        collector = TripleCollector()
+    emit = collector.emitter()
+    if prepared is not None:
+        scratch = list(prepared[0])
+        stack = [PlanFrame(plan, scratch, len(row), plan.header, prepared[1], fname, cnt, pt, gsMap, subiter, deterministic, geocoded, collector)]
+    else:
+        scratch = list(row)
+        stack = [PlanFrame(plan, scratch, len(row), None, None, fname, cnt, pt, gsMap, subiter, deterministic, geocoded, collector)]
+    while len(stack) > 0:
+        if collector.flush is not None and len(collector.triples) >= collector.flush:
+            collector.spill()
+        frame = stack[-1]
+        step = next(frame.ops, None)
+        if step is None:
+            collector.merge(frame.start, frame.ltriples)
+            stack.pop()
+            if len(stack) > 0:
+                del scratch[stack[-1].length:]
+            continue
+        classID, op, ix, x = step
+        if type(op) is DataOp and frame.literals is not None:
+            pdatum = frame.literals[op.slot]
+            if type(pdatum) is list:
+                for b in pdatum:
+                    emit((classID, op.predicate, b))
+            elif pdatum is not None:
+                emit((classID, op.predicate, pdatum))
+        elif type(op) is DataOp:
+            try:
+                datum = scratch[op.index if frame.header is frame.plan.header else frame.header[op.column]]
+            except:
+                datum = ''
+            if datum == "":
+                pass
+            elif type(datum) is list:
+                for b in datum:
+                    pdatum = ParseDatum(op.prop, b, pt)
+                    if pdatum is not None:
+                        emit((classID, op.predicate, pdatum))
+            elif datum != None:
+                pdatum = ParseDatum(op.prop, datum, pt)
+                if pdatum is not None:
+                    emit((classID, op.predicate, pdatum))
+        elif type(op) is TypeOp:
+            emit((classID, "<" + RDFTYPE + ">", op.object))
+        elif type(op) is LinkOp:
+            emit((classID, op.predicate, WrapNS(frame.gensymMap[op.gensym])))
+        else:
+            gensymMap = frame.gensymMap
+            if op.bindgensym:
+                gensymMap[op.gensym] = scratch[frame.header[op.gensym]]
+            elif frame.plan.hashed:
+                gensymMap[op.gensym] = str(uuid.UUID(hashlib.md5((str(ix) + op.gensym + fname + str(cnt)).encode("utf-8")).hexdigest()))
+            else:
+                gensymMap[op.gensym] = str(uuid.uuid4())
+            emit((classID, op.predicate, WrapNS(gensymMap[op.gensym])))
+            length = len(scratch)
+            scratch += [x]
+            stack += [PlanFrame(op.plan, scratch, length + 1, None, None, fname, cnt, pt, gensymMap, ix, deterministic, geocoded, collector)]
+    return collector.take()
+
+class PlanFrame(object):
+    """The state of a plan being run on a row by PlanTriples, the row (with the values appended by the enclosing frames) is the first length values of the scratch row"""
+    __slots__ = ['plan', 'length', 'header', 'literals', 'gensymMap', 'ltriples', 'start', 'ops']
+
+    def __init__(self, plan, scratch, length, header, literals, fname, cnt, pt, gsMap, subiter, deterministic, geocoded, collector):
+        self.plan = plan
+        self.literals = literals
+        if header is None:
+            header = plan.header if length == plan.width else RebaseHeader(plan.columns, plan.inherited, plan.bindnames, length)
+            for j in plan.binds:
+                scratch += [ResolveBind(j, scratch, header)]
+        self.header = header
+        self.length = len(scratch)
+        self.gensymMap = PlanGensyms(plan, scratch, header, fname, cnt, gsMap, subiter, deterministic)
+        self.ltriples = PlanLocations(plan, scratch, header, self.gensymMap, pt, geocoded)
+        self.start = collector.position()
+        self.ops = PlanOps(plan, scratch, header, self.gensymMap)
+
+def PlanGensyms(plan, rowplus, headerplus, fname, cnt, gsMap = None, subiter = None, deterministic = None):
+    """This function assigns the IDs of the gensyms of a plan for a row, starting from a copy of the IDs of the enclosing template"""
+    metrics = GetMetrics()
+    if metrics is not None:
+        with metrics.timer('gensym'):
+            return AssignGensyms(plan, rowplus, headerplus, fname, cnt, gsMap, subiter, deterministic)
+    return AssignGensyms(plan, rowplus, headerplus, fname, cnt, gsMap, subiter, deterministic)
+
+def AssignGensyms(plan, rowplus, headerplus, fname, cnt, gsMap = None, subiter = None, deterministic = None):
+    """This function assigns the IDs of the gensyms of a plan for a row for PlanGensyms"""
+    gensymMap = dict(gsMap) if gsMap is not None else {}
+    subiterval = str(subiter) if subiter is not None else ""
     if deterministic == None or deterministic == "NONE":
-        for j in template:
-            if j[1]['GENSYM'] in gensymMap.keys():
+        for gensym, bind in plan.gensyms:
+            if gensym in gensymMap:
                 pass
-            elif 'BIND' in j[1]['GENSYM']:
-                gensymMap[j[1]['GENSYM']] = rowplus[headerplus[j[1]['GENSYM']]]
-            elif "HASHED_IDS" in spec['OPTIONS'].keys() and spec['OPTIONS']['HASHED_IDS'] == True:
-                gensymMap[j[1]['GENSYM']] = str(uuid.UUID(hashlib.md5((subiterval + j[1]['GENSYM'] + fname + str(cnt)).encode("utf-8")).hexdigest()))
+            elif bind:
+                gensymMap[gensym] = rowplus[headerplus[gensym]]
+            elif plan.hashed:
+                gensymMap[gensym] = str(uuid.UUID(hashlib.md5((subiterval + gensym + fname + str(cnt)).encode("utf-8")).hexdigest()))
             else:
-                gensymMap[j[1]['GENSYM']] = str(uuid.uuid4())
+                gensymMap[gensym] = str(uuid.uuid4())
     else:
-        gensymMap = DeterministicGensym(deterministic, rowplus, headerplus, template, fname)
-    for j in template:
-        if j[0] == 'AddressLocation':
-            classID = WrapNS(gensymMap[j[1]['GENSYM']])
-            if "GEOLOOKUP" in spec["OPTIONS"] and spec['OPTIONS']['GEOLOOKUP'] == True:
-                qaddress = AddressQuery(BuildAddress({v[0] : rowplus[headerplus[k]] for k,v in j[1].items() if k != "GENSYM"}))
-                if 'features' in qaddress.keys() and len(qaddress['features']) > 0 and qaddress['features'][0]['properties']['place_rank'] > 20:
-                    ltriples += AddressTriples(classID, qaddress['features'][0], pt)
-            #j[1] = {'GENSYM' : j[1]['GENSYM']}
-    for j in template:
-        classID = WrapNS(gensymMap[j[1]['GENSYM']])
-        for k,v in j[1].items():
-            if k == "GENSYM":
-                triples += [(classID, "<" + RDFTYPE + ">", WrapNS(j[0]))]
+        gensymMap = DeterministicGensym(deterministic, rowplus, headerplus, plan.gensymorder if plan.gensymorder is not None else plan.template, fname, plan.idhash)
+    return gensymMap
+
+def PlanLocations(plan, rowplus, headerplus, gensymMap, pt, geocoded = None):
+    """This function geolocates the AddressLocation templates of a row when GEOLOOKUP is enabled and returns their triples"""
+    ltriples = []
+    if plan.geolookup:
+        for gensym, fields in plan.addresses:
+            classID = WrapNS(gensymMap[gensym])
+            q = BuildAddress({a : rowplus[headerplus[k]] for a,k in fields})
+            if geocoded is not None and q in geocoded:
+                qaddress = geocoded[q]
+            elif GetMetrics() is not None:
+                with GetMetrics().timer('geocode'):
+                    qaddress = AddressQuery(q, GetGeocoder().server)
             else:
-                for a in v:
-                    if "SUBTEMPLATE" in k:
-                        subgensym = k.split('.')[1].split('_')[-1]
-                        subiter = spec["SUBTEMPLATES"][k.split('.')[0].split('_')[-1]]["ITERABLE"]
-                        for ix, x in enumerate(rowplus[headerplus[subiter[0][0]]]):
-                            if 'BIND' in subgensym:
-                                gensymMap[subgensym] = rowplus[headerplus[subgensym]]
-                            elif "HASHED_IDS" in spec['OPTIONS'].keys() and spec['OPTIONS']['HASHED_IDS'] == True:
-                                gensymMap[subgensym] = str(uuid.UUID(hashlib.md5((str(ix) + subgensym + fname + str(cnt)).encode("utf-8")).hexdigest()))
-                            else:
-                                gensymMap[subgensym] = str(uuid.uuid4())
-                            if subiter[0][1] in headerplus.keys():
-                                rowplus[headerplus[subiter[0][1]]] = x
-                            else:
-                                rowplus += [x]
-                                headerplus[subiter[0][1]] = len(rowplus)-1
-                            triples += [(classID, WrapNS(a), WrapNS(gensymMap[subgensym]))]
-                            triples += RowTriples(spec["SUBTEMPLATES"][k.split('.')[0].split('_')[-1]], headerplus, rowplus, fname, cnt, pt, gensymMap, ix, deterministic)
-                            headerplus.pop(subiter[0][1], None)
-                    elif "GENSYM_" in k:
-                        triples += [(classID, WrapNS(a), WrapNS(gensymMap[k.split('_')[-1]]))]
-                    else:
-                        try:
-                            datum = rowplus[headerplus[k]]
-                        except:
-                            datum = ''
-                        if datum == "":
-                            pass
-                        elif type(datum) is list:
-                            for b in datum:
-                                pdatum = ParseDatum(a, b, pt)
-                                if pdatum is not None:
-                                    triples += [(classID, WrapNS(a), pdatum)]
-                        elif datum != None:
-                            pdatum = ParseDatum(a, datum, pt)
-                            if pdatum is not None:
-                                triples += [(classID, WrapNS(a), pdatum)]
-                #triples += [(classID, WrapNS(a), ParseDatum(a,rowplus[headerplus[k]])) if "GENSYM" not in a else (classID, WrapNS(k), WrapNS(gensymMap[a.split('_')[-1]])) for a in v if "GENSYM" in a or ParseDatum(a,rowplus[headerplus[k]]) != None]
-    lltriples = []
-    for i in ltriples:
-        found = False
-        for j in triples:
-            if i[0] == j[0] and i[1] == j[1]:
-                found = True
-        if found == False:
-            lltriples += [i]
-
-    triples += lltriples
-    return triples
+                qaddress = AddressQuery(q, GetGeocoder().server)
+            if 'features' in qaddress.keys() and len(qaddress['features']) > 0 and qaddress['features'][0]['properties']['place_rank'] > 20:
+                ltriples += AddressTriples(classID, qaddress['features'][0], pt)
+    return ltriples
+
+def PlanOps(plan, rowplus, headerplus, gensymMap):
+    """This function yields the (subject, op, index, item) steps of a plan, a subtemplate op is yielded once for every item of its iterable column"""
+    for j in plan.classes:
+        classID = WrapNS(gensymMap[j.gensym])
+        for op in j.ops:
+            if type(op) is SubOp:
+                for ix, x in enumerate(rowplus[headerplus[op.iterable]]):
+                    yield classID, op, ix, x
+            else:
+                yield classID, op, None, None
+
+def PlanAddresses(plan, row):
+    """This function builds the geocoder queries for the AddressLocation templates of a row"""
+    rowplus = list(row)
+    if len(rowplus) == plan.width:
+        headerplus = plan.header
+    else:
+        headerplus = RebaseHeader(plan.columns, plan.inherited, plan.bindnames, len(rowplus))
+    try:
+        for j in plan.binds:
+            rowplus += [ResolveBind(j, rowplus, headerplus)]
+        return [BuildAddress({a : rowplus[headerplus[k]] for a,k in fields}) for gensym, fields in plan.addresses]
+    except Exception:
+        # the row is reported when it is parsed, here it just has nothing to prefetch
+        return []
+
+def PrepareRows(plan, rows, pt, size = 1000):
+    """This function reads rows in batches, prepares each batch column by column with PrepareBatch and prefetches the geocoder results for its addresses, and yields every row with its (prepared, geocoded) state"""
+    if plan.geolookup and len(plan.addresses) > 0:
+        geocoder = GetGeocoder()
+        size = geocoder.batch
+    else:
+        geocoder = None
+    rows = iter(rows)
+    batch = list(itertools.islice(rows, size))
+    while len(batch) > 0:
+        prepared = PrepareBatch(plan, batch, pt)
+        geocoded = None
+        if geocoder is not None:
+            queries = []
+            for i, p in zip(batch, prepared):
+                if p is not None:
+                    queries += [BuildAddress({a : p[0][plan.header[k]] for a,k in fields}) for gensym, fields in plan.addresses]
+                elif i != "":
+                    queries += PlanAddresses(plan, i)
+            if GetMetrics() is not None:
+                with GetMetrics().timer('geocode'):
+                    geocoded = geocoder.prefetch(queries)
+            else:
+                geocoded = geocoder.prefetch(queries)
+        for i, p in zip(batch, prepared):
+            yield i, p, geocoded
+        batch = list(itertools.islice(rows, size))
+
+def PrepareBatch(plan, rows, pt):
+    """This function transposes the rows of a batch that match the width of the plan into columns, resolving every bind function and datum converter once per column, and returns for each row its values with the bind values appended and its data literals, or None for rows that are parsed on their own"""
+    ixs = [ix for ix, i in enumerate(rows) if i != "" and len(i) == plan.width]
+    prepared = [None] * len(rows)
+    if len(ixs) == 0:
+        return prepared
+    try:
+        rowsplus = [list(rows[ix]) for ix in ixs]
+        for j in plan.binds:
+            for r, v in zip(rowsplus, ResolveBindColumn(j, rowsplus, plan.header)):
+                r += [v]
+        columns = []
+        for prop, k in plan.data:
+            ix = plan.header.get(k)
+            columns += [ColumnLiterals(prop, pt, [r[ix] for r in rowsplus]) if ix is not None else [None] * len(rowsplus)]
+    except Exception:
+        # the rows of a batch that cannot be converted by column are parsed one at a time so errors surface as before
+        return prepared
+    for n, ix in enumerate(ixs):
+        prepared[ix] = (rowsplus[n], [c[n] for c in columns])
+    return prepared
+
+def ColumnLiterals(prop, pt, column):
+    """This function converts the datums of a data column of a property like DataLiteral, rendering the plain datums of a string or untyped property in bulk"""
+    converter = DatumConverter(prop, pt)
+    serializer = COLUMN_SERIALIZERS.get(pt.get(prop)) if GetMetrics() is None else None
+    if serializer is None:
+        return [DataLiteral(converter, d) for d in column]
+    plain = [type(d) in serializer[1] and d != "" for d in column]
+    rendered = iter(serializer[0]([d for d, p in zip(column, plain) if p]))
+    return [next(rendered) if p else DataLiteral(converter, d) for d, p in zip(column, plain)]
+
+def DataLiteral(converter, datum):
+    """This function converts the datum of a data column to a literal, a list of literals for list datums, or None when no triple is emitted"""
+    if datum == "":
+        return None
+    elif type(datum) is list:
+        return [b for b in map(converter, datum) if b is not None]
+    elif datum != None:
+        return converter(datum)
+    return None
 
 def BuildAddress(adict):
     """This function constructs an address for use in an address query"""
@@ -292,4 +650,4 @@ def WrapNS(s, ns = "http://schema.localhost"):
 
 def WrapDQ(s):
     """This function renders a variable to it's appropriate N-triple type"""
-    return rdflib.Literal(s).n3()
+    return NTLiteral(s)
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import mmap
+import time
+import marshal
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+RDFSUBCLASS = 'http://www.w3.org/2000/01/rdf-schema#subClassOf'
+RDFDOMAIN = 'http://schema.localhost/domainIncludes'
+RDFRANGE = 'http://schema.localhost/rangeIncludes'
+RDFNS = 'http://schema.localhost/'
+
+# bumped whenever the layout of the compiled artifact changes, older artifacts are then compiled again
+ARTIFACT_VERSION = 1
+
+class PropertyTypes(dict):
+    """Dictionary mapping each property of a schema to its datatype, along with the superclasses of each class and the domains of each property. The datum converter of each property is resolved once and kept in converters. A schema loaded from a compiled artifact is pickled as the path of the artifact, so the workers of a multiprocess run memory map it instead of receiving the whole schema."""
+
+    def __init__(self, properties = (), classes = None, domains = None, artifact = None):
+        dict.__init__(self, properties)
+        self.classes = classes if classes is not None else {}
+        self.domains = domains if domains is not None else {}
+        self.artifact = artifact
+        self.converters = {}
+
+    def __reduce__(self):
+        if self.artifact is not None:
+            return (ReadSchemaArtifact, (self.artifact,))
+        return (PropertyTypes, (dict(self), self.classes, self.domains))
+
+    def digest(self):
+        """Returns the md5 of the datatypes, superclasses and domains of the schema"""
+        return hashlib.md5(json.dumps([self, self.classes, self.domains], sort_keys = True).encode("utf-8")).hexdigest()
+
+    def superclasses(self, name):
+        """Returns every class a class is a subclass of, nearest first"""
+        found = []
+        pending = list(self.classes.get(name, ()))
+        while len(pending) > 0:
+            c = pending.pop(0)
+            if c not in found and c != name:
+                found += [c]
+                pending += list(self.classes.get(c, ()))
+        return found
+
+def SchemaIds(value):
+    """Function that returns the local names of the @id references of a JSON-LD value that is a reference or a list of them"""
+    if type(value) is dict:
+        value = [value]
+    if type(value) is not list:
+        return []
+    return [v['@id'].replace(RDFNS, '') for v in value if type(v) is dict and '@id' in v.keys()]
+
+def CompileSchema(schema):
+    """Function that compiles a parsed schema JSON-LD to the datatype of each property, the superclasses of each class and the domains of each property"""
+    properties = {}
+    classes = {}
+    domains = {}
+    if type(schema) is dict and '@graph' in schema.keys():
+        for i in schema['@graph']:
+            if type(i) is not dict or '@id' not in i.keys():
+                continue
+            name = i['@id'].replace(RDFNS, '')
+            if RDFRANGE in i.keys():
+                ranges = SchemaIds(i[RDFRANGE])
+                if len(ranges) > 0:
+                    properties[name] = ranges[0]
+            if RDFDOMAIN in i.keys():
+                domains[name] = SchemaIds(i[RDFDOMAIN])
+            if RDFSUBCLASS in i.keys():
+                classes[name] = SchemaIds(i[RDFSUBCLASS])
+    return properties, classes, domains
+
+def SchemaArtifactPath(cache, source):
+    """Function that returns the path of the compiled artifact of a schema URL or file in a cache directory"""
+    if '://' not in source:
+        source = os.path.abspath(source)
+    return os.path.join(cache, 'schema_' + hashlib.md5(source.encode('utf-8')).hexdigest() + '.bin')
+
+def ReadSchemaArtifact(path):
+    """Function that memory maps a compiled artifact and returns its schema"""
+    artifact = LoadSchemaArtifact(path)
+    if artifact is None:
+        raise Exception("Could not read the compiled schema " + path)
+    return PropertyTypes(artifact['properties'], artifact['classes'], artifact['domains'], path)
+
+def LoadSchemaArtifact(path):
+    """Function that memory maps a compiled artifact and returns its contents, or None when it is missing, unreadable or from another version"""
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                artifact = marshal.loads(mm)
+            finally:
+                mm.close()
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    if type(artifact) is not dict or artifact.get('version') != ARTIFACT_VERSION or artifact.get('python') != list(sys.version_info[:2]):
+        return None
+    return artifact
+
+def WriteSchemaArtifact(path, artifact):
+    """Function that writes a compiled artifact, replacing the previous one in one step so concurrent runs never read a partial file"""
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    artifact = dict(artifact, version = ARTIFACT_VERSION, python = list(sys.version_info[:2]))
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as f:
+        marshal.dump(artifact, f)
+    os.replace(tmp, path)
+
+def FetchSchema(url, timeout = 30, etag = None, modified = None):
+    """Function that downloads a schema, conditionally on the ETag and Last-Modified of an earlier download when given, and returns its content (None when it has not changed), ETag and Last-Modified"""
+    import urllib.request
+    import urllib.error
+    request = urllib.request.Request(url)
+    if etag is not None:
+        request.add_header('If-None-Match', etag)
+    if modified is not None:
+        request.add_header('If-Modified-Since', modified)
+    try:
+        with urllib.request.urlopen(request, timeout = timeout) as qr:
+            return qr.read(), qr.headers.get('ETag'), qr.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag, modified
+        raise
+
+def CompileSchemaContent(source, content, etag = None, modified = None):
+    """Function that compiles the content of a schema to an artifact"""
+    properties, classes, domains = CompileSchema(json.loads(content.decode('utf-8')))
+    return {'source' : source, 'hash' : hashlib.md5(content).hexdigest(), 'etag' : etag, 'modified' : modified, 'checked' : time.time(),
+            'properties' : properties, 'classes' : classes, 'domains' : domains}
+
+def LoadSchema(source, cache = None, refresh = 3600, timeout = 30):
+    """Function that returns the PropertyTypes of a schema URL or JSON-LD file. When cache is a directory the schema is compiled once to an artifact there and later runs memory map it: a file is compiled again when its content changes, a URL is checked with a conditional request once refresh seconds have passed since the last check and the artifact is kept when the server cannot be reached. An unreachable or missing schema without an artifact leaves every property untyped."""
+    remote = source.startswith('http://') or source.startswith('https://')
+    path = SchemaArtifactPath(cache, source) if cache is not None else None
+    artifact = LoadSchemaArtifact(path) if path is not None else None
+    if remote:
+        if artifact is not None and refresh is not None and time.time() - artifact['checked'] < refresh:
+            return PropertyTypes(artifact['properties'], artifact['classes'], artifact['domains'], path)
+        try:
+            content, etag, modified = FetchSchema(source, timeout, *((artifact['etag'], artifact['modified']) if artifact is not None else (None, None)))
+            compiled = CompileSchemaContent(source, content, etag, modified) if content is not None else None
+        except Exception as e:
+            if artifact is None:
+                logger.error("Could not retrieve schema from external server", exc_info=e)
+                return PropertyTypes()
+            logger.warning("Could not refresh schema {} ({}), using the compiled schema checked {}".format(source, e, time.ctime(artifact["checked"])))
+            return PropertyTypes(artifact['properties'], artifact['classes'], artifact['domains'], path)
+        if compiled is None:
+            logger.debug("Schema {} has not changed".format(source))
+            artifact = dict(artifact, checked = time.time())
+        else:
+            artifact = compiled
+    elif os.path.exists(source):
+        with open(source, 'rb') as f:
+            content = f.read()
+        if artifact is not None and artifact['hash'] == hashlib.md5(content).hexdigest():
+            return PropertyTypes(artifact['properties'], artifact['classes'], artifact['domains'], path)
+        artifact = CompileSchemaContent(source, content)
+    else:
+        return PropertyTypes()
+    if path is not None:
+        try:
+            WriteSchemaArtifact(path, artifact)
+        except OSError as e:
+            logger.warning("Could not write the compiled schema " + path, exc_info=e)
+            path = None
+    return PropertyTypes(artifact['properties'], artifact['classes'], artifact['domains'], path)
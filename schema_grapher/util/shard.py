@@ -0,0 +1,104 @@
+import os
+import json
+import zlib
+import glob
+import logging
+
+logger = logging.getLogger(__name__)
+
+def ParseShard(value):
+    """Function that parses a shard given as K/N, the K-th of N shards counting from 0, to a (K, N) pair"""
+    try:
+        k, n = [int(v) for v in str(value).split('/')]
+    except ValueError:
+        raise Exception("A shard is given as K/N, not " + str(value))
+    if n < 1:
+        raise Exception("A run needs at least one shard, not " + str(value))
+    if k < 0 or k >= n:
+        raise Exception("Shard {} is not one of 0/{} to {}/{}".format(value, n, n - 1, n))
+    return k, n
+
+def ShardSeed(file):
+    """Function that returns the hash of the name of a file the shards of its chunks start from, without its directory so that hosts reading the input from different roots agree"""
+    return zlib.crc32(file.split(os.sep)[-1].encode('utf-8'))
+
+def ShardOwner(file, fcount, shards):
+    """Function that returns the shard a chunk of a file belongs to. The chunks of a file are dealt out in turn, starting at a shard derived from the file name, so every host computes the same assignment without coordination."""
+    return (ShardSeed(file) + fcount) % shards
+
+def ShardChunks(file, total, shard):
+    """Function that returns how many of the total chunks of a file belong to a (K, N) shard"""
+    k, n = shard
+    return total // n + (1 if (k - ShardSeed(file)) % n < total % n else 0)
+
+def ShardManifestPath(config, shard):
+    """Function that returns the path of the manifest of a (K, N) shard in the output folder"""
+    return os.path.join(config['OUTPUTDIR'], 'shard_{}_of_{}.json'.format(*shard))
+
+def ChunkName(file, fcount):
+    """Function that returns the name of the output of a chunk of a file, as the parsers name it"""
+    return file.split(os.sep)[-1].split('.')[0] + '_' + str(fcount) + '.nt'
+
+def ShardManifests(paths):
+    """Function that expands the directories among paths to the shard manifests they hold"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(glob.glob(os.path.join(path, 'shard_*_of_*.json')))
+        else:
+            found += [path]
+    return found
+
+def MergeShards(paths):
+    """Function that checks that the manifests of the shards of a run cover every chunk of every file exactly once, with the same input, spec, schema and settings. Returns the combined manifest listing the output of every chunk in order, and the problems found."""
+    manifests = []
+    for path in paths:
+        with open(path) as f:
+            manifests += [(path, json.load(f))]
+    problems = []
+    unsharded = [path for path, m in manifests if m.get('shard') is None]
+    if len(unsharded) > 0:
+        return None, ["{} was not written by a sharded run".format(", ".join(unsharded))]
+    counts = sorted(set(m['shard'][1] for _, m in manifests))
+    if len(counts) != 1:
+        return None, ["The manifests were written by runs of {} shards".format(", ".join(str(c) for c in counts))]
+    n = counts[0]
+    found = [m['shard'][0] for _, m in manifests]
+    for k in range(n):
+        if found.count(k) == 0:
+            problems += ["The manifest of shard {}/{} is missing".format(k, n)]
+        elif found.count(k) > 1:
+            problems += ["Shard {}/{} has {} manifests".format(k, n, found.count(k))]
+    files = {}
+    for file in dict.fromkeys(f for _, m in manifests for f in m['files'].keys()):
+        states = [(path, m['shard'][0], m['files'].get(file)) for path, m in manifests]
+        if any(s is None for _, _, s in states):
+            problems += ["{} was not started by {}".format(file, ", ".join(p for p, _, s in states if s is None))]
+            continue
+        for key in ('md5', 'fingerprint', 'total'):
+            if len(set(s[key] for _, _, s in states)) > 1:
+                problems += ["The shards disagree on the {} of {}".format(key, file)]
+        total = states[0][2]['total']
+        if any(s['total'] is None for _, _, s in states):
+            problems += ["{} did not finish reading {}".format(", ".join(p for p, _, s in states if s['total'] is None), file)]
+            continue
+        chunks = {}
+        for path, k, s in states:
+            for fname, chunk in s['chunks'].items():
+                chunks.setdefault(os.path.split(fname)[1], []).append(dict(chunk, shard = k))
+        outputs = []
+        for fcount in range(total):
+            name = ChunkName(file, fcount)
+            owner = ShardOwner(file, fcount, n)
+            written = chunks.pop(name, [])
+            if len(written) == 0:
+                problems += ["Chunk {} of {} is missing from shard {}/{}".format(name, file, owner, n)]
+                continue
+            if len(written) > 1 or written[0]['shard'] != owner:
+                problems += ["Chunk {} of {} was written by shards {}, it belongs to shard {}/{}".format(name, file, ", ".join(str(c['shard']) for c in written), owner, n)]
+            outputs += [dict(written[0], chunk = name)]
+        for name in sorted(chunks.keys()):
+            problems += ["Chunk {} is not a chunk of {}".format(name, file)]
+        files[file] = {'md5' : states[0][2]['md5'], 'chunks' : total, 'rows' : sum(c['rows'] for c in outputs),
+                       'triples' : sum(c['triples'] for c in outputs) if all(c.get('triples') is not None for c in outputs) else None, 'outputs' : outputs}
+    return {'shards' : n, 'complete' : len(problems) == 0, 'files' : files}, problems
@@ -0,0 +1,184 @@
+import os
+import time
+import base64
+import random
+import threading
+import urllib.parse
+import logging
+
+from schema_grapher.util.metrics import GetMetrics
+
+logger = logging.getLogger(__name__)
+
+PROTOCOLS = ('graphstore', 'update')
+
+class GraphStore(object):
+    """Loads N-Triples into a SPARQL 1.1 Graph Store HTTP endpoint, or an update endpoint with INSERT DATA, in batches of batch triples sent concurrently over keep-alive connections with retries. The triples go to the named graph when one is given and to the default graph otherwise."""
+
+    def __init__(self, endpoint, protocol = 'graphstore', graph = None, batch = 50000, concurrency = 4, retries = 3, backoff = 1.0, timeout = 60, user = None, password = None):
+        if protocol not in PROTOCOLS:
+            raise Exception("Unknown SPARQL protocol: " + str(protocol))
+        self.endpoint = endpoint
+        self.protocol = protocol
+        self.graph = graph
+        self.batch = batch
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = {'Connection' : 'keep-alive', 'Content-Type' : 'application/n-triples' if protocol == 'graphstore' else 'application/sparql-update'}
+        if user is not None:
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode((user + ':' + (password or '')).encode('utf-8')).decode('ascii')
+        url = urllib.parse.urlparse(endpoint)
+        self.path = url.path or '/'
+        if protocol == 'graphstore':
+            query = urllib.parse.urlencode({'graph' : graph}) if graph is not None else 'default'
+            self.path += '?' + (url.query + '&' if url.query != '' else '') + query
+        elif url.query != '':
+            self.path += '?' + url.query
+        self._local = threading.local()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_local'] = None
+        state['_executor'] = None
+        state['_slots'] = None
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self):
+        """Returns the keep-alive connection of the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import http.client
+            url = urllib.parse.urlparse(self.endpoint)
+            if url.scheme == 'https':
+                conn = http.client.HTTPSConnection(url.netloc, timeout = self.timeout)
+            else:
+                conn = http.client.HTTPConnection(url.netloc, timeout = self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def body(self, text):
+        """Returns the request body loading N-Triples text"""
+        if self.protocol == 'graphstore':
+            return text.encode('utf-8')
+        if self.graph is not None:
+            return ('INSERT DATA { GRAPH <' + self.graph + '> {\n' + text + '} }').encode('utf-8')
+        return ('INSERT DATA {\n' + text + '}').encode('utf-8')
+
+    def post(self, text, count):
+        """Sends a batch of count triples, retrying failures with exponential backoff, and raises an error if every attempt failed or the endpoint rejected the batch"""
+        body = self.body(text)
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+            conn = self._connection()
+            try:
+                start = time.perf_counter()
+                conn.request('POST', self.path, body = body, headers = self.headers)
+                resp = conn.getresponse()
+                message = resp.read()
+                if GetMetrics() is not None:
+                    GetMetrics().add('sparql', time.perf_counter() - start)
+                if resp.status in (200, 201, 204):
+                    return count
+                error = "HTTP {} {}".format(resp.status, message[:200].decode('utf-8', errors = 'replace'))
+                if resp.status < 500 and resp.status not in (408, 429):
+                    break
+            except Exception as e:
+                error = repr(e)
+                conn.close()
+                self._local.conn = None
+            logger.warning("Loading {} triples into {} failed (attempt {}): {}".format(count, self.endpoint, attempt + 1, error))
+            if GetMetrics() is not None:
+                GetMetrics().count('sparql_failures')
+        raise Exception("Could not load {} triples into {}: {}".format(count, self.endpoint, error))
+
+    def submit(self, text, count):
+        """Queues a batch of count triples and returns its future, blocking while twice as many batches as there are connections are in flight so the text held in memory stays bounded"""
+        if self._pid != os.getpid():
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.concurrency)
+            self._slots = threading.BoundedSemaphore(2 * self.concurrency)
+            self._pid = os.getpid()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self.post, text, count)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def open(self, fname):
+        """Returns a GraphStoreOutput that loads the triples of the output chunk fname"""
+        return GraphStoreOutput(self, fname)
+
+    def close(self):
+        """Waits for the batches in flight and releases the connections of this process"""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+            self._executor = None
+            self._pid = None
+
+class GraphStoreOutput(object):
+    """Output of a chunk loaded into a GraphStore, written like a text stream. The N-Triples text is sent in batches of the batch size of the store as it is written, and closing the output sends the rest and waits until every batch of the chunk is loaded."""
+
+    def __init__(self, store, fname):
+        self.store = store
+        self.fname = fname
+        self._parts = []
+        self._count = 0
+        self._futures = []
+
+    def write(self, text):
+        self._parts.append(text)
+        # empty rows are written as blank lines, they hold no triple
+        self._count += sum(1 for line in text.split('\n') if line != '')
+        if self._count >= self.store.batch:
+            self._send()
+
+    def write_triples(self, triples, render):
+        """Writes a list of triples rendered by render, the triples are counted as they are given rather than by their lines"""
+        if len(triples) == 0:
+            return
+        self._parts.append(render(triples))
+        self._count += len(triples)
+        if self._count >= self.store.batch:
+            self._send()
+
+    def _send(self):
+        if self._count > 0:
+            self._futures += [self.store.submit(''.join(self._parts), self._count)]
+        self._parts = []
+        self._count = 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Sends the remaining triples and raises an error if a batch of the chunk could not be loaded"""
+        self._send()
+        errors = [f.exception() for f in self._futures]
+        self._futures = []
+        errors = [e for e in errors if e is not None]
+        if len(errors) > 0:
+            raise Exception("{} batches of {} were not loaded: {}".format(len(errors), self.fname, errors[0]))
+
+def GraphStoreFromConfig(config):
+    """Function that builds the GraphStore selected by the SPARQL settings of a config, or returns None when SPARQL_ENDPOINT is not set"""
+    if config.get('SPARQL_ENDPOINT') is None:
+        return None
+    if config.get('PARTITIONS') is not None:
+        raise Exception("PARTITIONS cannot be combined with SPARQL_ENDPOINT")
+    return GraphStore(config['SPARQL_ENDPOINT'], config.get('SPARQL_PROTOCOL', 'graphstore'), config.get('SPARQL_GRAPH'), config.get('SPARQL_BATCH', 50000), config.get('SPARQL_CONCURRENCY', 4),
+                      config.get('SPARQL_RETRIES', 3), config.get('SPARQL_BACKOFF', 1.0), config.get('SPARQL_TIMEOUT', 60), config.get('SPARQL_USER'), config.get('SPARQL_PASSWORD'))
@@ -0,0 +1,56 @@
+import os
+import glob
+import json
+
+import pytest
+
+SCHEMA = {'@graph' : [{'@id' : 'http://schema.localhost/' + prop, 'http://schema.localhost/rangeIncludes' : {'@id' : 'http://schema.localhost/' + kind}}
+                      for prop, kind in [('name', 'String'), ('score', 'Decimal'), ('count', 'Integer'), ('city', 'String')]]}
+
+SPEC = {'TEMPLATE' : [['Event', {'GENSYM' : 'e', 'name' : ['name'], 'score' : ['score'], 'count' : ['count'], 'GENSYM_o' : ['organizer']}],
+                      ['Org', {'GENSYM' : 'o', 'city' : ['city']}]],
+        'BIND' : {}, 'OPTIONS' : {}}
+
+ROWS = 95
+
+class SmallRun(object):
+    """A CSV of ROWS rows with a quoted field holding a newline, its spec and a schema in a directory, with the configs that parse them"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.file = os.path.join(directory, 'data.csv')
+        with open(self.file, 'w') as f:
+            f.write('name,score,count,city\n')
+            for n in range(ROWS):
+                f.write('"Event {0}, ""{0}""{1}",{2},{3},{4}\n'.format(n, '\nmore' if n % 10 == 3 else '', n / 4, n % 7, ['Richland', 'Pasco', 'Kennewick'][n % 3]))
+        with open(os.path.join(directory, 'spec.json'), 'w') as f:
+            json.dump(SPEC, f)
+        with open(os.path.join(directory, 'schema.jsonld'), 'w') as f:
+            json.dump(SCHEMA, f)
+        self.configs = 0
+
+    def config(self, outdir = 'out', **settings):
+        """Writes a config that parses the CSV into outdir with deterministic IDs in chunks of 20 rows, overridden by settings, and returns its path"""
+        config = {'FILES' : [{'FILE' : self.file, 'SPEC' : os.path.join(self.directory, 'spec.json')}], 'OUTPUTDIR' : os.path.join(self.directory, outdir),
+                  'CHUNKSIZE' : 20, 'THREADS' : 2, 'S3_FOLDER' : 'run/', 'SCHEMA' : os.path.join(self.directory, 'schema.jsonld'),
+                  'DETERMINISTIC_IDS' : 'FILE', 'UPLOAD_BACKEND' : 'none'}
+        config.update(settings)
+        os.makedirs(config['OUTPUTDIR'], exist_ok = True)
+        self.configs += 1
+        path = os.path.join(self.directory, 'config_{}.json'.format(self.configs))
+        with open(path, 'w') as f:
+            json.dump(config, f)
+        return path
+
+    def output(self, outdir = 'out', pattern = 'data_*.nt'):
+        """Returns the triples written to the files of outdir matching pattern, in the order of their chunks"""
+        files = sorted(glob.glob(os.path.join(self.directory, outdir, pattern)), key = lambda f: int(f.rsplit('_', 1)[1].split('.')[0]))
+        lines = []
+        for f in files:
+            with open(f) as o:
+                lines += o.read().splitlines()
+        return lines
+
+@pytest.fixture
+def small_run(tmp_path):
+    return SmallRun(str(tmp_path))
@@ -0,0 +1,133 @@
+import copy
+import math
+import random
+
+import pytest
+from geographiclib.geodesic import Geodesic
+
+from schema_grapher.util.bind import PolygonLonLat, PolygonVertices, GeoJSONHexFromCombinedLonLat, GeoJSONHexFromCombinedLatLon, GeoJSONHexFromCombinedLonLatColumn, GeoJSONHexFromCombinedLatLonColumn
+from schema_grapher.util.bind import BINDS, COLUMN_BINDS, ResolveBind, ResolveBindColumn, LocalDirect
+from schema_grapher.util.metrics import Metrics, SetMetrics
+
+def DirectPolygon(lat, lon, numvertex, distance):
+    """Solves the vertices of a polygon with Geodesic.Direct, as PolygonLonLat did before it was cached"""
+    geod = Geodesic.WGS84
+    angle = 360 / numvertex
+    coords = []
+    for i in range(numvertex-1,-1,-1):
+        vertex = geod.Direct(lat, lon, float(angle*i), distance)
+        coords += [[vertex['lon2'], vertex['lat2']]]
+    coords += [coords[0]]
+    return coords
+
+def LocalError(lat, lon, distance):
+    """Returns the largest distance in meters between the vertices of the local approximation and the geodesic ones"""
+    geod = Geodesic.WGS84
+    exact = DirectPolygon(lat, lon, 6, distance)
+    local = PolygonLonLat(lat, lon, 6, distance, "local")
+    return max(geod.Inverse(a[1], a[0], b[1], b[0])['s12'] for a, b in zip(exact, local))
+
+POINTS = [(random.Random(n).uniform(-85, 85), random.Random(-n).uniform(-180, 180)) for n in range(200)]
+
+def test_cached_vertices_match_geodesic():
+    PolygonVertices.cache_clear()
+    for lat, lon in POINTS + POINTS:
+        assert PolygonLonLat(lat, lon, 6, 500) == DirectPolygon(lat, lon, 6, 500)
+
+def test_centers_are_exact_unless_precision_is_set():
+    row = ['12.3456789012345,48.1234567890123']
+    header = {'lonlat' : 0}
+    data = {'LonLat' : 'lonlat', 'Radius' : 500}
+    exact = {"type": "Polygon", "coordinates": [DirectPolygon(12.3456789012345, 48.1234567890123, 6, 500)]}
+    assert GeoJSONHexFromCombinedLonLat(data, row, header) == exact
+    assert GeoJSONHexFromCombinedLonLatColumn(data, [row], header) == [exact]
+    rounded = {"type": "Polygon", "coordinates": [DirectPolygon(12.346, 48.123, 6, 500)]}
+    assert GeoJSONHexFromCombinedLonLat(dict(data, Precision = 3), row, header) == rounded
+    assert GeoJSONHexFromCombinedLonLatColumn(dict(data, Precision = 3), [row], header) == [rounded]
+
+@pytest.mark.parametrize('method', ['geodesic', 'local'])
+def test_column_matches_row(method):
+    rows = [['{:.6f},{:.6f}'.format(lat, lon)] for lat, lon in POINTS[:50]] + [['not a point'], ['']]
+    header = {'latlon' : 0}
+    data = {'LatLon' : 'latlon', 'Radius' : 1000, 'Method' : method}
+    assert GeoJSONHexFromCombinedLatLonColumn(data, rows, header) == [GeoJSONHexFromCombinedLatLon(data, r, header) for r in rows]
+
+@pytest.mark.parametrize('radius, band, bound', [(1000, 60, 0.001), (10000, 60, 0.02), (10000, 85, 1.0), (100000, 60, 15.0)])
+def test_local_error(radius, band, bound):
+    assert max(LocalError(lat * band / 85, lon, radius) for lat, lon in POINTS) < bound
+
+def test_local_error_near_the_poles():
+    # the approximation is only good away from the poles, for 10km it is off by meters within a few degrees of them
+    assert 0.01 < LocalError(59, 10, 10000) < 0.02
+    assert 10 < LocalError(89, 10, 10000) < 20
+
+HEADER = {'lat' : 0, 'lon' : 1, 'lonlat' : 2, 'latlon' : 3, 'flag' : 4, 'name' : 5, 'ts' : 6}
+ROWS = [['46.28', '-119.28', '-119.28,46.28', '46.28,-119.28', 'yes', 'Richland', '1600000000'],
+        ['nan', '-119.1', '(-119.1, 46.2)', '[46.2 -119.1]', 'no', 'Pasco Pasco', '0'],
+        ['', 'x', 'not a point', '', 'YES', '', 'soon'],
+        ['-89.9', '179.99', '179.99,-89.9', '-89.9,179.99', 'yes', 'ÉCOLE', '-1']]
+
+# a binding of every function with a column implementation
+COLUMN_CASES = {
+    'GeoJSONFromLatLon' : {'Latitude' : 'lat', 'Longitude' : 'lon'},
+    'GeoJSONHexFromCombinedLonLat' : {'LonLat' : 'lonlat', 'Radius' : 500},
+    'GeoJSONHexFromCombinedLatLon' : {'LatLon' : 'latlon', 'Radius' : 2000, 'Method' : 'local', 'Precision' : 2},
+    'Echo' : {'Echostring' : 'constant'},
+    'TernaryBool' : {'Column' : 'flag', 'True' : 'yes'},
+    'Replace' : {'Column' : 'name', 'Key' : 'Pasco', 'Value' : 'P'},
+    'UpCase' : {'Column' : 'name'},
+    'UnixTimestamp' : {'DateCol' : 'ts'},
+    'ObjectTemplate' : {'Obj' : {'kind' : 'place'}, 'Map' : {'name' : 'name', 'flag' : 'flag'}},
+}
+
+def test_every_column_bind_is_a_bind():
+    assert set(COLUMN_BINDS) <= set(BINDS)
+    assert set(COLUMN_CASES) == set(COLUMN_BINDS)
+
+@pytest.mark.parametrize('function', sorted(COLUMN_CASES))
+def test_column_binds_match_row_binds(function):
+    binding = {'FUNCTION' : function, 'DATA' : COLUMN_CASES[function]}
+    column = ResolveBindColumn(binding, ROWS, HEADER)
+    # ObjectTemplate fills in the same object for every row, so each row is compared with what it held when the row was bound
+    assert column == [copy.deepcopy(ResolveBind(binding, row, header = HEADER)) for row in ROWS]
+    assert len(set(id(v) for v in column if isinstance(v, dict))) == len([v for v in column if isinstance(v, dict)])
+
+def test_binds_without_a_column_implementation_are_resolved_row_by_row():
+    binding = {'FUNCTION' : 'CombineColumns', 'DATA' : {'Columns' : ['lat', 'lon'], 'Delimiter' : ';'}}
+    assert 'CombineColumns' not in COLUMN_BINDS
+    assert ResolveBindColumn(binding, ROWS, HEADER) == ['46.28;-119.28', 'nan;-119.1', ';x', '-89.9;179.99']
+    with pytest.raises(Exception, match = 'Binding Function Not Found'):
+        ResolveBindColumn({'FUNCTION' : 'Missing', 'DATA' : {}}, ROWS, HEADER)
+
+def test_column_binds_are_timed_per_row():
+    metrics = Metrics()
+    SetMetrics(metrics)
+    try:
+        ResolveBindColumn({'FUNCTION' : 'UpCase', 'DATA' : {'Column' : 'name'}}, ROWS, HEADER)
+        ResolveBind({'FUNCTION' : 'UpCase', 'DATA' : {'Column' : 'name'}}, ROWS[0], HEADER)
+    finally:
+        SetMetrics(None)
+    assert metrics.timers['bind.UpCase'][0] == len(ROWS) + 1
+
+def DirectError(lat, lon, azimuth, distance):
+    """Returns the distance in meters between the point LocalDirect reaches and the one Geodesic.Direct reaches"""
+    geod = Geodesic.WGS84
+    exact = geod.Direct(lat, lon, azimuth, distance)
+    lon2, lat2 = LocalDirect(lat, lon, azimuth, distance)
+    return geod.Inverse(exact['lat2'], exact['lon2'], lat2, lon2)['s12']
+
+# the error of LocalDirect grows with the cube of the distance, these are its bounds in meters for 10km up to each latitude
+DIRECT_BOUNDS = [(60, 0.02), (75, 0.08), (85, 0.7)]
+
+@pytest.mark.parametrize('band, bound', DIRECT_BOUNDS)
+def test_local_direct_is_within_tolerance(band, bound):
+    for distance in [100, 1000, 10000, 100000]:
+        worst = max(DirectError(sign * lat, lon, azimuth, distance) for lat, lon in POINTS[:20] for sign in (1, -1) for azimuth in range(0, 360, 30) if abs(lat) <= band)
+        worst = max(worst, max(DirectError(sign * band, 10, azimuth, distance) for sign in (1, -1) for azimuth in range(0, 360, 15)))
+        assert worst <= bound * (distance / 10000) ** 3
+
+def test_local_direct_wraps_the_antimeridian():
+    lon2, lat2 = LocalDirect(10, 179.999, 90, 1000)
+    exact = Geodesic.WGS84.Direct(10, 179.999, 90, 1000)
+    assert lon2 < -179.99 and abs(lon2 - exact['lon2']) < 1e-9 and abs(lat2 - exact['lat2']) < 1e-9
+    assert all(math.isnan(v) for v in LocalDirect(91, 0, 0, 10)) and math.isnan(Geodesic.WGS84.Direct(91, 0, 0, 10)['lat2'])
@@ -0,0 +1,74 @@
+import os
+import json
+
+import pytest
+
+from schema_grapher.parser.single import ParseConfigSingle
+from schema_grapher.util.checkpoint import CheckpointFromConfig, Fingerprint
+from schema_grapher.util.schema import PropertyTypes
+
+from conftest import SPEC
+
+def test_run_dedup_is_not_resumable(tmp_path):
+    config = {'OUTPUTDIR' : str(tmp_path), 'CHECKPOINT' : str(tmp_path / 'checkpoint.json'), 'DEDUP' : 'run'}
+    with pytest.raises(Exception, match = 'CHECKPOINT'):
+        CheckpointFromConfig(config)
+    config['DEDUP'] = 'chunk'
+    assert CheckpointFromConfig(config).path == config['CHECKPOINT']
+
+def Manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+def test_resume_skips_finished_chunks(small_run):
+    checkpoint = os.path.join(small_run.directory, 'checkpoint.json')
+    ParseConfigSingle(small_run.config(CHECKPOINT = checkpoint))
+    expected = small_run.output()
+    saved = Manifest(checkpoint)
+    chunks = saved['files'][small_run.file]['chunks']
+    assert len(chunks) == 5
+    forgotten = sorted(chunks)[:2]
+    for fname in forgotten:
+        os.remove(chunks.pop(fname)['output'])
+    kept = sorted(chunks)[0]
+    with open(kept, 'a') as f:
+        f.write('# kept\n')
+    with open(checkpoint, 'w') as f:
+        json.dump(saved, f)
+    ParseConfigSingle(small_run.config(CHECKPOINT = checkpoint))
+    # only the forgotten chunks were parsed again, the finished ones were left alone
+    assert [l for l in small_run.output() if l != '# kept'] == expected
+    with open(kept) as f:
+        assert f.read().endswith('# kept\n')
+    assert sorted(Manifest(checkpoint)['files'][small_run.file]['chunks']) == sorted(list(chunks) + forgotten)
+
+def test_stale_fingerprint_parses_the_file_again(small_run):
+    checkpoint = os.path.join(small_run.directory, 'checkpoint.json')
+    ParseConfigSingle(small_run.config(CHECKPOINT = checkpoint))
+    assert len(small_run.output()) > 0
+    ParseConfigSingle(small_run.config('fresh', CHUNKSIZE = 50))
+    config = small_run.config(CHECKPOINT = checkpoint, CHUNKSIZE = 50)
+    ParseConfigSingle(config)
+    # the chunks of the old chunk size are removed and the file is written as a run with the new one writes it
+    assert sorted(os.listdir(os.path.join(small_run.directory, 'out'))) == ['data_0.nt', 'data_1.nt', 'manifest.json']
+    assert small_run.output() == small_run.output('fresh')
+    state = Manifest(checkpoint)['files'][small_run.file]
+    assert state['total'] == 2 and state['fingerprint'] == Fingerprint(Manifest(config), SPEC)
+
+def test_schema_urls_are_fingerprinted_by_their_content():
+    config = {'SCHEMA' : 'http://schema.localhost/schema.jsonld'}
+    first = PropertyTypes({'name' : 'String'}, {'Event' : ['Thing']}, {'name' : ['Event']})
+    assert Fingerprint(config, SPEC, first) == Fingerprint(config, SPEC, PropertyTypes({'name' : 'String'}, {'Event' : ['Thing']}, {'name' : ['Event']}))
+    assert Fingerprint(config, SPEC, first) != Fingerprint(config, SPEC, PropertyTypes({'name' : 'Text'}, {'Event' : ['Thing']}, {'name' : ['Event']}))
+    assert Fingerprint(config, SPEC, first) != Fingerprint(config, SPEC, PropertyTypes({'name' : 'String'}, {'Event' : ['Place']}, {'name' : ['Event']}))
+    with pytest.raises(Exception, match = 'has to be loaded'):
+        Fingerprint(config, SPEC)
+
+@pytest.mark.parametrize('content', ['{"files" : {"data.csv" :', '', '[]', '{"chunks" : {}}'])
+def test_corrupt_manifest(small_run, content):
+    checkpoint = os.path.join(small_run.directory, 'checkpoint.json')
+    with open(checkpoint, 'w') as f:
+        f.write(content)
+    with pytest.raises(Exception, match = 'not a valid manifest'):
+        ParseConfigSingle(small_run.config(CHECKPOINT = checkpoint))
+    assert small_run.output() == []
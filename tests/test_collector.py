@@ -0,0 +1,69 @@
+import random
+import multiprocessing
+
+import pytest
+
+from schema_grapher.util.collector import TripleCollector
+from schema_grapher.util.dedup import ExactIndex, BloomIndex, TripleKey
+
+class CountingIndex(ExactIndex):
+    """ExactIndex that remembers the size of every lookup"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    def filter(self, keys):
+        self.calls += [len(keys)]
+        return super().filter(keys)
+
+def Rows(collector, rows):
+    for row in rows:
+        for t in row:
+            collector.add(t)
+        collector.take()
+    collector.finish()
+
+def test_run_dedup_looks_up_rows_in_batches(tmp_path):
+    index = CountingIndex(str(tmp_path / 'dedup.sqlite'))
+    written = []
+    collector = TripleCollector('run', index, written.extend, flush = 10)
+    rows = [[('<s%d>' % (n % 7), '<p>', '"%d"' % j) for j in range(3)] for n in range(20)]
+    Rows(collector, rows)
+    # the rows of 3 triples are looked up together once at least 10 triples wait for the index
+    assert index.calls == [12, 12, 12, 12, 12]
+    assert written == list(dict.fromkeys(t for row in rows for t in row))
+    assert (collector.count, collector.dropped) == (21, 39)
+
+def test_run_dedup_spans_collectors(tmp_path):
+    index = ExactIndex(str(tmp_path / 'dedup.sqlite'))
+    first, second = [], []
+    Rows(TripleCollector('run', index, first.extend, flush = 100), [[('<a>', '<p>', '<b>')], [('<a>', '<p>', '<c>')]])
+    Rows(TripleCollector('run', index, second.extend, flush = 100), [[('<a>', '<p>', '<c>'), ('<a>', '<p>', '<d>')]])
+    assert first == [('<a>', '<p>', '<b>'), ('<a>', '<p>', '<c>')]
+    assert second == [('<a>', '<p>', '<d>')]
+
+def Filter(index, keys, seed, queue):
+    """Adds the keys to the index in small batches in an order of its own and puts the number it was told were new"""
+    keys = list(keys)
+    random.Random(seed).shuffle(keys)
+    queue.put(sum(sum(index.filter(keys[i:i + 50])) for i in range(0, len(keys), 50)))
+
+@pytest.mark.parametrize('kind', ['exact', 'bloom'])
+def test_no_duplicates_leak_across_processes(tmp_path, kind):
+    keys = [TripleKey(('<s%d>' % n, '<p>', '<o>')) for n in range(20000)]
+    if kind == 'exact':
+        index = ExactIndex(str(tmp_path / 'dedup.sqlite'))
+    else:
+        # sized so that a false positive is unlikely, every key is then new to exactly one process
+        index = BloomIndex(str(tmp_path / 'dedup.bloom'), 1000000, 0.0001)
+    index.clear()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    workers = [context.Process(target = Filter, args = (index, keys, seed, queue)) for seed in range(4)]
+    for w in workers:
+        w.start()
+    new = [queue.get() for w in workers]
+    for w in workers:
+        w.join()
+    assert sum(new) == len(keys)
@@ -0,0 +1,97 @@
+import random
+
+import pytest
+import dateutil.parser
+
+from schema_grapher.util.dates import DateParser
+
+COLUMNS = {
+    'iso' : ['2021-03-04', '2021-03-04T10:11:12', '2021-03-04 10:11:12', '2021-03-04T10:11', '2021-03-04T10:11:12.5', '2021-03-04T10:11:12.123456',
+             '2021-03-04T10:11:12Z', '2021-03-04T10:11:12+05:30', '2021-03-04T10:11:12-08:00', '1999-12-31T23:59:59.000001-00:00', '2020-02-29'],
+    'us' : ['03/04/2021', '3/4/2021', '12/31/1999', '03/04/2021 10:11', '03/04/2021 10:11:12', '03/04/2021 10:11:12 PM', '02/29/2020', '03/04/21', '01/02/0099'],
+    'dayfirst' : ['04/03/2021', '13/04/2021', '31/12/1999', '25-12-2021', '01/02/2021', '29/02/2020', '31/04/2021'],
+    'text' : ['Mar 4 2021', 'Mar 4, 2021', '4 Mar 2021', '04-Mar-2021', 'Thu Mar 04 10:11:12 2021', 'March 4th, 2021', 'Sunday 4 July 2021'],
+    'unparseable' : ['not a date', '', '2021-13-45', '2021-02-30', '2021-03-04T25:00:00', '99/99/9999', 'Marchember 4'],
+}
+
+# kept before a test counts the calls to dateutil
+DATEUTIL = dateutil.parser.parse
+
+def Expected(s):
+    """Returns what dateutil parses s to, or ValueError when it cannot"""
+    try:
+        return DATEUTIL(s)
+    except (ValueError, OverflowError):
+        return ValueError
+
+def Parsed(parser, s):
+    """Returns what a DateParser parses s to, or ValueError when it cannot"""
+    try:
+        return parser.parse(s)
+    except ValueError:
+        return ValueError
+
+def Column(values, rows = 200, seed = 0):
+    """Returns rows values drawn from values, so that a DateParser samples and memoizes them as it would a column"""
+    r = random.Random(seed)
+    return [r.choice(values) for n in range(rows)]
+
+@pytest.mark.parametrize('kind', sorted(COLUMNS))
+def test_matches_dateutil(kind):
+    parser = DateParser(size = 4)
+    for s in Column(COLUMNS[kind]):
+        value = Parsed(parser, s)
+        expected = Expected(s)
+        # a UTC offset may be another tzinfo than dateutil's, the datetime and its rendering are the same
+        assert value == expected, s
+        assert value is ValueError or (value.isoformat(), value.utcoffset()) == (expected.isoformat(), expected.utcoffset()), s
+
+def test_mixed_columns_match_dateutil():
+    values = [v for kind in sorted(COLUMNS) for v in COLUMNS[kind]]
+    for seed in range(5):
+        parser = DateParser(size = 16, sample = 8)
+        assert [Parsed(parser, s) for s in Column(values, 500, seed)] == [Expected(s) for s in Column(values, 500, seed)]
+
+@pytest.fixture
+def dateutil_calls(monkeypatch):
+    calls = []
+
+    def Parse(s, *args, **kwargs):
+        calls.append(s)
+        return DATEUTIL(s, *args, **kwargs)
+
+    monkeypatch.setattr(dateutil.parser, 'parse', Parse)
+    return calls
+
+def test_iso_dates_skip_dateutil(dateutil_calls):
+    parser = DateParser(size = 0)
+    for s in COLUMNS['iso']:
+        parser.parse(s)
+    assert dateutil_calls == [] and parser.format is None
+
+def test_format_is_inferred_from_a_sample(dateutil_calls):
+    parser = DateParser(size = 0, sample = 8)
+    values = ['{:02d}/{:02d}/{}'.format(n % 12 + 1, n % 28 + 1, 1990 + n) for n in range(30)]
+    for s in values:
+        assert parser.parse(s) == Expected(s)
+    # once the sample agrees with a format only the values it does not parse reach dateutil
+    assert parser.format == '%m/%d/%Y'
+    assert dateutil_calls[:8] == values[:8]
+    assert [s for s in dateutil_calls[8:] if s in values[8:]] == []
+    assert parser.parse('13/04/2021') == Expected('13/04/2021')
+    assert dateutil_calls[-1] == '13/04/2021'
+
+def test_no_format_is_inferred_for_ambiguous_columns():
+    # no format parses half of a sample of day first and mixed dates, so the column keeps using dateutil
+    parser = DateParser(size = 0, sample = 8)
+    for s in ['13/04/2021', '14/04/2021', '2021/04/15 10:00:00', '15.04.2021', '16/04/2021', 'April 17 2021', '18/04/2021', '19 Apr 2021']:
+        parser.parse(s)
+    assert parser.format is None
+
+def test_memoized_values_are_recent():
+    parser = DateParser(size = 2)
+    for s in ['2021-03-04', '03/04/2021', 'not a date', '2021-03-04']:
+        Parsed(parser, s)
+    assert list(parser._memo) == ['not a date', '2021-03-04']
+    with pytest.raises(ValueError, match = 'not a date'):
+        parser.parse('not a date')
@@ -0,0 +1,126 @@
+import json
+import time
+import threading
+import http.server
+import urllib.parse
+import multiprocessing
+
+import pytest
+
+from schema_grapher.util.geobatch import RateLimiter, Geocoder
+from schema_grapher.util.geocache import GeoCache, GetGeoCache, SetGeoCache
+from schema_grapher.util.misc import AddressQuery
+
+class StubNominatim(http.server.ThreadingHTTPServer):
+    """Nominatim server that finds every street but nowhere, answers the first failures requests for a street flaky with 503 and drops the connection of every request for a street reset"""
+
+    def __init__(self, failures = 0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.failures = failures
+        self.hits = []
+        self.lock = threading.Lock()
+
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        street = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get('street', [''])[0]
+        with self.server.lock:
+            self.server.hits += [street]
+            failed = street == 'flaky' and self.server.hits.count(street) <= self.server.failures
+        if street == 'reset':
+            self.close_connection = True
+            return
+        if failed:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        features = [] if street == 'nowhere' else [{'properties' : {'place_rank' : 30, 'display_name' : street}}]
+        body = json.dumps({'type' : 'FeatureCollection', 'features' : features}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def nominatim(request):
+    server = StubNominatim(*getattr(request, 'param', ()))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    cache = GetGeoCache()
+    SetGeoCache(GeoCache())
+    yield server
+    SetGeoCache(cache)
+    server.shutdown()
+    server.server_close()
+
+def Calls(limiter, n, results):
+    for _ in range(n):
+        limiter.wait()
+        results.put(time.monotonic())
+
+def test_shared_limiter_holds_across_processes():
+    limiter = RateLimiter(20)
+    limiter.share()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=Calls, args=(limiter, 5, results)) for _ in range(4)]
+    for w in workers:
+        w.start()
+    calls = sorted(results.get() for _ in range(20))
+    for w in workers:
+        w.join()
+    # 20 calls at 20 per second take at least 19 intervals, not the 4 of a limit per process
+    assert calls[-1] - calls[0] >= 19 * limiter.interval * 0.95
+
+def test_limiter_spaces_calls_of_a_process():
+    limiter = RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 5 * limiter.interval * 0.95
+    assert RateLimiter(0).interval == 0.0
+
+def test_prefetch_resolves_each_query_once(nominatim):
+    geocoder = Geocoder(nominatim.url(), concurrency = 4, rate = 0)
+    queries = ['street=' + str(n % 10) for n in range(40)]
+    found = geocoder.prefetch(queries)
+    assert sorted(found.keys()) == sorted(set(queries))
+    assert all(found[q]['features'][0]['properties']['display_name'] == q.split('=')[1] for q in queries)
+    assert sorted(nominatim.hits) == sorted(str(n) for n in range(10))
+    # a second batch is answered from the cache
+    assert geocoder.prefetch(queries) == found
+    assert len(nominatim.hits) == 10
+
+@pytest.mark.parametrize('nominatim', [(2,)], indirect = True)
+def test_retries_transient_errors(nominatim):
+    geocoder = Geocoder(nominatim.url(), rate = 0, retries = 2, backoff = 0.01)
+    assert len(geocoder.search('street=flaky')['features']) == 1
+    assert nominatim.hits == ['flaky'] * 3
+
+@pytest.mark.parametrize('nominatim', [(5,)], indirect = True)
+def test_failed_lookups_are_not_cached(nominatim):
+    geocoder = Geocoder(nominatim.url(), rate = 0, retries = 1, backoff = 0.01)
+    assert geocoder.search('street=flaky') == {}
+    assert geocoder.search('street=reset') == {}
+    assert geocoder.search('street=flaky') == {}
+    assert nominatim.hits == ['flaky', 'flaky', 'reset', 'reset', 'flaky', 'flaky']
+    assert AddressQuery('street=x', 'http://127.0.0.1:1') == {}
+    assert GetGeoCache().get('http://127.0.0.1:1/search?format=geojson&limit=1&addressdetails=1&street=x') == (False, None)
+
+def test_empty_results_are_cached(nominatim):
+    geocoder = Geocoder(nominatim.url(), rate = 0)
+    assert geocoder.search('street=nowhere')['features'] == []
+    assert geocoder.search('street=nowhere')['features'] == []
+    assert AddressQuery('street=nowhere', nominatim.url())['features'] == []
+    assert nominatim.hits == ['nowhere']
+    SetGeoCache(GeoCache(negative_ttl = 0))
+    geocoder.search('street=nowhere')
+    geocoder.search('street=nowhere')
+    assert nominatim.hits == ['nowhere'] * 3
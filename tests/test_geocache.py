@@ -0,0 +1,120 @@
+import sqlite3
+import multiprocessing
+
+import pytest
+
+from schema_grapher.util import geocache
+from schema_grapher.util.geocache import GeoCache, NormalizeQuery
+
+class Clock(object):
+    """Stand-in for the time module of geocache whose time only moves when it is set"""
+
+    def __init__(self, now = 1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geocache, 'time', clock)
+    return clock
+
+def test_lru_evicts_the_least_recently_used():
+    cache = GeoCache(size = 3)
+    for key in 'abc':
+        cache.put(key, [key])
+    assert cache.get('a') == (True, ['a'])
+    cache.put('d', ['d'])
+    assert list(cache._memory) == ['c', 'a', 'd']
+    assert cache.get('b') == (False, None)
+    assert [cache.get(key)[0] for key in 'acd'] == [True, True, True]
+    assert (cache.hits, cache.misses) == (4, 1)
+
+def test_evicted_entries_are_read_back_from_sqlite(tmp_path):
+    cache = GeoCache(str(tmp_path / 'geocache.sqlite'), size = 2)
+    for key in 'abc':
+        cache.put(key, {'key' : key})
+    assert 'a' not in cache._memory
+    assert cache.get('a') == (True, {'key' : 'a'})
+    assert list(cache._memory) == ['c', 'a']
+
+def Lookup(cache, keys, puts, queue):
+    """Looks up keys in a cache unpickled in another process, stores puts and reports what it found"""
+    found = [cache.get(k) for k in keys]
+    for k in puts:
+        cache.put(k, {'key' : k, 'by' : 'child'})
+    queue.put(found)
+
+def test_sqlite_is_shared_across_processes(tmp_path):
+    path = str(tmp_path / 'geocache.sqlite')
+    cache = GeoCache(path)
+    cache.put('parent', {'key' : 'parent'})
+    cache.put('nowhere', [], negative = True)
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    child = context.Process(target = Lookup, args = (cache, ['parent', 'nowhere', 'child'], ['child'], queue))
+    child.start()
+    found = queue.get()
+    child.join()
+    # the child starts with an empty memory, so everything it finds was read from the file
+    assert found == [(True, {'key' : 'parent'}), (True, []), (False, None)]
+    assert cache.get('child') == (True, {'key' : 'child', 'by' : 'child'})
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+def Fill(path, worker, queue):
+    """Stores 200 keys of a worker in the cache at path"""
+    cache = GeoCache(path)
+    for n in range(200):
+        cache.put('{}-{}'.format(worker, n), [n])
+    queue.put(worker)
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'geocache.sqlite')
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    workers = [context.Process(target = Fill, args = (path, w, queue)) for w in range(4)]
+    for w in workers:
+        w.start()
+    assert sorted(queue.get() for w in workers) == [0, 1, 2, 3]
+    for w in workers:
+        w.join()
+    cache = GeoCache(path)
+    assert all(cache.get('{}-{}'.format(w, n)) == (True, [n]) for w in range(4) for n in range(200))
+
+def test_ttl(tmp_path, clock):
+    path = str(tmp_path / 'geocache.sqlite')
+    cache = GeoCache(path, ttl = 10)
+    cache.put('a', ['a'])
+    clock.now += 10
+    assert cache.get('a') == (True, ['a'])
+    assert GeoCache(path, ttl = 10).get('a') == (True, ['a'])
+    clock.now += 1
+    assert cache.get('a') == (False, None)
+    assert GeoCache(path, ttl = 10).get('a') == (False, None)
+    assert 'a' not in cache._memory
+
+def test_negative_entries(tmp_path, clock):
+    path = str(tmp_path / 'geocache.sqlite')
+    cache = GeoCache(path, negative_ttl = 60)
+    cache.put('found', ['somewhere'])
+    cache.put('nowhere', [], negative = True)
+    clock.now += 60
+    assert cache.get('nowhere') == (True, [])
+    clock.now += 1
+    # only the negative entry expires, responses are kept forever without a ttl
+    assert cache.get('nowhere') == (False, None)
+    assert GeoCache(path, negative_ttl = 60).get('nowhere') == (False, None)
+    assert cache.get('found') == (True, ['somewhere'])
+    clock.now += 10 ** 6
+    assert GeoCache(path, negative_ttl = 60).get('found') == (True, ['somewhere'])
+
+def test_negative_caching_can_be_disabled(tmp_path):
+    cache = GeoCache(str(tmp_path / 'geocache.sqlite'), negative_ttl = 0)
+    cache.put('nowhere', [], negative = True)
+    assert cache.get('nowhere') == (False, None)
+    assert GeoCache(str(tmp_path / 'geocache.sqlite')).get('nowhere') == (False, None)
+
+def test_normalized_queries_share_a_key():
+    assert NormalizeQuery('street=1 Main St&city=Richland&') == NormalizeQuery(' City=richland & street=1 main st')
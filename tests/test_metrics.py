@@ -0,0 +1,89 @@
+import os
+import re
+import json
+import multiprocessing
+
+import pytest
+
+from schema_grapher.parser.single import ParseConfigSingle
+from schema_grapher.parser.multiprocess import ParseConfigMulti
+from schema_grapher.util.metrics import Metrics, SetMetrics
+
+from conftest import ROWS
+
+# a sample line of the Prometheus text format, a metric name with optional labels and a value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? -?[0-9.e+-]+$')
+
+@pytest.fixture(autouse = True)
+def no_metrics():
+    yield
+    SetMetrics(None)
+
+def Recorded():
+    """Returns a Metrics with a few timers and counters"""
+    metrics = Metrics()
+    metrics.add('read', 0.5, 10)
+    metrics.add('bind.Echo', 0.25)
+    metrics.add('bind.Echo', 0.25)
+    metrics.add('parse.Odd "name" \\', 0.125)
+    metrics.count('rows', 10)
+    metrics.count('triples', 70)
+    metrics.count('rows', 5)
+    return metrics
+
+def test_writers(tmp_path):
+    Recorded().write(str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == ['metrics.json', 'metrics.prom']
+    with open(str(tmp_path / 'metrics.json')) as f:
+        report = json.load(f)
+    assert report['timers'] == {'bind.Echo' : {'calls' : 2, 'seconds' : 0.5}, 'parse.Odd "name" \\' : {'calls' : 1, 'seconds' : 0.125}, 'read' : {'calls' : 10, 'seconds' : 0.5}}
+    assert report['counters'] == {'rows' : 15, 'triples' : 70}
+    with open(str(tmp_path / 'metrics.prom')) as f:
+        lines = f.read().splitlines()
+    assert all(l.startswith('# HELP ') or l.startswith('# TYPE ') or SAMPLE.match(l) for l in lines)
+    assert 'schema_grapher_stage_calls_total{stage="bind",name="Echo"} 2' in lines
+    assert 'schema_grapher_stage_seconds_total{stage="read",name=""} 0.500000' in lines
+    assert 'schema_grapher_stage_calls_total{stage="parse",name="Odd \\"name\\" \\\\"} 1' in lines
+    assert lines[-4:] == ['# TYPE schema_grapher_rows_total counter', 'schema_grapher_rows_total 15', '# TYPE schema_grapher_triples_total counter', 'schema_grapher_triples_total 70']
+
+def test_take_starts_over():
+    metrics = Recorded()
+    snapshot = metrics.take()
+    assert snapshot['counters'] == {'rows' : 15, 'triples' : 70} and snapshot['timers']['bind.Echo'] == [2, 0.5]
+    assert metrics.take() == {'timers' : {}, 'counters' : {}}
+
+def Worker(n):
+    """Records the metrics of a chunk of n rows and hands them over like a worker"""
+    metrics = Metrics()
+    for k in range(n):
+        metrics.add('parse.Integer', 0.5)
+        metrics.count('rows')
+    metrics.count('triples', 7 * n)
+    return metrics.take()
+
+def test_merge_across_workers():
+    parent = Metrics()
+    parent.count('rows', 1)
+    with multiprocessing.get_context('fork').Pool(3) as pool:
+        for snapshot in pool.imap_unordered(Worker, range(1, 11)):
+            parent.merge(snapshot)
+    report = parent.report()
+    assert report['counters'] == {'rows' : 56, 'triples' : 7 * 55}
+    assert report['timers'] == {'parse.Integer' : {'calls' : 55, 'seconds' : 27.5}}
+
+@pytest.mark.parametrize('parse', [ParseConfigSingle, ParseConfigMulti], ids = ['single', 'multi'])
+def test_counters_of_a_run(small_run, parse):
+    ParseConfigSingle(small_run.config('all'))
+    triples = len(small_run.output('all'))
+    metrics = os.path.join(small_run.directory, 'metrics')
+    parse(small_run.config(DEDUP = 'chunk'), metrics = metrics)
+    written = len(small_run.output())
+    with open(os.path.join(metrics, 'metrics.json')) as f:
+        report = json.load(f)
+    # the organizations of a chunk repeat, so chunk dedup drops some of the triples written without it
+    assert 0 < written < triples
+    assert report['counters'] == {'rows' : ROWS, 'triples' : written, 'duplicates' : triples - written}
+    assert {k : v['calls'] for k, v in report['timers'].items() if k.startswith('parse.')} == {'parse.Decimal' : ROWS, 'parse.Integer' : ROWS, 'parse.String' : 2 * ROWS}
+    assert report['timers']['render']['calls'] == ROWS
+    with open(os.path.join(metrics, 'metrics.prom')) as f:
+        assert 'schema_grapher_rows_total {}'.format(ROWS) in f.read().splitlines()
@@ -0,0 +1,32 @@
+import random
+
+from schema_grapher.util.misc import ReadCSV, ReadCSVRange, ReadCSVBytes, CountCSVBytes, CSVRecordStarts
+
+def test_record_starts_keep_quoted_newlines(tmp_path):
+    # most of every record is a quoted field holding newlines, so most slice boundaries are first aimed inside one
+    path = str(tmp_path / 'quoted.csv')
+    with open(path, 'w', newline = '') as f:
+        f.write('id,text,n\n')
+        for n in range(200):
+            f.write('{},"{}",{}\n'.format(n, '\n'.join(['line, "quoted"'.replace('"', '""')] * (1 + n % 5)), n))
+            if n % 17 == 0:
+                f.write(',,\n\n')
+    starts, counts = CSVRecordStarts(path, 7)
+    assert len(counts) == len(starts) - 1 > 10
+    rows = [list(ReadCSVRange(path, s, e)) for s, e in zip(starts[:-1], starts[1:])]
+    assert [len(r) for r in rows] == counts
+    assert [row for r in rows for row in r] == list(ReadCSV(path))[1:]
+    assert all(r[0][0].isdigit() for r in rows)
+
+def test_count_matches_reader():
+    r = random.Random(0)
+    fields = ['', '""', '"a\nb"', '"x""y"', '"a,b"', '"\r\n"', 'a', ' ', 'é']
+    for _ in range(2000):
+        lines = [','.join(r.choice(fields) for _ in range(r.randint(1, 3))) for _ in range(r.randint(0, 8))]
+        data = r.choice(['\n', '\r\n']).join(lines).encode('utf-8') + r.choice([b'', b'\n'])
+        assert CountCSVBytes(data) == sum(1 for _ in ReadCSVBytes(data)), data
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.csv'
+    path.write_bytes(b'')
+    assert CSVRecordStarts(str(path), 10) == ([0], [])
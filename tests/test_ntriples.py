@@ -0,0 +1,61 @@
+import math
+import json
+import datetime
+
+import pytest
+import rdflib
+
+from schema_grapher.util.ntriples import NTLiteral, NTLiterals, StringLiteral, StringLiterals, GeoJSONLiteral
+from schema_grapher.util.rdf import WrapDQ, ColumnLiterals, DataLiteral, DatumConverter, GeoJSONDatum
+
+STRINGS = ['plain', 'a "quoted" word', "'single'", 'back\\slash', '\\"', 'cr\rx', 'tab\tx', 'nul\x00x', 'bell\x07', 'del\x7f',
+           'é', 'emoji 😀', 'clef 𝄞', '']
+
+VALUES = STRINGS + [0, -5, 10**30, 1.5, 1e20, 1e-7, 0.1, -0.0, float('inf'), -float('inf'), True, False,
+                    datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.datetime(2020, 1, 2, 3, 4, 5, 123456),
+                    datetime.datetime(2020, 1, 2, tzinfo = datetime.timezone.utc), datetime.date(2020, 1, 2),
+                    rdflib.Literal('hi', lang = 'en'), rdflib.Literal('hallo', lang = 'de-AT'),
+                    rdflib.Literal('5', datatype = rdflib.XSD.integer), rdflib.Literal('x', datatype = rdflib.URIRef('http://schema.localhost/Text'))]
+
+def Parse(literal):
+    """Parses a literal with the rdflib N-Triples parser"""
+    g = rdflib.Graph()
+    g.parse(data = '<http://s> <http://p> ' + literal + ' .\n', format = 'nt')
+    return list(g.objects())[0]
+
+@pytest.mark.parametrize('value', VALUES, ids = repr)
+def test_matches_rdflib(value):
+    assert NTLiteral(value) == rdflib.Literal(value).n3()
+    assert WrapDQ(value) == NTLiteral(value)
+
+def test_nan_matches_rdflib():
+    assert NTLiteral(math.nan) == rdflib.Literal(math.nan).n3() == '"NaN"^^<http://www.w3.org/2001/XMLSchema#double>'
+
+@pytest.mark.parametrize('value', STRINGS + ['line\nbreak', 'crlf\r\n', '"""'], ids = repr)
+def test_parses_back(value):
+    assert Parse(StringLiteral(value)) == rdflib.Literal(value)
+
+def test_newlines_are_escaped():
+    # rdflib writes a string holding a newline as a triple quoted literal, which is Turtle and not N-Triples, every triple is kept on one line instead
+    assert rdflib.Literal('line\nbreak').n3() == '"""line\nbreak"""'
+    assert NTLiteral('line\nbreak') == '"line\\nbreak"'
+    assert NTLiteral('a\r\nb"\n') == '"a\\r\\nb\\"\\n"'
+
+GEOJSON = [{'type' : 'Point', 'coordinates' : [12.5, 48.25]}, {'type' : 'Polygon', 'coordinates' : [[[0.0, 1e-7], [1, 2], [0.0, 1e-7]]]}, {'name' : 'Stra\u00dfe "7"\n'}]
+
+@pytest.mark.parametrize('value', GEOJSON, ids = repr)
+def test_geojson_matches_rdflib(value):
+    literal = rdflib.Literal(json.dumps(value), datatype = rdflib.URIRef('http://schema.localhost/GeoJSON'))
+    assert GeoJSONLiteral(value) == GeoJSONDatum(value) == literal.n3()
+    assert json.loads(Parse(GeoJSONLiteral(value))) == value
+
+def test_columns_match_values():
+    assert NTLiterals(VALUES) == [NTLiteral(v) for v in VALUES]
+    assert StringLiterals(STRINGS) == [StringLiteral(s) for s in STRINGS]
+
+@pytest.mark.parametrize('prop', ['name', 'count', 'shape', 'untyped'])
+def test_column_literals_match_data_literals(prop):
+    pt = {'name' : 'String', 'count' : 'Integer', 'shape' : 'GeoJSON'}
+    column = STRINGS + ['', None, 5, 2.5, True, ['a', 'b'], GEOJSON[0], datetime.datetime(2020, 1, 2)]
+    converter = DatumConverter(prop, pt)
+    assert ColumnLiterals(prop, pt, column) == [DataLiteral(converter, d) for d in column]
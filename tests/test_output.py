@@ -0,0 +1,160 @@
+import os
+import gzip
+import zlib
+import json
+import hashlib
+import threading
+
+import pytest
+
+from schema_grapher.parser.single import ParseConfigSingle
+from schema_grapher.parser.multiprocess import ParseConfigMulti
+from schema_grapher.util.output import LocalBackend, Uploader, PartitionedOutput, PartitionName, PartitionCountsName, MergePartitions
+from schema_grapher.util.rdf import RenderTriples
+
+class FlakyBackend(LocalBackend):
+    """LocalBackend whose first fail uploads of every key raise an error, and that counts the uploads of every key"""
+
+    def __init__(self, directory, fail = 0):
+        super().__init__(directory)
+        self.fail = fail
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def upload(self, path, key):
+        with self.lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            failed = self.attempts[key] <= self.fail
+        if failed:
+            raise OSError("connection reset")
+        super().upload(path, key)
+
+def WriteFiles(directory, n):
+    """Writes n small files to directory and returns their paths"""
+    paths = []
+    for k in range(n):
+        paths += [os.path.join(directory, 'chunk_{}.nt'.format(k))]
+        with open(paths[-1], 'w') as f:
+            f.write('<http://s/{0}> <http://p> "{0}" .\n'.format(k) * (k + 1))
+    return paths
+
+def Digest(path):
+    """Returns the md5 of a file"""
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+def test_local_backend_manifest(tmp_path):
+    paths = WriteFiles(str(tmp_path), 5)
+    manifest = str(tmp_path / 'manifest.json')
+    uploader = Uploader(LocalBackend(str(tmp_path / 'bucket')), concurrency = 2, manifest = manifest)
+    done = []
+    for p in paths:
+        uploader.submit(p, 'run/' + os.path.basename(p), lambda p = p: done.append(p))
+    uploader.close()
+    assert sorted(done) == sorted(paths)
+    with open(manifest) as f:
+        objects = json.load(f)['objects']
+    assert objects == [{'key' : 'run/' + os.path.basename(p), 'file' : p, 'size' : os.path.getsize(p), 'md5' : Digest(p), 'uploaded' : True} for p in paths]
+    assert sorted(os.listdir(str(tmp_path / 'bucket' / 'run'))) == sorted(os.path.basename(p) for p in paths)
+    assert all(Digest(str(tmp_path / 'bucket' / o['key'])) == o['md5'] for o in objects)
+
+def test_run_manifest_lists_every_chunk(small_run):
+    bucket = os.path.join(small_run.directory, 'bucket')
+    ParseConfigSingle(small_run.config(UPLOAD_BACKEND = 'local', UPLOAD_DIR = bucket))
+    with open(os.path.join(small_run.directory, 'out', 'manifest.json')) as f:
+        objects = json.load(f)['objects']
+    assert [o['key'] for o in objects] == ['run/data_{}.nt'.format(k) for k in range(5)]
+    assert all(o['uploaded'] and Digest(os.path.join(bucket, o['key'])) == Digest(o['file']) == o['md5'] for o in objects)
+
+def test_failed_uploads_are_retried(tmp_path):
+    paths = WriteFiles(str(tmp_path), 3)
+    backend = FlakyBackend(str(tmp_path / 'bucket'), fail = 2)
+    uploader = Uploader(backend, concurrency = 2, retries = 2, backoff = 0.001)
+    done = []
+    for p in paths:
+        uploader.submit(p, os.path.basename(p), lambda p = p: done.append(p))
+    entries = uploader.close()
+    assert all(e['uploaded'] for e in entries) and sorted(done) == sorted(paths)
+    assert backend.attempts == {os.path.basename(p) : 3 for p in paths}
+
+def test_exhausted_retries_are_reported(tmp_path):
+    paths = WriteFiles(str(tmp_path), 2)
+    backend = FlakyBackend(str(tmp_path / 'bucket'), fail = 3)
+    uploader = Uploader(backend, concurrency = 1, retries = 2, backoff = 0.001, manifest = str(tmp_path / 'manifest.json'))
+    done = []
+    for p in paths:
+        uploader.submit(p, os.path.basename(p), lambda p = p: done.append(p))
+    uploader.close()
+    with open(str(tmp_path / 'manifest.json')) as f:
+        assert [o['uploaded'] for o in json.load(f)['objects']] == [False, False]
+    assert done == [] and backend.attempts == {os.path.basename(p) : 3 for p in paths}
+
+def test_callback_errors_are_not_retried(tmp_path):
+    paths = WriteFiles(str(tmp_path), 1)
+    backend = FlakyBackend(str(tmp_path / 'bucket'))
+    uploader = Uploader(backend, concurrency = 1, retries = 2, backoff = 0.001)
+
+    def Done():
+        raise ValueError("checkpoint is full")
+
+    uploader.submit(paths[0], 'chunk_0.nt', Done)
+    with pytest.raises(ValueError, match = 'checkpoint is full'):
+        uploader.close()
+    assert backend.attempts == {'chunk_0.nt' : 1}
+
+def Partitions(directory, n, compression = None):
+    """Returns the lines of the merged partitions in directory"""
+    lines = []
+    for k in range(n):
+        path = os.path.join(directory, 'partition_{}.nt'.format(k))
+        if compression == 'gzip':
+            with gzip.open(path + '.gz', 'rt') as f:
+                lines += [f.read().splitlines()]
+        else:
+            with open(path) as f:
+                lines += [f.read().splitlines()]
+    return lines
+
+@pytest.mark.parametrize('parse, compression', [(ParseConfigSingle, None), (ParseConfigMulti, None), (ParseConfigSingle, 'gzip')], ids = ['single', 'multi', 'gzip'])
+def test_partitions_merge_to_the_unpartitioned_output(small_run, parse, compression):
+    ParseConfigSingle(small_run.config('all'))
+    expected = small_run.output('all')
+    parse(small_run.config(PARTITIONS = 3, OUTPUT_COMPRESSION = compression))
+    partitions = Partitions(os.path.join(small_run.directory, 'out'), 3, compression)
+    # every partition holds the triples of its subjects in the order the chunks wrote them, the pieces of the 5 chunks are removed
+    assert sorted(sum(partitions, [])) == sorted(expected)
+    for k, lines in enumerate(partitions):
+        assert len(lines) > 0
+        assert lines == [l for l in expected if zlib.crc32(l.split(' ', 1)[0].encode('utf-8')) % 3 == k]
+    assert sorted(os.listdir(os.path.join(small_run.directory, 'out'))) == sorted(['manifest.json'] + ['partition_{}.nt{}'.format(k, '.gz' if compression else '') for k in range(3)])
+    with open(os.path.join(small_run.directory, 'out', 'manifest.json')) as f:
+        assert [p['triples'] for p in json.load(f)['partitions']] == [len(lines) for lines in partitions]
+
+TRIPLES = [('<http://s/%d>' % (n % 13), '<http://p/%d>' % n, '"%d"' % n) for n in range(100)]
+
+def test_merge_rolls_over_chunks_in_order(tmp_path):
+    chunks = []
+    for c in range(4):
+        chunks += [str(tmp_path / 'data_{}.nt'.format(c))]
+        f = PartitionedOutput(chunks[-1], 2)
+        # the 13 subjects repeat in every chunk, so each partition gathers them from all of the chunks
+        for n in range(25 * c, 25 * (c + 1)):
+            f.write_triples([TRIPLES[n]], RenderTriples)
+        f.close()
+    assert all(os.path.exists(PartitionName(c, k)) for c in chunks for k in range(2))
+    merged = MergePartitions(str(tmp_path), chunks, 2)
+    assert [p['triples'] for p in merged] == [len(Partitions(str(tmp_path), 2)[k]) for k in range(2)]
+    assert sum(Partitions(str(tmp_path), 2), []) == [RenderTriples([t]).rstrip('\n') for k in range(2) for t in TRIPLES if zlib.crc32(t[0].encode('utf-8')) % 2 == k]
+    assert not any(os.path.exists(PartitionName(c, k)) or os.path.exists(PartitionCountsName(c)) for c in chunks for k in range(2))
+    # merging again finds the partitions already merged
+    assert MergePartitions(str(tmp_path), chunks, 2) is None
+
+def test_merge_needs_every_piece(tmp_path):
+    chunks = [str(tmp_path / 'data_{}.nt'.format(c)) for c in range(2)]
+    for c in chunks:
+        f = PartitionedOutput(c, 2)
+        f.write_triples(TRIPLES[:10], RenderTriples)
+        f.close()
+    os.remove(PartitionCountsName(chunks[1]))
+    assert MergePartitions(str(tmp_path), chunks, 2) is None
+    assert not os.path.exists(str(tmp_path / 'partition_0.nt'))
@@ -0,0 +1,25 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+def Run(code):
+    """Runs code in a fresh interpreter, as the imports it checks are cached by this one, and returns what it prints"""
+    env = dict(os.environ, PYTHONPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return subprocess.run([sys.executable, '-c', code], env = env, check = True, capture_output = True, text = True).stdout.split()
+
+@pytest.mark.parametrize('package', ['schema_grapher.util', 'schema_grapher.parser'])
+def test_packages_are_imported_lazily(package):
+    assert Run("import sys, {0}; print(len([m for m in sys.modules if m.startswith('{0}.')]))".format(package)) == ['0']
+
+def test_star_imports_export_the_modules():
+    names = Run("from schema_grapher.util import *\nfrom schema_grapher.parser import *\n"
+                "print(ParseDatum.__module__, ResolveBind.__module__, ReadCSVStream.__module__, rdf.__name__, ParseConfigSingle.__module__, ParseStream.__module__)")
+    assert names == ['schema_grapher.util.rdf', 'schema_grapher.util.bind', 'schema_grapher.util.misc', 'schema_grapher.util.rdf', 'schema_grapher.parser.single', 'schema_grapher.parser.stream']
+
+def test_all_lists_every_name_once():
+    import schema_grapher.util
+    names = schema_grapher.util.__all__
+    assert len(names) == len(set(names)) and all(hasattr(schema_grapher.util, n) for n in names)
+    assert {'ParseDatum', 'LocalDirect', 'MergeShards', 'shard'} <= set(names) and not any(n.startswith('_') for n in names)
@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from schema_grapher.util.rdf import CompileGensymOrder, DeterministicGensym
+
+TEMPLATE = [['Event', {'GENSYM' : 'e', 'name' : ['name'], 'GENSYM_o' : ['organizer']}],
+            ['Org', {'GENSYM' : 'o', 'id' : ['identifier']}],
+            ['Place', {'GENSYM' : 'p', 'GENSYM_e' : ['at'], 'GENSYM_o' : ['of']}]]
+HEADER = {'name' : 0, 'id' : 1}
+ROW = ['Fair', 'ACME']
+
+# IDs of the gensyms of TEMPLATE for ROW, the md5 ones are those of the resolution loop the gensym order replaced
+IDS = {
+    ('GLOBAL', 'md5') : {'e' : 'c1ef2a95-fbb7-f995-bbd1-afb523744938', 'o' : '49f25625-b9d8-3ced-3114-2615476947f0', 'p' : 'b9c77e54-2277-912f-9027-d189d4a4e591'},
+    ('FILE', 'md5') : {'e' : '3aa660cb-52d0-af83-146f-c8e2153bd72f', 'o' : 'cf8da975-3bac-8e06-39d6-6d00d36fd7a2', 'p' : 'ce98c142-8f12-7a39-19b7-19d928ddcb88'},
+    ('GLOBAL', 'blake2b') : {'e' : '0a489e13-6032-6505-8ffe-d1707d5b998b', 'o' : '00cd1f76-725e-4e4b-87be-7c8550e97b4e', 'p' : '40725603-f5a5-ab66-2521-0866fae5ccc7'},
+    ('FILE', 'blake2b') : {'e' : '0facea93-75d9-f7ab-f73e-0ed6d81a933c', 'o' : 'b94a173d-ad91-e2a6-7a0a-cc74e4c002d0', 'p' : 'e8d65d09-4f2a-3f51-c453-562f5f1c8093'},
+}
+
+def Entry(gensym, *fields):
+    """Builds a template entry for gensym with the given column and GENSYM_ fields"""
+    return ['Class', dict([('GENSYM', gensym)] + [(f, ['p']) for f in fields])]
+
+def test_steps_follow_their_references():
+    order = CompileGensymOrder(TEMPLATE)
+    assert order.steps == (((False, 'id'),), ((False, 'name'), (True, 0)), ((True, 1), (True, 0)))
+    assert dict(order.gensyms) == {'o' : 0, 'e' : 1, 'p' : 2}
+
+def test_long_chains():
+    template = [Entry('g%d' % n, 'c', 'GENSYM_g%d' % (n + 1)) for n in range(2000)] + [Entry('g2000', 'c')]
+    order = CompileGensymOrder(template)
+    assert dict(order.gensyms) == {'g%d' % n : 2000 - n for n in range(2001)}
+    assert all(f == (True, ix - 1) for ix, step in enumerate(order.steps[1:], 1) for f in step if f[0])
+
+def test_repeated_gensyms_keep_their_ids():
+    # a gensym defined by two entries takes the ID of the first, and the entries reached after every gensym has an ID are left out
+    template = [Entry('e', 'name', 'GENSYM_o'), Entry('o', 'id', 'city'), Entry('o', 'id2'), Entry('n', 'GENSYM_o', 'GENSYM_n')]
+    with pytest.raises(Exception, match = 'cyclic'):
+        CompileGensymOrder(template)
+    template = template[:3] + [Entry('n', 'GENSYM_o'), Entry('n', 'name', 'GENSYM_n')]
+    order = CompileGensymOrder(template)
+    assert order.steps == (((False, 'id2'),), ((False, 'id'), (False, 'city')), ((False, 'name'), (True, 1)), ((True, 1),))
+    assert order.gensyms == (('o', 1), ('e', 2), ('n', 3))
+
+@pytest.mark.parametrize('template, cycle', [
+    ([Entry('a', 'GENSYM_b'), Entry('b', 'GENSYM_a')], 'a, b'),
+    ([Entry('a', 'c', 'GENSYM_a')], 'a'),
+    ([Entry('a', 'c'), Entry('b', 'GENSYM_c'), Entry('c', 'GENSYM_d'), Entry('d', 'GENSYM_b'), Entry('e', 'GENSYM_d')], 'b, c, d, e'),
+])
+def test_cycles_are_rejected(template, cycle):
+    with pytest.raises(Exception, match = 'cyclic GENSYM dependency between ' + cycle + '$'):
+        CompileGensymOrder(template)
+
+def test_undefined_gensyms_are_rejected():
+    with pytest.raises(Exception, match = 'GENSYM a refers to GENSYM b'):
+        CompileGensymOrder([Entry('a', 'GENSYM_b')])
+
+@pytest.mark.parametrize('deterministic, idhash', sorted(IDS))
+def test_ids(deterministic, idhash):
+    assert DeterministicGensym(deterministic, ROW, HEADER, TEMPLATE, 'chunk_0.nt', idhash) == IDS[deterministic, idhash]
+    assert DeterministicGensym(deterministic, ROW, HEADER, CompileGensymOrder(TEMPLATE), 'chunk_0.nt', idhash) == IDS[deterministic, idhash]
+
+def test_blake2b_ids_are_stable_across_runs():
+    code = 'import json, sys; from schema_grapher.util.rdf import DeterministicGensym; print(json.dumps(DeterministicGensym("GLOBAL", *json.loads(sys.argv[1]), "chunk_0.nt", "blake2b")))'
+    args = json.dumps([ROW, HEADER, TEMPLATE])
+    for seed in ['1', '2']:
+        env = dict(os.environ, PYTHONHASHSEED = seed, PYTHONPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        out = subprocess.run([sys.executable, '-c', code, args], env = env, check = True, capture_output = True, text = True).stdout
+        assert json.loads(out) == IDS['GLOBAL', 'blake2b']
@@ -0,0 +1,157 @@
+import os
+import json
+import pickle
+import threading
+import http.server
+
+import pytest
+
+from schema_grapher.util import schema
+from schema_grapher.util.schema import PropertyTypes, CompileSchema, LoadSchema, LoadSchemaArtifact, SchemaArtifactPath
+
+NS = 'http://schema.localhost/'
+
+def Schema(ranges, classes = {}, domains = {}):
+    """Builds a schema JSON-LD from the range of every property, the superclasses of every class and the domains of every property"""
+    graph = [{'@id' : NS + p, NS + 'rangeIncludes' : [{'@id' : NS + r}]} for p, r in ranges.items()]
+    graph += [{'@id' : NS + c, 'http://www.w3.org/2000/01/rdf-schema#subClassOf' : [{'@id' : NS + s} for s in supers]} for c, supers in classes.items()]
+    graph += [{'@id' : NS + p, NS + 'domainIncludes' : [{'@id' : NS + d} for d in ds]} for p, ds in domains.items()]
+    return {'@graph' : graph}
+
+SCHEMA = Schema({'name' : 'String', 'score' : 'Decimal'}, {'Event' : ['Thing'], 'Festival' : ['Event']}, {'score' : ['Event']})
+
+def test_compile():
+    properties, classes, domains = CompileSchema(SCHEMA)
+    assert properties == {'name' : 'String', 'score' : 'Decimal'}
+    assert classes == {'Event' : ['Thing'], 'Festival' : ['Event']}
+    assert domains == {'score' : ['Event']}
+    assert PropertyTypes(properties, classes, domains).superclasses('Festival') == ['Event', 'Thing']
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """Counts the schemas that are compiled rather than read from an artifact"""
+    calls = []
+    compile = schema.CompileSchemaContent
+
+    def Compile(source, *args, **kwargs):
+        calls.append(source)
+        return compile(source, *args, **kwargs)
+
+    monkeypatch.setattr(schema, 'CompileSchemaContent', Compile)
+    return calls
+
+def WriteSchema(path, content):
+    """Writes a schema JSON-LD to path"""
+    with open(path, 'w') as f:
+        json.dump(content, f)
+
+def test_file_artifact(tmp_path, compiles):
+    source = str(tmp_path / 'schema.jsonld')
+    cache = str(tmp_path / 'cache')
+    WriteSchema(source, SCHEMA)
+    first = LoadSchema(source, cache)
+    assert first.artifact == SchemaArtifactPath(cache, source) and os.path.exists(first.artifact)
+    second = LoadSchema(source, cache)
+    assert compiles == [source]
+    assert (dict(second), second.classes, second.domains) == (dict(first), first.classes, first.domains) == CompileSchema(SCHEMA)
+    # a changed file is compiled again
+    WriteSchema(source, Schema({'name' : 'Text'}))
+    assert dict(LoadSchema(source, cache)) == {'name' : 'Text'}
+    assert compiles == [source, source]
+    assert dict(LoadSchema(source, cache)) == {'name' : 'Text'} and len(compiles) == 2
+
+def test_artifacts_of_another_version_are_compiled_again(tmp_path, compiles, monkeypatch):
+    source = str(tmp_path / 'schema.jsonld')
+    cache = str(tmp_path / 'cache')
+    WriteSchema(source, SCHEMA)
+    path = LoadSchema(source, cache).artifact
+    monkeypatch.setattr(schema, 'ARTIFACT_VERSION', schema.ARTIFACT_VERSION + 1)
+    assert LoadSchemaArtifact(path) is None
+    assert dict(LoadSchema(source, cache)) == CompileSchema(SCHEMA)[0]
+    assert len(compiles) == 2 and LoadSchemaArtifact(path)['version'] == schema.ARTIFACT_VERSION
+
+@pytest.mark.parametrize('content', [b'', b'not marshal', b'\xe9\x00\x01'])
+def test_unreadable_artifacts_are_compiled_again(tmp_path, compiles, content):
+    source = str(tmp_path / 'schema.jsonld')
+    cache = str(tmp_path / 'cache')
+    WriteSchema(source, SCHEMA)
+    path = LoadSchema(source, cache).artifact
+    with open(path, 'wb') as f:
+        f.write(content)
+    assert LoadSchemaArtifact(path) is None
+    assert dict(LoadSchema(source, cache)) == CompileSchema(SCHEMA)[0] and len(compiles) == 2
+
+def test_artifacts_are_pickled_by_path(tmp_path):
+    source = str(tmp_path / 'schema.jsonld')
+    WriteSchema(source, SCHEMA)
+    pt = LoadSchema(source, str(tmp_path / 'cache'))
+    inline = PropertyTypes(dict(pt), pt.classes, pt.domains)
+    pickled = pickle.dumps(pt)
+    # the workers receive the path of the artifact instead of the schema
+    assert pt.artifact.encode('utf-8') in pickled and b'Festival' not in pickled and b'Festival' in pickle.dumps(inline)
+    loaded = pickle.loads(pickled)
+    assert (dict(loaded), loaded.classes, loaded.domains, loaded.artifact) == (dict(pt), pt.classes, pt.domains, pt.artifact)
+
+def test_missing_schemas_are_untyped(tmp_path):
+    pt = LoadSchema(str(tmp_path / 'missing.jsonld'), str(tmp_path / 'cache'))
+    assert dict(pt) == {} and pt.artifact is None
+
+class StubSchema(http.server.ThreadingHTTPServer):
+    """Server of a schema that answers conditional requests with 304 while the schema is unchanged and records the requests it is sent"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubSchemaHandler)
+        self.content = json.dumps(SCHEMA).encode('utf-8')
+        self.version = 1
+        self.requests = []
+
+class StubSchemaHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        etag = '"v{}"'.format(self.server.version)
+        self.server.requests += [self.headers.get('If-None-Match')]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+        self.wfile.write(self.server.content)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = StubSchema()
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_url_artifact(tmp_path, server, compiles):
+    url = 'http://127.0.0.1:{}/schema.jsonld'.format(server.server_port)
+    cache = str(tmp_path / 'cache')
+    assert dict(LoadSchema(url, cache)) == CompileSchema(SCHEMA)[0]
+    # within refresh seconds the artifact is used without asking the server
+    assert dict(LoadSchema(url, cache, refresh = 3600)) == CompileSchema(SCHEMA)[0]
+    assert server.requests == [None]
+    # after that it is checked with a conditional request, and kept when unchanged
+    assert dict(LoadSchema(url, cache, refresh = 0)) == CompileSchema(SCHEMA)[0]
+    assert server.requests == [None, '"v1"'] and len(compiles) == 1
+    server.content = json.dumps(Schema({'name' : 'Text'})).encode('utf-8')
+    server.version = 2
+    assert dict(LoadSchema(url, cache, refresh = 0)) == {'name' : 'Text'}
+    assert server.requests == [None, '"v1"', '"v1"'] and len(compiles) == 2
+
+def test_unreachable_url_keeps_the_artifact(tmp_path, server):
+    url = 'http://127.0.0.1:{}/schema.jsonld'.format(server.server_port)
+    cache = str(tmp_path / 'cache')
+    LoadSchema(url, cache)
+    server.shutdown()
+    server.server_close()
+    assert dict(LoadSchema(url, cache, refresh = 0, timeout = 1)) == CompileSchema(SCHEMA)[0]
+    assert dict(LoadSchema(url, None, timeout = 1)) == {}
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from schema_grapher.util.checkpoint import Checkpoint, CheckpointFromConfig
+from schema_grapher.util.shard import ParseShard, ShardOwner, ShardChunks, ShardManifestPath, ShardManifests, ChunkName, MergeShards
+
+FILES = ['data.csv', '/data/input/part-0001.csv', 'a.csv', 'b.csv']
+
+def test_parse_shard():
+    assert ParseShard('0/1') == (0, 1)
+    assert ParseShard('3/4') == (3, 4)
+    for value in ['4/4', '-1/4', '0/0', '1', 'a/b']:
+        with pytest.raises(Exception):
+            ParseShard(value)
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7])
+def test_every_chunk_has_one_owner(n):
+    for file in FILES:
+        for total in [0, 1, 2, n - 1, n, n + 1, 50]:
+            owners = [ShardOwner(file, fcount, n) for fcount in range(total)]
+            counts = [owners.count(k) for k in range(n)]
+            assert all(0 <= k < n for k in owners)
+            assert counts == [ShardChunks(file, total, (k, n)) for k in range(n)]
+            assert sum(counts) == total and max(counts) - min(counts) <= 1
+
+def test_roots_do_not_change_the_assignment(tmp_path):
+    # two hosts reading the same inputs from different mounts deal out the chunks alike
+    for name in ['data.csv', 'part-0001.csv', 'a.csv']:
+        roots = [os.path.join('/mnt/input', name), os.path.join(str(tmp_path), 'copy', name), name]
+        for n in [2, 3, 7]:
+            assert len(set(tuple(ShardOwner(file, fcount, n) for fcount in range(20)) for file in roots)) == 1
+            assert len(set(tuple(ShardChunks(file, 20, (k, n)) for k in range(n)) for file in roots)) == 1
+    assert [ShardOwner(file, 0, 7) for file in ['a.csv', 'b.csv', 'data.csv']] != [ShardOwner('a.csv', 0, 7)] * 3
+
+def test_run_dedup_is_not_sharded(tmp_path):
+    config = {'OUTPUTDIR' : str(tmp_path), 'SHARD' : '0/2', 'DEDUP' : 'run'}
+    with pytest.raises(Exception, match = 'SHARD'):
+        CheckpointFromConfig(config)
+    config['DEDUP'] = 'chunk'
+    assert CheckpointFromConfig(config).path == ShardManifestPath(config, (0, 2))
+
+def WriteShards(tmp_path, n, total, skip = (), extra = ()):
+    """Writes the manifests of the n shards of a run over one file of total chunks, leaving out the chunks in skip and writing the (shard, chunk) pairs in extra as well"""
+    file = str(tmp_path / 'data.csv')
+    with open(file, 'w') as f:
+        f.write('a,b\n1,2\n')
+    config = {'OUTPUTDIR' : str(tmp_path)}
+    for k in range(n):
+        checkpoint = Checkpoint(ShardManifestPath(config, (k, n)), (k, n))
+        checkpoint.begin(config, {'FILE' : file}, {})
+        for fcount in range(total):
+            if (checkpoint.owns(file, fcount) and fcount not in skip) or (k, fcount) in extra:
+                fname = os.path.join(str(tmp_path), ChunkName(file, fcount))
+                checkpoint.done(file, fname, fname, 10 * fcount, 10, 100)
+        checkpoint.total(file, total)
+    return file
+
+def test_merge_complete(tmp_path):
+    file = WriteShards(tmp_path, 3, 10)
+    merged, problems = MergeShards(ShardManifests([str(tmp_path)]))
+    assert problems == [] and merged['complete'] and merged['shards'] == 3
+    assert [c['chunk'] for c in merged['files'][file]['outputs']] == [ChunkName(file, fcount) for fcount in range(10)]
+    assert (merged['files'][file]['rows'], merged['files'][file]['triples']) == (100, 1000)
+
+def test_merge_reports_missing_chunks(tmp_path):
+    file = WriteShards(tmp_path, 3, 10, skip = (4,))
+    merged, problems = MergeShards(ShardManifests([str(tmp_path)]))
+    assert not merged['complete']
+    assert problems == ["Chunk {} of {} is missing from shard {}/3".format(ChunkName(file, 4), file, ShardOwner(file, 4, 3))]
+
+def test_merge_reports_duplicate_chunks(tmp_path):
+    file = str(tmp_path / 'data.csv')
+    other = (ShardOwner(file, 2, 2) + 1) % 2
+    WriteShards(tmp_path, 2, 6, extra = ((other, 2),))
+    merged, problems = MergeShards(ShardManifests([str(tmp_path)]))
+    assert not merged['complete']
+    assert len(problems) == 1 and "Chunk {} of {} was written by shards".format(ChunkName(file, 2), file) in problems[0]
+
+def test_merge_reports_missing_shards(tmp_path):
+    WriteShards(tmp_path, 3, 10)
+    os.remove(ShardManifestPath({'OUTPUTDIR' : str(tmp_path)}, (1, 3)))
+    merged, problems = MergeShards(ShardManifests([str(tmp_path)]))
+    assert "The manifest of shard 1/3 is missing" in problems
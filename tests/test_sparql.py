@@ -0,0 +1,99 @@
+import threading
+import http.server
+import urllib.parse
+
+import pytest
+import rdflib
+
+from schema_grapher.util.rdf import RenderTriples
+from schema_grapher.util.sparql import GraphStore
+
+class StubEndpoint(http.server.ThreadingHTTPServer):
+    """SPARQL endpoint that records the requests it is sent and answers the first fail of them with status"""
+
+    def __init__(self, fail = 0, status = 503):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.fail = fail
+        self.status = status
+        self.requests = []
+        self.lock = threading.Lock()
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.requests += [(self.path, self.headers['Content-Type'], body.decode('utf-8'))]
+            failed = len(self.server.requests) <= self.server.fail
+        self.send_response(self.server.status if failed else 204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def endpoint(request):
+    server = StubEndpoint(*getattr(request, 'param', ()))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+TRIPLES = [('<http://s/%d>' % n, '<http://p>', '"value %d"' % n) for n in range(25)]
+
+def Load(store, rows):
+    """Writes rows of triples to the output of a chunk like WritePlan, an empty row as a blank line"""
+    f = store.open('chunk_0.nt')
+    for row in rows:
+        f.write_triples(row, RenderTriples)
+    f.write(RenderTriples([]))
+    f.close()
+    store.close()
+
+def Parsed(text):
+    g = rdflib.Graph()
+    g.parse(data = text, format = 'nt')
+    return len(g)
+
+def test_graphstore_protocol(endpoint):
+    store = GraphStore('http://127.0.0.1:{}/ds/data'.format(endpoint.server_port), graph = 'http://g', batch = 10, concurrency = 1)
+    Load(store, [TRIPLES[:4], [], TRIPLES[4:12], [], [], TRIPLES[12:]])
+    assert [urllib.parse.parse_qs(urllib.parse.urlparse(p).query) for p, _, _ in endpoint.requests] == [{'graph' : ['http://g']}] * 2
+    assert set(t for _, t, _ in endpoint.requests) == {'application/n-triples'}
+    # batches close at the first row that fills them, blank lines are not counted as triples
+    assert [Parsed(b) for _, _, b in endpoint.requests] == [12, 13]
+
+def test_blank_lines_are_not_triples(endpoint):
+    store = GraphStore('http://127.0.0.1:{}/ds/data'.format(endpoint.server_port), batch = 3, concurrency = 1)
+    f = store.open('chunk_0.nt')
+    f.write(RenderTriples(TRIPLES[:2]) + RenderTriples([]) + RenderTriples([]))
+    f.write(RenderTriples(TRIPLES[2:3]))
+    f.close()
+    store.close()
+    assert [Parsed(b) for _, _, b in endpoint.requests] == [3]
+
+def test_update_protocol(endpoint):
+    store = GraphStore('http://127.0.0.1:{}/ds/update'.format(endpoint.server_port), protocol = 'update', batch = 100, concurrency = 1)
+    Load(store, [TRIPLES, []])
+    assert len(endpoint.requests) == 1
+    path, ctype, body = endpoint.requests[0]
+    assert (path, ctype) == ('/ds/update', 'application/sparql-update')
+    g = rdflib.Graph()
+    g.update(body)
+    assert len(g) == len(TRIPLES)
+
+@pytest.mark.parametrize('endpoint', [(2,)], indirect = True)
+def test_retries(endpoint):
+    store = GraphStore('http://127.0.0.1:{}/ds/data'.format(endpoint.server_port), batch = 100, concurrency = 1, retries = 2, backoff = 0.01)
+    Load(store, [TRIPLES])
+    assert [Parsed(b) for _, _, b in endpoint.requests] == [len(TRIPLES)] * 3
+
+@pytest.mark.parametrize('endpoint', [(3,), (1, 400)], indirect = True)
+def test_failed_batch_fails_the_chunk(endpoint):
+    store = GraphStore('http://127.0.0.1:{}/ds/data'.format(endpoint.server_port), batch = 100, concurrency = 1, retries = 2, backoff = 0.01)
+    with pytest.raises(Exception, match = 'chunk_0.nt'):
+        Load(store, [TRIPLES])
+    assert len(endpoint.requests) == (3 if endpoint.status == 503 else 1)
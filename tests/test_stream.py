@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from schema_grapher.parser.single import ParseConfigSingle
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'schema_grapher')
+
+def Stream(small_run, config, *args, **kwargs):
+    """Starts the CLI streaming the CSV of small_run with config and returns the process"""
+    env = dict(os.environ, PYTHONPATH = os.path.dirname(os.path.dirname(SCRIPT)))
+    command = [sys.executable, SCRIPT, '--stream', '-i', config, '--spec', os.path.join(small_run.directory, 'spec.json')] + list(args)
+    return subprocess.Popen(command, env = env, stdout = subprocess.PIPE, stderr = subprocess.PIPE, **kwargs)
+
+@pytest.mark.parametrize('args', [[], ['--multiprocess'], ['--multiprocess', '--input', None]], ids = ['single', 'multi', 'multi-input'])
+def test_stream_equals_the_single_run(small_run, args):
+    config = small_run.config()
+    ParseConfigSingle(config)
+    expected = small_run.output()
+    args = [small_run.file if a is None else a for a in args]
+    if '--input' in args:
+        process = Stream(small_run, config, *args)
+    else:
+        process = Stream(small_run, config, '--name', 'data', *args, stdin = open(small_run.file, 'rb'))
+    out, err = process.communicate(timeout = 120)
+    assert process.returncode == 0, err.decode('utf-8')
+    # the batches of the workers are written in input order, so the stream is the chunks of the single run one after another
+    assert out.decode('utf-8').splitlines() == expected
+
+@pytest.mark.parametrize('args', [[], ['--multiprocess']], ids = ['single', 'multi'])
+def test_stream_stops_when_the_output_is_closed(small_run, args):
+    # far more triples than a pipe holds, so the stream is still writing when the reader goes away
+    with open(small_run.file) as f:
+        header = f.readline()
+        rows = f.read()
+    big = os.path.join(small_run.directory, 'big.csv')
+    with open(big, 'w') as f:
+        f.write(header + rows * 200)
+    process = Stream(small_run, small_run.config(), '--input', big, *args)
+    first = process.stdout.readline()
+    process.stdout.close()
+    err = process.stderr.read().decode('utf-8')
+    assert process.wait(timeout = 120) == 0, err
+    assert first.startswith(b'<') and 'Output closed, stopping the stream' in err
+    assert 'Streamed' not in err